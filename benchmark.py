@@ -0,0 +1,130 @@
+import random
+import time
+from threading import Lock
+
+import config
+
+
+class ParserStats:
+    """
+    Parse times of the files handled by a parser. The percentiles are computed on a uniform random sample
+    of at most benchmark_reservoir_size parse times (reservoir sampling), so the memory used is bounded
+    """
+
+    def __init__(self):
+        self.times = []
+        self.files = 0
+        self.parse_time = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, elapsed: float):
+        self.files += 1
+        self.parse_time += elapsed
+
+        if len(self.times) < config.benchmark_reservoir_size:
+            self.times.append(elapsed)
+        else:
+            i = random.randrange(self.files)
+            if i < len(self.times):
+                self.times[i] = elapsed
+
+    def percentile(self, p: float) -> float:
+        times = sorted(self.times)
+        return times[int(round(p * (len(times) - 1)))] if times else 0
+
+
+class Benchmark:
+    """
+    Collects the parse times of a dry-run crawl. Documents are discarded instead of being indexed.
+    Only a random sample of the files can be parsed, the total crawl time is projected from the sample
+    """
+
+    def __init__(self, sample_ratio: float = 1):
+        """
+        :param sample_ratio: ratio of the files that are parsed, between 0 and 1
+        """
+        self.sample_ratio = sample_ratio
+
+        self.parsers = {}  # parser name -> ParserStats
+        self.lock = Lock()
+        self.walked_files = 0
+        self.sampled_files = 0
+
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        self.start_time = time.time()
+
+    def stop(self):
+        self.end_time = time.time()
+
+    def sample(self) -> bool:
+        """
+        Called for each file found by the walk
+        :return: True if the file should be parsed
+        """
+
+        self.walked_files += 1
+        if self.sample_ratio >= 1 or random.random() < self.sample_ratio:
+            self.sampled_files += 1
+            return True
+        return False
+
+    def record(self, parser: str, elapsed: float, size: int, parsed: bool):
+        """
+        Record the parsing of a file
+        :param parser: name of the parser
+        :param elapsed: parse time, in seconds
+        :param size: size of the file
+        :param parsed: False if the parser failed
+        """
+
+        with self.lock:
+            stats = self.parsers.get(parser)
+            if stats is None:
+                stats = self.parsers[parser] = ParserStats()
+
+            stats.add(elapsed)
+            stats.bytes += size
+            if not parsed:
+                stats.errors += 1
+
+    def index(self, docs: list, directory: int):
+        """Stands in for the Indexer, the documents are dropped"""
+        return []
+
+    def delete(self, doc_ids: list):
+        pass
+
+    def report(self, timed_out_files: int = 0) -> dict:
+        """
+        :param timed_out_files: number of files that exceeded the time budget of their parser
+        :return: results of the benchmark
+        """
+
+        elapsed = (self.end_time or time.time()) - self.start_time
+
+        parsers = {}
+        for name, stats in self.parsers.items():
+            parsers[name] = {
+                "files": stats.files,
+                "errors": stats.errors,
+                "bytes": stats.bytes,
+                "parse_time": stats.parse_time,
+                "files_per_sec": stats.files / elapsed if elapsed > 0 else 0,
+                "bytes_per_sec": stats.bytes / elapsed if elapsed > 0 else 0,
+                "p50": stats.percentile(0.5),
+                "p99": stats.percentile(0.99),
+            }
+
+        return {
+            "sample_ratio": self.sample_ratio,
+            "walked_files": self.walked_files,
+            "sampled_files": self.sampled_files,
+            "timed_out_files": timed_out_files,
+            "elapsed": elapsed,
+            "projected_time": elapsed * self.walked_files / self.sampled_files if self.sampled_files else 0,
+            "parsers": parsers,
+        }
@@ -5,16 +5,52 @@ default_options = {
     "ThumbnailColor": "FF00FF",
     "TextFileContentLength": "2000",
     "PdfFileContentLength": "2000",
+    # layout, or fast to extract the text as it is drawn, without layout analysis (much faster, but the text of
+    # columns and tables may be mixed up)
+    "PdfTextMode": "layout",
+    "PdfMaxPages": "0",  # Maximum number of pages read from a PDF, 0 for no limit
     "DocxContentLength": "2000",
     "SpreadSheetContentLength": "2000",
     "EbookContentLength": "2000",
     "MimeGuesser": "extension",  # extension, content
-    "CheckSumCalculators": "",  # md5, sha1, sha256
-    "FileParsers": "media, text, picture, font, pdf, docx, spreadsheet, ebook"
+    # md5, sha1, sha256, fingerprint (fast, from samples of the files: the sha256 checksum is only calculated for
+    # the files with the same fingerprint, after the crawl)
+    "CheckSumCalculators": "",
+    "FileParsers": "media, text, picture, font, pdf, docx, spreadsheet, ebook",
+    "Watch": "0",  # 1 to keep the index up to date with inotify (Linux only)
+    "BenchmarkSample": "1",  # Ratio of the files parsed by benchmark tasks, between 0 and 1
+    # Files and directories that are not crawled, comma separated. Glob patterns match names (or relative paths if
+    # they contain a /), patterns starting with re: are regular expressions. Example: .git, node_modules, re:^tmp/
+    "Exclude": "",
+    "MaxDepth": "",  # Depth of the deepest crawled directories (0: only the root), empty for no limit
+    "MaxFileSize": "0",  # Size (in bytes) of the largest crawled files, 0 for no limit
+    "OneFileSystem": "0",  # 1 to skip the file systems mounted inside the directory
+    # Listing of the files to crawl instead of walking the directory, one file per line:
+    # path<TAB>size<TAB>mtime[<TAB>inode] such as the output of find -type f -printf '%p\t%s\t%T@\t%i\n'
+    "Listing": "",
+    "MaxReadRate": "0",  # Bytes of files read per second by crawls, 0 for no limit
+    "MaxFileRate": "0",  # Files parsed per second by crawls, 0 for no limit
+    "MaxIndexRate": "0",  # Documents indexed per second by crawls, 0 for no limit
+    "AdaptiveThrottle": "0",  # 1 to slow crawls down while the searches are slow or elasticsearch is overloaded
 }
 
 # Index documents after every X parsed files (Larger number will use more memory)
 index_every = 10000
+# ... or once the parsed documents reach X bytes
+index_batch_bytes = 32 * 1024 * 1024
+# Maximum size (in bytes) of the parsed documents waiting to be indexed. The parsers wait when indexing
+# falls behind
+max_pending_bytes = 128 * 1024 * 1024
+# The parsers also wait while the crawl process uses more than X bytes of memory (RSS), 0 for no limit
+crawl_memory_limit = 0
+# ... except while the parsed documents held are smaller than X bytes, so that they are still indexed in batches
+index_min_batch_bytes = 1024 * 1024
+# Seconds without new documents after which the indexer indexes a partial batch if parsers are waiting
+index_flush_wait = 0.1
+# A batch of documents that elasticsearch failed to index is retried X times, after index_retry_delay seconds
+# doubled after each attempt, and then dropped (the files are parsed again if the crawl is resumed from its journal)
+index_retries = 3
+index_retry_delay = 1
 
 # See https://www.elastic.co/guide/en/elasticsearch/reference/current/analysis-ngram-tokenizer.html#_configuration_16
 nGramMin = 3
@@ -26,16 +62,142 @@ elasticsearch_index = "sist"
 bcrypt_rounds = 13
 # sqlite3 database path
 db_path = "./local_storage.db"
+# sqlite3 database where the results of the parsers are cached, set to None to disable the cache
+parse_cache_path = "./parse_cache.db"
+# Results not used for X seconds are removed from the cache, and the least recently used results are removed
+# once it holds more than Y results. The cache is pruned every Z results added
+parse_cache_max_age = 90 * 24 * 3600
+parse_cache_max_entries = 1000000
+parse_cache_prune_interval = 10000
 
 # Set to true to allow guests to search any directory
 allow_guests = True
 
+# Tell the kernel how the crawled files are read (Linux only): the files are read ahead, and the pages read by
+# the crawl are dropped from the page cache once they are parsed so that crawls don't evict the cached files of
+# other programs. Pages that were cached before the crawl are kept
+fadvise = True
+# Bytes read ahead of the position of sequential reads
+fadvise_readahead = 8 * 1024 * 1024
+
+# Size (in bytes) of the blocks read to calculate checksums. All the checksums of a file are calculated from
+# the same blocks
+checksum_block_size = 1024 * 1024
+# Size (in bytes) of the start, middle and end samples of the fingerprint checksum
+fingerprint_sample_size = 64 * 1024
+
+# Once X text files of a directory needed chardet to find their encoding, and a ratio of Y of them have the same
+# encoding, the following files are decoded with this encoding before trying chardet
+encoding_stats_min_files = 100
+encoding_stats_ratio = 0.9
+
 # Number of threads used for parsing
 parse_threads = 32
 
+# Number of threads used to list directories during a crawl
+walk_threads = 8
+
+# Number of processes used for parsing. Set to 0 to parse with parse_threads threads in the crawler process
+# instead (Parsers written in pure python will only use one CPU core)
+parse_processes = 0
+
+# Number of files sent to a parsing process at once
+parse_batch_size = 64
+
+# Adjust the number of parse and thumbnail threads while a task runs to maximise the number of files processed
+# per second. parse_threads and tn_threads are then used as the initial number of threads
+autotune_threads = True
+# Seconds between adjustments
+autotune_interval = 5
+autotune_max_threads = 128
+# Don't add threads when the CPU usage or the I/O wait (ratio of the total CPU time) is above these values
+autotune_max_cpu = 0.95
+autotune_max_iowait = 0.5
+
+# Parsers that get their own queue and a fixed number of threads (with parse_processes, the maximum number of
+# processes working on their files), so that slow parsers can't keep the threads of the other parsers busy.
+# The other parsers share the parse_threads threads
+parser_lanes = {
+    "MediaFileParser": 4,
+    "PdfFileParser": 8,
+}
+
+# Maximum number of files read at the same time from each device, by kind of device. Reading many files at
+# once from a hard disk makes it seek between them. Network and virtual file systems use the value of other.
+# A slot is held while a parser has a file open, not during the rest of the parse
+device_queue_depths = {
+    "rotational": 4,
+    "ssd": 32,
+    "other": 16,
+}
+
+# Maximum time (in seconds) spent parsing a single file. Files that take longer are skipped
+parse_timeout = 120
+
+# Per-parser overrides of parse_timeout
+parser_timeouts = {
+    "MediaFileParser": 60,
+    "PdfFileParser": 300,
+}
+
+# Index the files of watched directories once no changes were seen for X seconds
+watch_debounce = 2
+# ... or at most X seconds after the first change
+watch_max_delay = 10
+
+# Parse hard links to the same file only once
+dedup_hard_links = True
+# Number of parse results kept in memory for the links that were not found yet. Links outside of the crawled
+# files are never found, older results are dropped and the file is parsed again if another link shows up
+link_cache_size = 10000
+# Number of parse results kept in memory to skip files with identical content (only used when checksums are
+# enabled). With parse_processes, each process keeps its own results
+dedup_cache_size = 10000
+# The parse time percentiles of benchmark tasks are computed on a random sample of X files per parser
+benchmark_reservoir_size = 10000
+
+# Distributed crawls: the directory is split into sub-trees that are crawled by worker processes. Workers on
+# other hosts (see crawl_worker.py) can take part if they mount the directory at the same path
+# sqlite3 database of the work units, it must be on storage shared by all the workers
+work_queue_path = "./work_queue.db"
+# Depth of the directories at the top of the sub-trees
+work_unit_depth = 2
+# Number of worker processes started on this host
+distributed_workers = 4
+# Units are handed out again if their worker didn't report for X seconds
+work_unit_lease = 60
+# Seconds between checks for new units when the queue is empty
+work_poll_interval = 5
+
+# Crawls with the AdaptiveThrottle option slow down while the average search time is above X seconds
+throttle_max_search_latency = 0.5
+# Searches older than X seconds are ignored
+throttle_latency_window = 30
+# Seconds between adjustments of the crawl rate limits
+throttle_check_interval = 2
+
 # Number of threads used for thumbnail generation
 tn_threads = 32
 
+# Maximum number of tasks running at the same time. Tasks of the same directory always run one after the other
+max_running_tasks = 4
+# Maximum number of running tasks on directories of the same device (0 for no limit)
+max_tasks_per_device = 1
+# Don't start another task while the CPU usage or the I/O wait (ratio of the total CPU time) is above these values
+task_max_cpu = 0.9
+task_max_iowait = 0.5
+# Tasks are started as soon as they are added. Seconds between checks of the tasks waiting for resources
+# and of the watched directories
+task_check_interval = 5
+# Tasks whose process stopped unexpectedly are restarted after X seconds, doubled after each attempt...
+task_retry_delay = 10
+# ... and marked as failed after X attempts. Failed tasks are paused until they are resumed
+task_max_attempts = 5
+# Seconds between progress updates sent to the task page
+progress_interval = 1
+# ... on a connection that is closed after X seconds (the page reconnects)
+progress_stream_duration = 300
+
 
 try:
     import cairosvg
@@ -0,0 +1,12 @@
+import sys
+
+import config
+from crawler import CrawlWorker
+from storage import WorkQueue
+
+# Worker of distributed crawls, can run on any host that mounts the crawled directories at the same path
+# and has access to the work queue database and to elasticsearch.
+# Usage: python crawl_worker.py [work queue database]
+
+if __name__ == "__main__":
+    CrawlWorker(WorkQueue(sys.argv[1] if len(sys.argv) > 1 else config.work_queue_path)).run()
@@ -1,21 +1,29 @@
 import json
 import os
 import shutil
-from multiprocessing import Process, Value
-from queue import Queue, Empty, Full
-from threading import Thread
-
-from apscheduler.schedulers.background import BackgroundScheduler
+import signal
+import socket
+import time
+from collections import OrderedDict, deque
+from multiprocessing import Process, Value, Pool
+from multiprocessing.connection import wait
+from queue import Queue, Full, Empty
+from threading import Thread, Condition, Lock, Event, current_thread
 
 import config
+import fileio
+from benchmark import Benchmark
 from indexer import Indexer
 from parsing import GenericFileParser, Md5CheckSumCalculator, ExtensionMimeGuesser, MediaFileParser, TextFileParser, \
     PictureFileParser, Sha1CheckSumCalculator, Sha256CheckSumCalculator, ContentMimeGuesser, MimeGuesser, FontParser, \
-    PdfFileParser, DocxParser, EbookParser, SpreadSheetParser
+    PdfFileParser, DocxParser, EbookParser, SpreadSheetParser, FingerprintCheckSumCalculator
 from search import Search
 from storage import Directory
-from storage import Task, LocalStorage
+from storage import Task, LocalStorage, ParseCache, WorkQueue
 from thumbnail import ThumbnailGenerator
+from tuning import ThreadCountTuner, ByteBudget, CrawlThrottle, RateLimiter, SearchLatency, DeviceSlots, read_cpu_times, cpu_load
+from walker import Walker, WalkFilter, split_tree, read_listing
+from watcher import DirectoryWatcher
 
 
 class RunningTask:
@@ -23,23 +31,171 @@ class RunningTask:
     def __init__(self, task: Task):
         self.total_files = Value("i", 0)
         self.parsed_files = Value("i", 0)
+        self.workers = Value("i", 0)
         self.task = task
         self.done = Value("i", 0)
+        self.parse_queue = Value("i", 0)  # Files waiting for the parsers
+        self.index_queue = Value("i", 0)  # Documents waiting for the indexer
+        self.process = None
+
+        self.samples = deque()  # (time, parsed files) of the last few seconds
+        self.samples_lock = Lock()
+
+    def rate(self) -> float:
+        """Get the number of files processed per second over the last few seconds"""
+
+        now = time.time()
+        parsed = self.parsed_files.value
+
+        with self.samples_lock:
+            if not self.samples or now - self.samples[-1][0] >= 1:
+                self.samples.append((now, parsed))
+            while len(self.samples) > 1 and now - self.samples[0][0] > 10:
+                self.samples.popleft()
+            start_time, start_parsed = self.samples[0]
+
+        if now <= start_time:
+            return 0
+        return (parsed - start_parsed) / (now - start_time)
+
+    def to_dict(self):
+        rate = self.rate()
+        remaining = self.total_files.value - self.parsed_files.value
+
+        return {"parsed": self.parsed_files.value, "total": self.total_files.value,
+                "workers": self.workers.value, "id": self.task.id, "rate": round(rate, 1),
+                "eta": int(remaining / rate) if rate > 0 else None,
+                "parse_queue": self.parse_queue.value, "index_queue": self.index_queue.value}
 
     def to_json(self):
-        return json.dumps({"parsed": self.parsed_files.value, "total": self.total_files.value, "id": self.task.id})
+        return json.dumps(self.to_dict())
+
+
+class DeviceQueue(Queue):
+    """
+    Queue of files kept per device. The devices are taken in turn, and the devices whose slots are all used
+    are skipped while the files of other devices are waiting
+    """
+
+    def __init__(self, maxsize: int = 0, is_free=None):
+        """
+        :param is_free: function telling if a device (st_dev) has a free slot
+        """
+        self.is_free = is_free
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.devices = OrderedDict()  # st_dev -> deque of (path, stat result, mime) tuples
+        self.sentinels = deque()
+
+    def _qsize(self):
+        return sum(len(files) for files in self.devices.values()) + len(self.sentinels)
+
+    def _put(self, item):
+        if item is None:
+            self.sentinels.append(item)
+        else:
+            self.devices.setdefault(item[1].st_dev, deque()).append(item)
+
+    def _get(self):
+        for st_dev in self.devices:
+            if self.is_free is None or self.is_free(st_dev):
+                break
+        else:
+            st_dev = next(iter(self.devices), None)
+
+        if st_dev is None:
+            return self.sentinels.popleft()
+
+        files = self.devices[st_dev]
+        item = files.popleft()
+        if files:
+            self.devices.move_to_end(st_dev)
+        else:
+            del self.devices[st_dev]
+        return item
+
+
+class ParseLane:
+    """
+    Queue of the files handled by a group of parsers, and the threads parsing them
+    """
+
+    def __init__(self, name: str, thread_count: int, is_free=None):
+        """
+        :param is_free: function telling if a device (st_dev) has a free slot, see DeviceQueue
+        """
+        self.name = name
+        self.in_q = DeviceQueue(50000, is_free)  # TODO: get from config?
+        self.threads = []
+        self.thread_count = thread_count
+        self.tuner = None
 
 
 class Crawler:
 
     def __init__(self, enabled_parsers: list, mime_guesser: MimeGuesser = ExtensionMimeGuesser(), indexer=None,
                  dir_id=0,
-                 root_dir="/"):
+                 root_dir="/", known_files: dict = None, storage: LocalStorage = None, task_id: int = None,
+                 parse_cache: ParseCache = None, benchmark: Benchmark = None, max_depth: int = None,
+                 walk_filter: WalkFilter = None, listing: str = None, throttle: CrawlThrottle = None):
         self.documents = []
+        self.documents_size = 0
         self.enabled_parsers = enabled_parsers
         self.indexer = indexer
         self.dir_id = dir_id
         self.root_dir = root_dir
+        self.max_depth = max_depth
+        self.walk_filter = walk_filter
+        # Files are read from this listing instead of walking the directory, see read_listing()
+        self.listing = listing
+
+        # Files already in the index (relative path -> state), only used for incremental crawls
+        self.known_files = known_files
+        self.outdated_docs = []
+        self.outdated_lock = Lock()
+
+        # Indexed files are recorded in the task's journal so that the crawl can be resumed
+        self.storage = storage
+        self.task_id = task_id
+        self.journaled_files = set()
+
+        self.parse_cache = parse_cache
+
+        # Parse times are recorded for dry-run crawls
+        self.benchmark = benchmark
+        # A benchmark parses every file, hard links and identical files included, so that all the parse times count
+        self.dedup = benchmark is None
+        # Limits the rate of the crawl
+        self.throttle = throttle
+        # Set to stop the walk, the files that were already walked are still parsed and indexed
+        self.stopped = Event()
+
+        # Hard links are parsed once, (st_dev, st_ino) -> paths waiting for the result of the first link
+        self.pending_links = {}
+        # (st_dev, st_ino) -> (parsed document, number of links not seen yet), least recently used first.
+        # Links outside of the crawled files are never seen, the oldest results are dropped
+        self.link_docs = OrderedDict()
+        self.link_lock = Lock()
+        # Results of the parsers for files with identical content, (parser, size, checksums) -> document
+        self.content_docs = OrderedDict()
+        self.content_lock = Lock()
+        self.out_q = None
+        # Approximate size of the parsed documents that are not indexed yet
+        self.pending_size = None
+
+        # Shared counters of the files waiting for the parsers and the documents waiting for the indexer
+        self.parse_queue = None
+        self.index_queue = None
+
+        # Files that exceeded the time budget of their parser
+        self.timed_out_files = []
+        self.parse_lock = Lock()
+        self.lane_sizes = {}  # lane name -> number of workers, see get_lane()
+        self.lanes = {}  # lane name -> ParseLane, see parse_with_threads()
+        self.in_progress = {}  # thread -> (deadline, path, stat result, lane)
+        # Limits the files read at the same time from each device, the parsers take the slots in fileio
+        self.device_slots = DeviceSlots()
 
         for parser in self.enabled_parsers:
             if parser.is_default:
@@ -52,43 +208,455 @@ class Crawler:
                 self.ext_map[ext] = parser
 
         self.mime_guesser = mime_guesser
+        self.extension_guesser = ExtensionMimeGuesser()
 
-    def crawl(self, root_dir: str, counter: Value = None, total_files=None):
+    def crawl(self, root_dir: str, counter: Value = None, total_files=None, workers: Value = None,
+              parse_queue: Value = None, index_queue: Value = None):
 
-        in_q = Queue(50000)  # TODO: get from config?
-        out_q = Queue()
+        if self.storage is not None:
+            self.journaled_files = self.storage.journal(self.task_id)
+            if self.journaled_files:
+                print("Resuming crawl, %d files already indexed" % (len(self.journaled_files),))
 
-        threads = []
-        print("Creating %d threads" % (config.parse_threads,))
-        for _ in range(config.parse_threads):
-            t = Thread(target=self.parse_file, args=[in_q, out_q, ])
-            threads.append(t)
-            t.start()
+        out_q = Queue()
+        self.out_q = out_q
+        # A full batch of documents must fit in the budget, or the parsers would wait for a batch that is never sent
+        self.pending_size = ByteBudget(max(config.max_pending_bytes, config.index_batch_bytes),
+                                       config.crawl_memory_limit, config.index_min_batch_bytes)
+        self.parse_queue = parse_queue
+        self.index_queue = index_queue
 
         indexer_thread = Thread(target=self.index_file, args=[out_q, counter, ])
         indexer_thread.start()
 
-        for root, dirs, files in os.walk(root_dir):
-            for filename in files:
-                while True:
-                    try:
-                        in_q.put(os.path.join(root, filename), timeout=10)
-                        if total_files:
-                            total_files.value += 1
-                        break
-                    except Full:
-                        continue
-
-        in_q.join()
-        out_q.join()
+        enabled = set(type(parser).__name__ for parser in self.enabled_parsers)
+        self.lane_sizes = {name: max(1, size) for name, size in config.parser_lanes.items() if name in enabled}
 
-        for _ in threads:
-            in_q.put(None)
-        out_q.put(None)
+        # The parsers take the slots of the devices and are charged the bytes they read in fileio
+        device_slots, read_limiter = fileio.device_slots, fileio.read_limiter
+        fileio.device_slots = self.device_slots
+        fileio.read_limiter = self.throttle.bytes if self.throttle is not None else None
+
+        try:
+            if config.parse_processes > 0:
+                if workers:
+                    workers.value = config.parse_processes
+                self.parse_with_processes(root_dir, out_q, total_files)
+            else:
+                self.parse_with_threads(root_dir, out_q, total_files, workers)
+        finally:
+            fileio.device_slots, fileio.read_limiter = device_slots, read_limiter
 
+        out_q.join()
+        out_q.put(None)
         indexer_thread.join()
-        for t in threads:
-            t.join()
+
+        if self.known_files is not None:
+            self.delete_outdated()
+
+    def walk(self, root_dir: str, total_files: Value = None):
+        """
+        Walk a directory and yield every file that needs to be parsed
+        :param root_dir: root directory of the crawl
+        :param total_files: counter of files to parse
+        :return: generator of (path, stat result) tuples
+        """
+
+        if self.listing is not None:
+            files = read_listing(self.listing, root_dir, self.walk_filter)
+        else:
+            files = Walker(max_depth=self.max_depth, walk_filter=self.walk_filter).walk(root_dir)
+
+        for full_path, file_stat in files:
+
+            if self.stopped.is_set():
+                # Stops the threads of the walker
+                files.close()
+                break
+
+            if self.journaled_files:
+                # Journaled paths are relative to the directory, the crawl may be limited to a sub-tree
+                rel_path = os.path.relpath(full_path, self.default_parser.root_dir)
+                if rel_path in self.journaled_files:
+                    if self.known_files is not None:
+                        self.known_files.pop(rel_path, None)
+                    continue
+
+            if self.known_files is not None and self.is_unchanged(full_path, root_dir, file_stat):
+                continue
+
+            if self.benchmark is not None and not self.benchmark.sample():
+                continue
+
+            if total_files:
+                total_files.value += 1
+
+            if self.dedup and config.dedup_hard_links and file_stat.st_nlink > 1 and \
+                    self.is_linked(full_path, file_stat):
+                continue
+
+            if self.throttle is not None:
+                self.throttle.parse()
+
+            yield full_path, file_stat
+
+    def is_linked(self, full_path: str, file_stat: os.stat_result) -> bool:
+        """
+        Check if another hard link to the same file was already sent to the parsers. The document
+        of the file is then created from the result of the first link
+        :return: True if the file doesn't need to be parsed
+        """
+
+        key = (file_stat.st_dev, file_stat.st_ino)
+
+        with self.link_lock:
+            if key in self.pending_links:
+                self.pending_links[key].append((full_path, file_stat))
+                return True
+
+            if key not in self.link_docs:
+                self.pending_links[key] = []
+                return False
+
+            doc, remaining = self.link_docs[key]
+            if remaining > 1:
+                self.link_docs[key] = (doc, remaining - 1)
+                self.link_docs.move_to_end(key)
+            else:
+                del self.link_docs[key]
+
+        self.put_linked_doc(doc, full_path, file_stat)
+        return True
+
+    def put_linked_doc(self, doc, full_path: str, file_stat: os.stat_result):
+        if doc is not None:
+            linked_doc = dict(doc)
+            linked_doc.update(self.default_parser.file_info(full_path, file_stat))
+            self.send_document(linked_doc)
+
+    def send_document(self, doc: dict):
+        """
+        Send a document to the indexer. Waits while too many documents are waiting
+        to be indexed, which slows the parsers down when indexing falls behind
+        """
+
+        size = document_size(doc)
+        self.pending_size.acquire(size)
+        self.out_q.put((doc, size))
+
+    def on_parsed(self, full_path: str, file_stat: os.stat_result, doc):
+        """
+        Send a parsed document to the indexer, along with the documents of the other hard links to the file
+        :param doc: parsed document, None if the file couldn't be parsed
+        """
+
+        if doc is not None:
+            self.send_document(doc)
+
+        for linked_path, linked_stat in self.pop_links(file_stat, doc):
+            self.put_linked_doc(doc, linked_path, linked_stat)
+
+    def on_timeout(self, full_path: str, file_stat: os.stat_result):
+        """
+        Give up on a file that exceeded the time budget of its parser, along with the other hard links to the file
+        """
+
+        self.record_timeout(full_path)
+        for linked_path, _ in self.pop_links(file_stat, None):
+            self.record_timeout(linked_path)
+
+    def pop_links(self, file_stat: os.stat_result, doc) -> list:
+        """
+        Get the hard links waiting for the result of the file that was parsed, and keep the result
+        for the links that the walk didn't reach yet
+        :param doc: parsed document, None if the file couldn't be parsed
+        :return: list of (path, stat result) tuples
+        """
+
+        if not (self.dedup and config.dedup_hard_links) or file_stat is None or file_stat.st_nlink <= 1:
+            return []
+
+        key = (file_stat.st_dev, file_stat.st_ino)
+
+        with self.link_lock:
+            waiting = self.pending_links.pop(key, [])
+
+            remaining = file_stat.st_nlink - 1 - len(waiting)
+            if remaining > 0:
+                self.link_docs[key] = (None if doc is None else dict(doc), remaining)
+                if len(self.link_docs) > config.link_cache_size:
+                    # The file is parsed again if another link to it is found
+                    self.link_docs.popitem(last=False)
+
+        return waiting
+
+    def get_lane(self, parser) -> str:
+        """Get the name of the lane of a parser, parsers without a lane of their own share the default lane"""
+        name = type(parser).__name__
+        return name if name in self.lane_sizes else "default"
+
+    def route(self, item: tuple):
+        """
+        Find the lane of a file. Files are routed by extension, on the walk thread. When the mime type
+        is guessed from the content, it is left to the parse workers so that the files aren't read serially
+        here; a file whose content doesn't match its extension is then parsed by the right parser in the
+        lane of its extension
+        :param item: (path, stat result) tuple
+        :return: (lane name, (path, stat result, mime or None)) tuple
+        """
+
+        full_path, file_stat = item
+
+        if not self.lane_sizes:
+            return "default", (full_path, file_stat, None)
+
+        mime = self.extension_guesser.guess_mime(full_path)
+        lane = self.get_lane(self.ext_map.get(mime, self.default_parser))
+
+        if not isinstance(self.mime_guesser, ExtensionMimeGuesser):
+            mime = None
+        return lane, (full_path, file_stat, mime)
+
+    def parse_with_threads(self, root_dir: str, out_q: Queue, total_files: Value = None, workers: Value = None):
+
+        self.lanes = {"default": ParseLane("default", config.parse_threads, self.device_slots.is_free)}
+        for name, thread_count in self.lane_sizes.items():
+            self.lanes[name] = ParseLane(name, thread_count, self.device_slots.is_free)
+
+        for lane in self.lanes.values():
+            print("Creating %d threads for %s parsers" % (lane.thread_count, lane.name))
+            self.resize_parse_threads(lane, lane.thread_count, out_q, workers)
+
+        # Only the shared lane is tuned, the other lanes keep the thread count they were given
+        default_lane = self.lanes["default"]
+        if config.autotune_threads:
+            default_lane.tuner = ThreadCountTuner(config.parse_threads, lambda count: self.resize_parse_threads(
+                default_lane, count, out_q, workers))
+            default_lane.tuner.start()
+
+        watchdog = Thread(target=self.watchdog, args=[out_q, ], daemon=True)
+        watchdog.start()
+
+        for item in self.walk(root_dir, total_files):
+            name, item = self.route(item)
+            in_q = self.lanes[name].in_q
+            while True:
+                try:
+                    in_q.put(item, timeout=10)
+                    break
+                except Full:
+                    continue
+
+        for lane in self.lanes.values():
+            lane.in_q.join()
+
+            if lane.tuner is not None:
+                lane.tuner.stop()
+                lane.tuner = None
+
+            with self.parse_lock:
+                threads = list(lane.threads)
+                lane.threads.clear()
+
+            for _ in threads:
+                lane.in_q.put(None)
+            for t in threads:
+                t.join()
+
+    def resize_parse_threads(self, lane: ParseLane, count: int, out_q: Queue, workers: Value = None):
+        """
+        Set the number of parse threads of a lane. Extra threads exit after parsing their current file
+        """
+
+        with self.parse_lock:
+            lane.thread_count = count
+            while len(lane.threads) < count:
+                self.start_parse_thread(lane, out_q)
+
+            if workers:
+                workers.value = sum(l.thread_count for l in self.lanes.values())
+
+    def start_parse_thread(self, lane: ParseLane, out_q: Queue):
+        # Abandoned threads may never return, they must not keep the process alive
+        t = Thread(target=self.parse_file, args=[lane, out_q, ], daemon=True)
+        lane.threads.append(t)
+        t.start()
+
+    def watchdog(self, out_q: Queue):
+        """
+        Abandon the parse threads that exceeded the time budget of their parser and start new
+        threads to replace them. Running python threads can't be killed, the abandoned thread
+        exits and its result is discarded whenever the parser returns
+        """
+
+        while True:
+            time.sleep(1)
+            timed_out = []
+
+            with self.parse_lock:
+                if not any(lane.threads for lane in self.lanes.values()):
+                    break
+
+                if self.parse_queue:
+                    self.parse_queue.value = sum(lane.in_q.qsize() for lane in self.lanes.values())
+
+                now = time.time()
+                for t, (deadline, full_path, file_stat, lane) in list(self.in_progress.items()):
+                    if now > deadline:
+                        del self.in_progress[t]
+                        lane.threads.remove(t)
+                        # The abandoned thread may never return, its replacement takes its device slots
+                        self.device_slots.release_thread(t)
+                        timed_out.append((full_path, file_stat, lane))
+
+                        self.start_parse_thread(lane, out_q)
+
+            # The file is done before task_done() so that the crawl doesn't end with links waiting for it
+            for full_path, file_stat, lane in timed_out:
+                self.on_timeout(full_path, file_stat)
+                lane.in_q.task_done()
+
+    def record_timeout(self, full_path: str):
+        print("Parsing timed out: " + full_path)
+        self.timed_out_files.append(full_path)
+
+    def get_timeout(self, parser) -> float:
+        """Get the time budget (in seconds) of a parser for a single file"""
+        return config.parser_timeouts.get(type(parser).__name__, config.parse_timeout)
+
+    def parse_with_processes(self, root_dir: str, out_q: Queue, total_files: Value = None):
+        """
+        Parse files in a pool of worker processes. Paths are sent to the workers in batches
+        and the parsed documents are streamed back to the indexer thread. The batches of the
+        parsers that have their own lane are limited to a number of workers. Batches hold the files of a single
+        device, the batches of the devices that have free slots are sent to the pool first
+        """
+
+        print("Creating %d processes" % (config.parse_processes,))
+
+        # A lane never has more batches in the pool than it may use workers. Full batches wait in the lane until
+        # it has room, so that a lane of slow parsers doesn't hold up the walk and the batches of the other lanes
+        lane_limits = {"default": config.parse_processes * 4}
+        for name, slots in self.lane_sizes.items():
+            lane_limits[name] = min(slots, config.parse_processes)
+        held = {name: deque() for name in lane_limits}  # lane name -> (st_dev, batch) tuples
+        in_pool = {name: 0 for name in lane_limits}
+        # The walk only waits when a lane holds as many files as the lane queues of parse_with_threads()
+        max_held = max(1, 50000 // config.parse_batch_size)
+        cond = Condition()
+
+        def dispatch():
+            """Send the held batches of the lanes that have room to the pool, cond must be held"""
+
+            for name, batches in held.items():
+                while batches and in_pool[name] < lane_limits[name]:
+                    # The workers would wait for the slots of a busy device, the other devices go first
+                    i = next((i for i, (device, _) in enumerate(batches) if self.device_slots.is_free(device)), 0)
+                    batch = batches[i][1]
+                    del batches[i]
+
+                    in_pool[name] += 1
+                    pool.apply_async(parse_batch, (batch,),
+                                     callback=lambda result, n=name: on_batch_parsed(n, result),
+                                     error_callback=lambda e, n=name, b=batch: on_batch_error(n, b, e))
+
+        def on_batch_done(name):
+            with cond:
+                in_pool[name] -= 1
+                dispatch()
+                cond.notify_all()
+
+        def on_batch_parsed(name, result):
+            parsed, timed_out_files = result
+            timed_out_files = set(timed_out_files)
+            for full_path, file_stat, doc, parser_name, elapsed in parsed:
+                if self.benchmark is not None and parser_name is not None:
+                    self.benchmark.record(parser_name, elapsed, file_stat.st_size, doc is not None)
+                if full_path in timed_out_files:
+                    self.on_timeout(full_path, file_stat)
+                else:
+                    self.on_parsed(full_path, file_stat, doc)
+            update_parse_queue(-len(parsed))
+            on_batch_done(name)
+
+        def on_batch_error(name, batch, e):
+            print("Error while parsing batch: " + str(e))
+            update_parse_queue(-len(batch))
+            on_batch_done(name)
+
+        def update_parse_queue(change):
+            if self.parse_queue:
+                with self.parse_queue.get_lock():
+                    self.parse_queue.value += change
+
+        def submit(name, device, batch):
+            update_parse_queue(len(batch))
+            with cond:
+                while len(held[name]) >= max_held:
+                    cond.wait()
+                held[name].append((device, batch))
+                dispatch()
+
+        pool = Pool(config.parse_processes, initializer=init_parse_worker,
+                    initargs=(self, fileio.read_limiter))
+
+        batches = {}  # (lane name, st_dev) -> files
+        for item in self.walk(root_dir, total_files):
+            name, item = self.route(item)
+            key = (name, item[1].st_dev)
+            batch = batches.setdefault(key, [])
+            batch.append(item)
+
+            if len(batch) == config.parse_batch_size:
+                submit(name, key[1], batch)
+                del batches[key]
+
+        for (name, device), batch in batches.items():
+            if batch:
+                submit(name, device, batch)
+
+        with cond:
+            while any(held.values()) or any(in_pool.values()):
+                cond.wait()
+
+        pool.close()
+        pool.join()
+
+    def is_unchanged(self, full_path: str, root_dir: str, file_stat: os.stat_result) -> bool:
+        """
+        Check if a file is already indexed with the same size, mtime and inode.
+        Indexed files that were modified are marked as outdated
+        :param full_path: path of the file
+        :param root_dir: root directory of the crawl
+        :param file_stat: stat result of the file
+        :return: True if the file doesn't need to be parsed again
+        """
+
+        known = self.known_files.pop(os.path.relpath(full_path, root_dir), None)
+
+        if known is None:
+            return False
+
+        # Files read from a listing may not have an inode
+        if file_stat.st_size == known["size"] and file_stat.st_mtime == known["mtime"] and \
+                (known["inode"] is None or not file_stat.st_ino or file_stat.st_ino == known["inode"]):
+            return True
+
+        with self.outdated_lock:
+            self.outdated_docs.append(known["id"])
+        return False
+
+    def delete_outdated(self):
+        """Delete the documents of modified files and of files that no longer exist"""
+
+        with self.outdated_lock:
+            for known in self.known_files.values():
+                self.outdated_docs.append(known["id"])
+            self.known_files.clear()
+
+            if self.indexer is not None and self.outdated_docs:
+                self.indexer.delete(self.outdated_docs)
+                self.outdated_docs = []
 
     def countFiles(self, root_dir: str):
         count = 0
@@ -98,109 +666,608 @@ class Crawler:
 
         return count
 
-    def parse_file(self, in_q: Queue, out_q: Queue):
+    def parse_file(self, lane: ParseLane, out_q: Queue):
+
+        current = current_thread()
+        in_q = lane.in_q
 
         while True:
-            try:
-                full_path = in_q.get(timeout=1)
-                if full_path is None:
-                    break
-            except Empty:
+            item = in_q.get()
+            if item is None:
+                in_q.task_done()
                 break
 
+            full_path, file_stat, mime = item
+            doc = None
+            parser = None
+            start = time.time()
+
             try:
-                mime = self.mime_guesser.guess_mime(full_path)
-                parser = self.ext_map.get(mime, self.default_parser)
+                mime, parser = self.guess_parser(full_path, mime)
+
+                with self.parse_lock:
+                    self.in_progress[current] = (time.time() + self.get_timeout(parser), full_path, file_stat, lane)
 
-                doc = parser.parse(full_path)
-                doc["mime"] = mime
-                out_q.put(doc)
+                start = time.time()
+                doc = self.run_parser(parser, mime, full_path, file_stat)
             except:
                 pass
-            finally:
-                in_q.task_done()
+
+            with self.parse_lock:
+                # The watchdog already gave up on this file, released the device slots and replaced the thread
+                if current not in self.in_progress and current not in lane.threads:
+                    break
+                self.in_progress.pop(current, None)
+
+                retire = len(lane.threads) > lane.thread_count
+                if retire:
+                    lane.threads.remove(current)
+
+            if self.benchmark is not None and parser is not None:
+                self.benchmark.record(type(parser).__name__, time.time() - start, file_stat.st_size, doc is not None)
+
+            self.on_parsed(full_path, file_stat, doc)
+            if lane.tuner is not None:
+                lane.tuner.done()
+            in_q.task_done()
+
+            if retire:
+                break
+
+    def guess_parser(self, full_path: str, mime: str = None):
+        """
+        Get the parser matching the mime type of a file
+        :param full_path: path of the file
+        :param mime: mime type of the file, if it is already known
+        :return: (mime, parser) tuple
+        """
+
+        if mime is None:
+            mime = self.mime_guesser.guess_mime(full_path)
+        return mime, self.ext_map.get(mime, self.default_parser)
+
+    def run_parser(self, parser, mime, full_path: str, file_stat: os.stat_result = None) -> dict:
+
+        if file_stat is None:
+            file_stat = os.stat(full_path)
+
+        # Files read from a listing without inodes can't be identified in the cache
+        parse_cache = self.parse_cache if file_stat.st_ino else None
+
+        doc = None
+        if parse_cache is not None:
+            doc = parse_cache.get(parser, file_stat)
+
+        if doc is None:
+            doc = self.parse_content(parser, full_path, file_stat)
+            if parse_cache is not None:
+                parse_cache.put(parser, file_stat, doc)
+        else:
+            # The same file may have been cached under another path (hard links, renamed directory)
+            doc.update(parser.file_info(full_path, file_stat))
+
+        doc["mime"] = mime
+        return doc
+
+    def parse_content(self, parser, full_path: str, file_stat: os.stat_result) -> dict:
+        """
+        Parse a file, unless a file with the same checksums was already parsed by the same parser
+        """
+
+        # Files with the same fingerprint may have different content
+        if not self.dedup or config.dedup_cache_size <= 0 or \
+                not any(calculator.exact for calculator in parser.checksum_calculators):
+            return parser.parse(full_path, file_stat)
+
+        checksums = parser.checksums(full_path)
+        key = (parser.cache_key(), file_stat.st_size) + tuple(sorted(checksums.items()))
+
+        with self.content_lock:
+            doc = self.content_docs.get(key)
+            if doc is not None:
+                self.content_docs.move_to_end(key)
+
+        if doc is not None:
+            doc = dict(doc)
+            doc.update(parser.file_info(full_path, file_stat))
+            return doc
+
+        doc = parser.parse(full_path, file_stat, checksums)
+
+        with self.content_lock:
+            self.content_docs[key] = dict(doc)
+            if len(self.content_docs) > config.dedup_cache_size:
+                self.content_docs.popitem(last=False)
+
+        return doc
+
+    def parse_path(self, full_path: str, file_stat: os.stat_result = None):
+        """
+        Parse a single file with the parser matching its mime type
+        :param full_path: path of the file
+        :param file_stat: stat result of the file, if it is already known
+        :return: parsed document, None if the file couldn't be parsed
+        """
+
+        try:
+            mime, parser = self.guess_parser(full_path)
+            return self.run_parser(parser, mime, full_path, file_stat)
+        except:
+            return None
+
+    def __getstate__(self):
+        # Only the parsing state is needed by the worker processes
+        state = self.__dict__.copy()
+        state["documents"] = []
+        state["documents_size"] = 0
+        state["indexer"] = None
+        state["known_files"] = None
+        state["outdated_docs"] = []
+        state["outdated_lock"] = None
+        state["storage"] = None
+        state["journaled_files"] = set()
+        state["pending_links"] = {}
+        state["link_docs"] = OrderedDict()
+        state["link_lock"] = None
+        state["content_docs"] = OrderedDict()
+        state["content_lock"] = None
+        state["out_q"] = None
+        state["pending_size"] = None
+        state["parse_queue"] = None
+        state["benchmark"] = None
+        state["throttle"] = None
+        state["index_queue"] = None
+        state["timed_out_files"] = []
+        state["parse_lock"] = None
+        state["lanes"] = {}
+        state["in_progress"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.outdated_lock = Lock()
+        self.link_lock = Lock()
+        self.content_lock = Lock()
+        self.parse_lock = Lock()
 
     def index_file(self, out_q: Queue, count: Value):
 
         if self.indexer is None:
             while True:
-                try:
-                    doc = out_q.get(timeout=120)
-                    if doc is None:
-                        break
-                except Empty:
+                item = out_q.get()
+                if item is None:
                     break
+                doc, size = item
                 self.documents.append(doc)
+                self.pending_size.release(size)
                 out_q.task_done()
             return
 
         while True:
             try:
-                doc = out_q.get(timeout=600)
-                if doc is None:
-                    break
+                item = out_q.get(timeout=config.index_flush_wait)
             except Empty:
-                print("outq empty")
+                # The parsers may be waiting for the memory held by the partial batch
+                if self.documents and self.pending_size.waiting:
+                    self.flush_documents()
+                continue
+            if item is None:
                 break
 
             try:
+                doc, size = item
                 self.documents.append(doc)
-                count.value += 1
+                self.documents_size += size
+                if count:
+                    count.value += 1
+                if self.index_queue:
+                    self.index_queue.value = out_q.qsize()
 
-                if count.value % config.index_every == 0:
-                    self.indexer.index(self.documents, self.dir_id)
-                    self.documents.clear()
+                if len(self.documents) >= config.index_every or self.documents_size >= config.index_batch_bytes or \
+                        (self.pending_size.waiting and out_q.empty() and
+                         self.documents_size >= config.index_min_batch_bytes):
+                    self.flush_documents()
             except:
                 pass
             finally:
                 out_q.task_done()
         if self.documents:
-            self.indexer.index(self.documents, self.dir_id)
+            self.flush_documents()
+
+    def flush_documents(self):
+        """
+        Index the parsed documents and record them in the journal. The documents of modified files
+        found so far are deleted first so that a resumed crawl doesn't leave them in the index
+        """
+
+        with self.outdated_lock:
+            outdated_docs = self.outdated_docs
+            self.outdated_docs = []
+
+        if outdated_docs:
+            self.indexer.delete(outdated_docs)
+
+        try:
+            for attempt in range(config.index_retries + 1):
+                try:
+                    if self.throttle is not None:
+                        self.throttle.index(len(self.documents))
+                    self.indexer.index(self.documents, self.dir_id)
+                    break
+                except Exception as e:
+                    print("Error while indexing documents: " + str(e))
+                    if attempt == config.index_retries:
+                        # The documents are dropped to free their memory, they are not in the journal so
+                        # a resumed crawl parses the files again
+                        return
+                    time.sleep(config.index_retry_delay * 2 ** attempt)
+
+            if self.storage is not None:
+                self.storage.save_journal(self.task_id, [Search.get_rel_path(doc) for doc in self.documents])
+        finally:
+            self.documents.clear()
+            self.pending_size.release(self.documents_size)
+            self.documents_size = 0
+
+
+def document_size(doc: dict) -> int:
+    """Estimate the memory used by a parsed document, in bytes"""
+
+    size = 200
+    for key, value in doc.items():
+        size += len(key) + 50
+        if isinstance(value, str):
+            size += len(value)
+    return size
+
+
+class ParseTimeoutException(Exception):
+    pass
+
+
+class ParseTimer:
+    """
+    Raises ParseTimeoutException in the main thread of the process after a delay
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expired = False
+
+    def on_alarm(self, signum, frame):
+        self.expired = True
+        raise ParseTimeoutException()
+
+    def __enter__(self):
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGALRM, self.on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+# Crawler of the current parsing worker process, see Crawler.parse_with_processes()
+worker_crawler = None
+
+
+def init_parse_worker(crawler: Crawler, read_limiter: RateLimiter = None):
+    global worker_crawler
+    worker_crawler = crawler
+    fileio.device_slots = crawler.device_slots
+    fileio.read_limiter = read_limiter
+
+
+def parse_batch(items: list) -> tuple:
+    """
+    Parse a batch of files in a worker process. Parsers that exceed their time budget
+    are interrupted with SIGALRM (where available)
+    :param items: (path, stat result, mime or None) tuples of the files to parse
+    :return: (list of (path, stat result, parsed document or None, parser name, parse time) tuples,
+    list of paths that timed out)
+    """
+
+    parsed = []
+    timed_out_files = []
+
+    for full_path, file_stat, mime in items:
+        try:
+            mime, parser = worker_crawler.guess_parser(full_path, mime)
+        except:
+            parsed.append((full_path, file_stat, None, None, 0))
+            continue
+
+        timer = ParseTimer(worker_crawler.get_timeout(parser))
+        doc = None
+        start = time.time()
+
+        try:
+            with timer:
+                doc = worker_crawler.run_parser(parser, mime, full_path, file_stat)
+        except:
+            pass
+
+        if timer.expired:
+            # The parser may have swallowed the exception, its result is discarded either way
+            timed_out_files.append(full_path)
+            doc = None
+
+        parsed.append((full_path, file_stat, doc, type(parser).__name__, time.time() - start))
+
+    return parsed, timed_out_files
 
 
 class TaskManager:
     def __init__(self, storage: LocalStorage):
-        self.current_task = None
+        self.running_tasks = {}  # task_id -> RunningTask
         self.storage = storage
-        self.current_process = None
         self.indexer = Indexer(config.elasticsearch_index)
+        self.watchers = {}  # dir_id -> (path, Process)
+
+        # Directories take turns, dir_id -> number of the last task started for the directory
+        self.last_started = {}
+        # Tasks whose process stopped unexpectedly, task_id -> (number of attempts, time of the next attempt)
+        self.task_attempts = {}
+        self.started_count = 0
+        self.cpu_times = read_cpu_times()
+        # Recorded by the search page, crawls with the AdaptiveThrottle option slow down while searches are slow
+        self.search_latency = SearchLatency()
+
+        # The dispatcher sleeps until a task is changed or a task process exits
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        storage.add_task_listener(self.wake)
 
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(self.check_new_task, "interval", seconds=0.5)
-        scheduler.start()
+        self.dispatcher = Thread(target=self.run, daemon=True)
+        self.dispatcher.start()
+
+    def wake(self):
+        """Wake the dispatcher up to check the tasks"""
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            # The dispatcher has pending wake ups already
+            pass
+
+    def run(self):
+
+        while True:
+            try:
+                self.check_new_task()
+            except Exception as e:
+                print("Error while checking tasks: " + str(e))
+
+            sentinels = [self.wake_r] + [running_task.process.sentinel for running_task in
+                                         list(self.running_tasks.values())]
+            # Tasks that are waiting for resources and watchers are checked at regular intervals
+            wait(sentinels, config.task_check_interval)
+
+            try:
+                while os.read(self.wake_r, 4096):
+                    pass
+            except BlockingIOError:
+                pass
 
     def start_task(self, task: Task):
-        self.current_task = RunningTask(task)
+        running_task = RunningTask(task)
+
+        # The watcher would race the task, it is started again after the task
+        self.stop_watcher(task.dir_id)
 
         directory = self.storage.dirs()[task.dir_id]
 
-        if task.type == Task.INDEX:
-            self.current_process = Process(target=self.execute_crawl, args=(directory,
-                                                                            self.current_task.parsed_files,
-                                                                            self.current_task.done,
-                                                                            self.current_task.total_files))
+        if task.type == Task.INDEX or task.type == Task.INCREMENTAL_INDEX:
+            running_task.process = Process(target=self.execute_crawl, args=(directory,
+                                                                            running_task.parsed_files,
+                                                                            running_task.done,
+                                                                            running_task.total_files,
+                                                                            task.type == Task.INCREMENTAL_INDEX,
+                                                                            running_task.workers,
+                                                                            task.id,
+                                                                            running_task.parse_queue,
+                                                                            running_task.index_queue))
 
         elif task.type == Task.GEN_THUMBNAIL:
-            self.current_process = Process(target=self.execute_thumbnails, args=(directory,
-                                                                                 self.current_task.total_files,
-                                                                                 self.current_task.parsed_files,
-                                                                                 self.current_task.done))
-        self.current_process.start()
+            running_task.process = Process(target=self.execute_thumbnails, args=(directory,
+                                                                                 running_task.total_files,
+                                                                                 running_task.parsed_files,
+                                                                                 running_task.done,
+                                                                                 running_task.workers))
+
+        elif task.type == Task.DISTRIBUTED_INDEX:
+            running_task.process = Process(target=self.execute_distributed_crawl, args=(directory,
+                                                                                        running_task.parsed_files,
+                                                                                        running_task.done,
+                                                                                        running_task.total_files,
+                                                                                        running_task.workers,
+                                                                                        task.id))
 
-    def execute_crawl(self, directory: Directory, counter: Value, done: Value, total_files: Value):
+        elif task.type == Task.BENCHMARK:
+            running_task.process = Process(target=self.execute_benchmark, args=(directory,
+                                                                                running_task.parsed_files,
+                                                                                running_task.done,
+                                                                                running_task.total_files,
+                                                                                running_task.workers,
+                                                                                running_task.parse_queue,
+                                                                                running_task.index_queue))
+        running_task.process.start()
 
-        Search(config.elasticsearch_index).delete_directory(directory.id)
+        self.running_tasks[task.id] = running_task
+        self.started_count += 1
+        self.last_started[task.dir_id] = self.started_count
+
+    def execute_crawl(self, directory: Directory, counter: Value, done: Value, total_files: Value,
+                      incremental: bool = False, workers: Value = None, task_id: int = None,
+                      parse_queue: Value = None, index_queue: Value = None):
+
+        if incremental:
+            # Only new and modified files are parsed, documents of deleted files are removed after the crawl
+            known_files = Search(config.elasticsearch_index).get_file_states(directory.id)
+        else:
+            known_files = None
+            if task_id is None or not self.storage.journal(task_id):
+                Search(config.elasticsearch_index).delete_directory(directory.id)
 
         chksum_calcs = self.make_checksums_list(directory)
 
         mime_guesser = ExtensionMimeGuesser() if directory.get_option("MimeGuesser") == "extension" \
             else ContentMimeGuesser()
 
-        c = Crawler(self.make_parser_list(chksum_calcs, directory), mime_guesser, self.indexer, directory.id)
-        c.crawl(directory.path, counter, total_files)
+        # The task runs in a forked process, it gets its own connection to elasticsearch
+        indexer = self.make_indexer()
+
+        c = Crawler(self.make_parser_list(chksum_calcs, directory), mime_guesser, indexer, directory.id,
+                    known_files=known_files, storage=self.storage if task_id is not None else None, task_id=task_id,
+                    parse_cache=self.make_parse_cache(), walk_filter=self.make_walk_filter(directory),
+                    listing=directory.get_option("Listing") or None, throttle=self.make_throttle(directory, indexer))
+        c.crawl(directory.path, counter, total_files, workers, parse_queue, index_queue)
+
+        if any(isinstance(calculator, FingerprintCheckSumCalculator) for calculator in chksum_calcs):
+            self.verify_fingerprints(directory, indexer)
+
+        done.value = 1
+
+    @staticmethod
+    def verify_fingerprints(directory: Directory, indexer):
+        """
+        Calculate the sha256 checksum of the files whose fingerprint is shared with other files of the directory,
+        so that duplicates can be told apart from files that only have identical samples
+        """
+
+        calculator = Sha256CheckSumCalculator()
+        updates = {}
+
+        for doc in Search(config.elasticsearch_index).get_fingerprint_collisions(directory.id):
+            if "sha256" in doc["_source"]:
+                continue
+            try:
+                full_path = os.path.join(directory.path, Search.get_rel_path(doc["_source"]))
+                updates[doc["_id"]] = {"sha256": calculator.checksum(full_path)}
+            except OSError:
+                continue
+
+            if len(updates) >= config.index_every:
+                indexer.update(updates)
+                updates = {}
+
+        if updates:
+            indexer.update(updates)
+
+    def execute_distributed_crawl(self, directory: Directory, counter: Value, done: Value, total_files: Value,
+                                  workers: Value = None, task_id: int = None):
+        """
+        Split the directory into work units and wait until they are crawled by the workers
+        of this host (and of other hosts)
+        """
 
+        work_queue = WorkQueue(config.work_queue_path)
+
+        if not work_queue.has_task(task_id):
+            Search(config.elasticsearch_index).delete_directory(directory.id)
+            work_queue.add_task(task_id, directory, split_tree(directory.path, config.work_unit_depth,
+                                                                       self.make_walk_filter(directory)))
+
+        processes = []
+
+        def on_terminate(signum, frame):
+            # The units of the workers are handed out again when the task is resumed
+            for p in processes:
+                p.terminate()
+            os._exit(0)
+
+        # Installed before the workers are started so that they are stopped with the task
+        signal.signal(signal.SIGTERM, on_terminate)
+
+        for _ in range(config.distributed_workers):
+            process = Process(target=self.execute_crawl_worker, args=(task_id,))
+            process.start()
+            processes.append(process)
+
+        if workers:
+            workers.value = len(processes)
+
+        while True:
+            completed_units, units, parsed_files, task_total_files = work_queue.progress(task_id)
+            counter.value = parsed_files
+            total_files.value = task_total_files
+
+            if completed_units == units:
+                break
+
+            # Workers only exit normally once the units are completed
+            if any(process.exitcode not in (None, 0) for process in processes):
+                for process in processes:
+                    process.terminate()
+                # The task crashed, it is restarted with a backoff (see TaskManager.on_task_crashed())
+                raise RuntimeError("A crawl worker of task %d exited with an error" % (task_id,))
+            time.sleep(1)
+
+        for process in processes:
+            process.join()
+
+        work_queue.remove_task(task_id)
         done.value = 1
 
+    @staticmethod
+    def execute_crawl_worker(task_id: int = None):
+        CrawlWorker(WorkQueue(config.work_queue_path), task_id).run()
+
+    def execute_benchmark(self, directory: Directory, counter: Value, done: Value, total_files: Value,
+                          workers: Value = None, parse_queue: Value = None, index_queue: Value = None):
+        """Parse the files of a directory without indexing them and save the parse times"""
+
+        chksum_calcs = self.make_checksums_list(directory)
+
+        mime_guesser = ExtensionMimeGuesser() if directory.get_option("MimeGuesser") == "extension" \
+            else ContentMimeGuesser()
+
+        # The benchmark stands in for the indexer and the parse cache is not used, every sampled file is parsed
+        benchmark = Benchmark(float(directory.get_option("BenchmarkSample")))
+        c = Crawler(self.make_parser_list(chksum_calcs, directory), mime_guesser, benchmark, directory.id,
+                    benchmark=benchmark, walk_filter=self.make_walk_filter(directory),
+                    listing=directory.get_option("Listing") or None)
+
+        benchmark.start()
+        c.crawl(directory.path, counter, total_files, workers, parse_queue, index_queue)
+        benchmark.stop()
+
+        self.storage.save_benchmark(directory.id, benchmark.report(len(c.timed_out_files)))
+
+        done.value = 1
+
+    @staticmethod
+    def make_indexer():
+        """
+        Create the indexer of a task. The connection of the indexer of the task manager is not shared with the
+        processes of the tasks, each process creates its own indexer
+        """
+        return Indexer(config.elasticsearch_index)
+
+    @staticmethod
+    def make_walk_filter(directory):
+        exclude = [p.strip() for p in directory.get_option("Exclude").split(",") if p.strip()]
+        max_depth = directory.get_option("MaxDepth").strip()
+        max_file_size = int(directory.get_option("MaxFileSize"))
+
+        return WalkFilter(directory.path, exclude, int(max_depth) if max_depth else None,
+                          max_file_size if max_file_size > 0 else None, directory.get_option("OneFileSystem") == "1")
+
+    def make_throttle(self, directory, indexer):
+        read_rate = int(directory.get_option("MaxReadRate"))
+        file_rate = float(directory.get_option("MaxFileRate"))
+        index_rate = float(directory.get_option("MaxIndexRate"))
+        adaptive = directory.get_option("AdaptiveThrottle") == "1"
+
+        if not (read_rate or file_rate or index_rate or adaptive):
+            return None
+        return CrawlThrottle(read_rate, file_rate, index_rate, adaptive, self.search_latency, indexer)
+
+    @staticmethod
+    def make_parse_cache():
+        return ParseCache(config.parse_cache_path) if config.parse_cache_path else None
+
     @staticmethod
     def make_checksums_list(directory):
         chksum_calcs = []
@@ -211,6 +1278,8 @@ class TaskManager:
                 chksum_calcs.append(Sha1CheckSumCalculator())
             elif arg.strip() == "sha256":
                 chksum_calcs.append(Sha256CheckSumCalculator())
+            elif arg.strip() == "fingerprint":
+                chksum_calcs.append(FingerprintCheckSumCalculator())
         return chksum_calcs
 
     @staticmethod
@@ -218,7 +1287,8 @@ class TaskManager:
         p = [p.strip() for p in directory.get_option("FileParsers").split(",")]
         parsers = [GenericFileParser(chksum_calcs, directory.path)]
         if "media" in p:
-            parsers.append(MediaFileParser(chksum_calcs, directory.path))
+            parsers.append(MediaFileParser(chksum_calcs, directory.path,
+                                           config.parser_timeouts.get("MediaFileParser", config.parse_timeout)))
         if "text" in p:
             parsers.append(
                 TextFileParser(chksum_calcs, int(directory.get_option("TextFileContentLength")), directory.path))
@@ -228,7 +1298,8 @@ class TaskManager:
             parsers.append(FontParser(chksum_calcs, directory.path))
         if "pdf" in p:
             parsers.append(
-                PdfFileParser(chksum_calcs, int(directory.get_option("PdfFileContentLength")), directory.path))
+                PdfFileParser(chksum_calcs, int(directory.get_option("PdfFileContentLength")), directory.path,
+                              directory.get_option("PdfTextMode") == "fast", int(directory.get_option("PdfMaxPages"))))
         if "docx" in p:
             parsers.append(DocxParser(chksum_calcs, int(directory.get_option("DocxContentLength")), directory.path))
         if "spreadsheet" in p:
@@ -238,7 +1309,8 @@ class TaskManager:
             parsers.append(EbookParser(chksum_calcs, int(directory.get_option("EbookContentLength")), directory.path))
         return parsers
 
-    def execute_thumbnails(self, directory: Directory, total_files: Value, counter: Value, done: Value):
+    def execute_thumbnails(self, directory: Directory, total_files: Value, counter: Value, done: Value,
+                           workers: Value = None):
 
         dest_path = os.path.join("static/thumbnails", str(directory.id))
         if os.path.exists(dest_path):
@@ -249,21 +1321,250 @@ class TaskManager:
         tn_generator = ThumbnailGenerator(int(directory.get_option("ThumbnailSize")),
                                           int(directory.get_option("ThumbnailQuality")),
                                           directory.get_option("ThumbnailColor"))
-        tn_generator.generate_all(docs, dest_path, counter, directory, total_files)
+        tn_generator.generate_all(docs, dest_path, counter, directory, total_files, workers)
 
         done.value = 1
 
-    def cancel_task(self):
-        self.current_task.done.value = 1
+    def execute_watch(self, directory: Directory):
+
+        chksum_calcs = self.make_checksums_list(directory)
+
+        mime_guesser = ExtensionMimeGuesser() if directory.get_option("MimeGuesser") == "extension" \
+            else ContentMimeGuesser()
+
+        search = Search(config.elasticsearch_index)
+        doc_ids = {rel_path: state["id"] for rel_path, state in search.get_file_states(directory.id).items()}
+
+        c = Crawler(self.make_parser_list(chksum_calcs, directory), mime_guesser, self.make_indexer(), directory.id,
+                    parse_cache=self.make_parse_cache(), walk_filter=self.make_walk_filter(directory))
+        DirectoryWatcher(c, directory.path, doc_ids, search).run()
+
+    def update_watchers(self):
+        """
+        Start and stop the watcher processes of the directories with the Watch option. Watchers are stopped
+        while a task runs on their directory, the task replaces the documents they know about. They are
+        started again once it is done and load the new documents
+        """
+
+        dirs = self.storage.dirs()
+        busy_dirs = set(running_task.task.dir_id for running_task in self.running_tasks.values())
+
+        for dir_id, (path, process) in list(self.watchers.items()):
+            directory = dirs.get(dir_id)
+
+            if directory is None or not directory.enabled or directory.get_option("Watch") != "1" \
+                    or directory.path != path or not process.is_alive() or dir_id in busy_dirs:
+                self.stop_watcher(dir_id)
+
+        for dir_id, directory in dirs.items():
+            if dir_id not in self.watchers and dir_id not in busy_dirs and directory.enabled and \
+                    directory.get_option("Watch") == "1":
+                process = Process(target=self.execute_watch, args=(directory,))
+                process.start()
+                self.watchers[dir_id] = (directory.path, process)
+
+    def stop_watcher(self, dir_id: int):
+        watcher = self.watchers.pop(dir_id, None)
+        if watcher is not None:
+            watcher[1].terminate()
+            watcher[1].join()
+
+    def cancel_task(self, task_id: int):
+        running_task = self.running_tasks.get(task_id)
+        if running_task is not None:
+            running_task.done.value = 1
+            self.wake()
+
+    def pause_task(self, task_id: int):
+        """Pause a task, it is stopped by check_new_task() and resumed from its journal later"""
+        self.storage.set_task_paused(task_id, True)
+
+    def resume_task(self, task_id: int):
+        self.task_attempts.pop(task_id, None)
+        self.storage.set_task_paused(task_id, False)
 
     def check_new_task(self):
 
-        if self.current_task is None:
-            tasks = self.storage.tasks()
-            if len(tasks) > 0:
-                self.start_task(tasks[sorted(tasks)[0]])
-        else:
-            if self.current_task.done.value == 1:
-                self.current_process.terminate()
-                self.storage.del_task(self.current_task.task.id)
-                self.current_task = None
+        tasks = self.storage.tasks()
+
+        for task_id, running_task in list(self.running_tasks.items()):
+            task = tasks.get(task_id)
+
+            if running_task.done.value == 1 or task is None:
+                running_task.process.terminate()
+                self.storage.del_task(task_id)
+                del self.running_tasks[task_id]
+                self.task_attempts.pop(task_id, None)
+
+                if running_task.task.type == Task.DISTRIBUTED_INDEX:
+                    # Stop the workers of other hosts if the task was cancelled
+                    WorkQueue(config.work_queue_path).remove_task(task_id)
+            elif task is not None and task.paused:
+                running_task.process.terminate()
+                del self.running_tasks[task_id]
+            elif not running_task.process.is_alive():
+                del self.running_tasks[task_id]
+                self.on_task_crashed(task_id)
+
+        self.update_watchers()
+
+        cpu_times = read_cpu_times()
+        load = cpu_load(self.cpu_times, cpu_times)
+        self.cpu_times = cpu_times
+
+        if self.running_tasks and load is not None and \
+                (load[0] > config.task_max_cpu or load[1] > config.task_max_iowait):
+            return
+
+        task = self.next_task(tasks)
+        if task is not None:
+            self.start_task(task)
+
+    def on_task_crashed(self, task_id: int):
+        """
+        The task will be restarted and resumed from its journal, after a delay that grows with each attempt.
+        It is paused as failed after task_max_attempts attempts
+        """
+
+        attempts = self.task_attempts.get(task_id, (0, 0))[0] + 1
+
+        if attempts >= config.task_max_attempts:
+            print("Task %d stopped unexpectedly %d times, giving up" % (task_id, attempts))
+            self.task_attempts.pop(task_id, None)
+            self.storage.set_task_paused(task_id, True, failed=True)
+            return
+
+        delay = config.task_retry_delay * 2 ** (attempts - 1)
+        print("Task %d stopped unexpectedly, restarting in %ds" % (task_id, delay))
+        self.task_attempts[task_id] = (attempts, time.time() + delay)
+
+    def next_task(self, tasks: dict):
+        """
+        Choose the next task to start, if the budget allows it. Directories take turns so that
+        the tasks of a directory don't hold back the other directories
+        :param tasks: task_id -> Task
+        :return: the task to start, None if no task can be started now
+        """
+
+        if len(self.running_tasks) >= config.max_running_tasks:
+            return None
+
+        dirs = self.storage.dirs()
+        busy_dirs = set(running_task.task.dir_id for running_task in self.running_tasks.values())
+
+        busy_devices = {}
+        for dir_id in busy_dirs:
+            device = self.get_device(dirs.get(dir_id))
+            busy_devices[device] = busy_devices.get(device, 0) + 1
+
+        candidates = {}
+        for task_id in sorted(tasks):
+            task = tasks[task_id]
+
+            if task.paused or task.dir_id in busy_dirs or task.dir_id in candidates or task.dir_id not in dirs:
+                continue
+
+            if self.task_attempts.get(task_id, (0, 0))[1] > time.time():
+                # Waiting before it is restarted, the other tasks of the directory wait too
+                candidates[task.dir_id] = None
+                continue
+
+            device = self.get_device(dirs[task.dir_id])
+            if device is not None and 0 < config.max_tasks_per_device <= busy_devices.get(device, 0):
+                continue
+
+            # Oldest task of the directory
+            candidates[task.dir_id] = task
+
+        candidates = {dir_id: task for dir_id, task in candidates.items() if task is not None}
+        if not candidates:
+            return None
+
+        return min(candidates.values(), key=lambda t: (self.last_started.get(t.dir_id, 0), t.id))
+
+    @staticmethod
+    def get_device(directory: Directory):
+        """Get the device of a directory, None if it can't be accessed"""
+        try:
+            return os.stat(directory.path).st_dev
+        except (OSError, AttributeError):
+            return None
+
+
+class CrawlWorker:
+    """
+    Claims the work units of distributed crawls, crawls their sub-tree and indexes the documents.
+    A unit that is handed out again after its worker was lost skips the files the worker indexed
+    """
+
+    def __init__(self, work_queue: WorkQueue, task_id: int = None, worker_id: str = None, indexer=None):
+        """
+        :param task_id: only work on the units of this task and stop when they are all completed.
+        Otherwise, work on the units of any task until the process is stopped
+        """
+        self.work_queue = work_queue
+        self.task_id = task_id
+        self.worker_id = worker_id if worker_id is not None else "%s:%d" % (socket.gethostname(), os.getpid())
+        self.indexer = indexer if indexer is not None else Indexer(config.elasticsearch_index)
+
+    def run(self):
+
+        while True:
+            unit = self.work_queue.claim(self.worker_id, self.task_id)
+
+            if unit is not None:
+                self.crawl_unit(*unit)
+                continue
+
+            if self.task_id is not None:
+                completed_units, units, _, _ = self.work_queue.progress(self.task_id)
+                if completed_units == units:
+                    break
+
+            # Wait for new units, or for the units of lost workers
+            time.sleep(config.work_poll_interval)
+
+    def crawl_unit(self, unit_id: int, task_id: int, path: str, recursive: bool, attempts: int):
+
+        directory = self.work_queue.directory(task_id)
+        if directory is None:
+            return
+
+        print("Crawling %s (attempt %d)" % (path, attempts))
+
+        chksum_calcs = TaskManager.make_checksums_list(directory)
+
+        mime_guesser = ExtensionMimeGuesser() if directory.get_option("MimeGuesser") == "extension" \
+            else ContentMimeGuesser()
+
+        c = Crawler(TaskManager.make_parser_list(chksum_calcs, directory), mime_guesser, self.indexer, directory.id,
+                    storage=self.work_queue, task_id=unit_id, parse_cache=TaskManager.make_parse_cache(),
+                    max_depth=None if recursive else 0, walk_filter=TaskManager.make_walk_filter(directory))
+
+        counter = Value("i", 0)
+        total_files = Value("i", 0)
+        stopped = Event()
+        lost = Event()
+
+        def send_heartbeats():
+            while not stopped.wait(config.work_unit_lease / 4):
+                if not self.work_queue.heartbeat(unit_id, self.worker_id, counter.value, total_files.value):
+                    # The unit is crawled by the other worker, stop walking it
+                    print("Lost the lease of %s, it was handed to another worker" % (path,))
+                    lost.set()
+                    c.stopped.set()
+                    break
+
+        heartbeat_thread = Thread(target=send_heartbeats, daemon=True)
+        heartbeat_thread.start()
+
+        try:
+            c.crawl(path, counter, total_files)
+        finally:
+            stopped.set()
+            heartbeat_thread.join()
+
+        if lost.is_set():
+            return
+
+        self.work_queue.complete(unit_id, self.worker_id, counter.value, total_files.value)
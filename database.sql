@@ -15,6 +15,27 @@ CREATE TABLE Task (
   type INTEGER,
   completed BOOLEAN DEFAULT 0,
   completed_time DATETIME,
+  paused BOOLEAN DEFAULT 0,
+  -- Set (with paused) when the task process crashed too many times
+  failed BOOLEAN DEFAULT 0,
+  FOREIGN KEY (directory_id) REFERENCES Directory(id)
+);
+
+-- Files indexed by a crawl task, used to resume the task after a pause or a crash
+CREATE TABLE CrawlJournal (
+  task_id INTEGER,
+  path TEXT,
+  FOREIGN KEY (task_id) REFERENCES Task(id)
+);
+
+CREATE INDEX CrawlJournal_task_id ON CrawlJournal (task_id);
+
+-- Results of the dry-run crawls of a Directory
+CREATE TABLE Benchmark (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  directory_id INTEGER,
+  time INTEGER,
+  report TEXT,
   FOREIGN KEY (directory_id) REFERENCES Directory(id)
 );
 
@@ -0,0 +1,204 @@
+import ctypes
+import ctypes.util
+import io
+import mmap
+import os
+from contextlib import contextmanager, nullcontext
+
+import config
+
+fadvise_supported = hasattr(os, "posix_fadvise")
+
+# Limits the files read at the same time from each device (tuning.DeviceSlots), set by the crawler
+device_slots = None
+
+# Limits the bytes read per second from the files opened with open_file() (tuning.RateLimiter), set by the crawler
+read_limiter = None
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long)
+    libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p)
+    mincore_supported = fadvise_supported
+except (OSError, AttributeError):
+    mincore_supported = False
+
+
+def advise(fd: int, offset: int, length: int, advice: int):
+    """
+    posix_fadvise() that ignores the file systems and platforms that don't support it
+    """
+
+    if config.fadvise and fadvise_supported:
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
+
+def resident_pages(fd: int, size: int):
+    """
+    Find the pages of a file that are in the page cache, with mincore()
+    :param fd: file descriptor
+    :param size: size of the file
+    :return: one byte per page of the file, the lowest bit is set for the cached pages.
+    None if it can't be known
+    """
+
+    if not (config.fadvise and mincore_supported) or size <= 0:
+        return None
+
+    address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+    if address is None or address == ctypes.c_void_p(-1).value:
+        return None
+
+    try:
+        pages = ctypes.create_string_buffer((size + mmap.PAGESIZE - 1) // mmap.PAGESIZE)
+        if libc.mincore(address, size, pages) != 0:
+            return None
+        return pages.raw
+    finally:
+        libc.munmap(address, size)
+
+
+def drop_pages(fd: int, start: int, end: int, resident):
+    """
+    Drop the pages of a file from the page cache, except the pages that were cached before the crawl read them
+    :param start: offset of the first byte to drop
+    :param end: offset after the last byte to drop, 0 for the end of the file
+    :param resident: result of resident_pages() when the file was opened, None to drop every page
+    """
+
+    if resident is None:
+        advise(fd, start, end - start if end else 0, os.POSIX_FADV_DONTNEED)
+        return
+
+    first = start // mmap.PAGESIZE
+    last = len(resident) if not end else min(len(resident), (end + mmap.PAGESIZE - 1) // mmap.PAGESIZE)
+
+    uncached = resident.count(0, first, last)
+    if uncached == last - first:
+        advise(fd, start, end - start if end else 0, os.POSIX_FADV_DONTNEED)
+        return
+    if uncached == 0:
+        return
+
+    # Runs of pages that were not cached
+    run_start = None
+    for page in range(first, last + 1):
+        cached = page == last or resident[page] & 1
+        if cached and run_start is not None:
+            advise(fd, run_start * mmap.PAGESIZE, (page - run_start) * mmap.PAGESIZE, os.POSIX_FADV_DONTNEED)
+            run_start = None
+        elif not cached and run_start is None:
+            run_start = page
+
+
+def device_slot(path: str, file_stat: os.stat_result = None):
+    """
+    Hold a slot of the device of a file while it is read, for the parsers that read files with other libraries
+    than open_file()
+    :param path: path of the file
+    :param file_stat: stat result of the file, if it is already known
+    """
+
+    if device_slots is None:
+        return nullcontext()
+    return device_slots.slot((os.stat(path) if file_stat is None else file_stat).st_dev)
+
+
+class ThrottledFileIO(io.FileIO):
+    """
+    Raw file whose reads are charged to read_limiter, so that only the bytes actually read from the disk count
+    """
+
+    def read(self, size: int = -1):
+        data = super().read(size)
+        charge_read(len(data) if data else 0)
+        return data
+
+    def readall(self):
+        data = super().readall()
+        charge_read(len(data))
+        return data
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        charge_read(n or 0)
+        return n
+
+
+def charge_read(size: int):
+    """Wait until size more bytes can be read without exceeding the read rate"""
+
+    if read_limiter is not None and size:
+        read_limiter.acquire(size)
+
+
+@contextmanager
+def open_file(path: str, sequential: bool = True, length: int = 0):
+    """
+    Open a file for reading by the crawler. The kernel is told how the file will be read so that it reads ahead,
+    and the pages read by the crawler are dropped from the page cache once it is closed. The pages that were
+    cached when the file was opened are left in the cache. A slot of the device of the file is held while it is open
+    and the bytes read are charged to read_limiter
+    :param path: path of the file
+    :param sequential: False if the file is read at random offsets
+    :param length: number of bytes read from the start of the file, 0 if unknown or the whole file
+    """
+
+    with io.BufferedReader(ThrottledFileIO(path)) as f:
+        fd = f.fileno()
+        file_stat = os.fstat(fd)
+
+        with device_slot(path, file_stat):
+            if fadvise_supported:
+                f.resident_pages = resident_pages(fd, file_stat.st_size)
+                advise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL if sequential else os.POSIX_FADV_RANDOM)
+                advise(fd, 0, min(length, config.fadvise_readahead) if length else config.fadvise_readahead,
+                       os.POSIX_FADV_WILLNEED)
+
+            try:
+                yield f
+            finally:
+                if fadvise_supported:
+                    drop_pages(fd, 0, 0, f.resident_pages)
+
+
+def read_views(f, block_size: int = 65536):
+    """
+    Read a file opened with open_file() from its current position to its end, into two buffers that are used in
+    turn. A block stays valid until the block after the next one is requested, so the caller can process a block
+    while the next one is read. The next fadvise_readahead bytes are requested ahead of the reads and the pages
+    that were read are dropped as the read progresses (see drop_pages()), so that reading a large file doesn't
+    fill the page cache
+    :param f: file
+    :param block_size: size of the blocks, in bytes
+    :return: generator of memoryviews of the blocks
+    """
+
+    fd = f.fileno()
+    window = config.fadvise_readahead
+    position = f.tell()
+    dropped = position
+    next_advice = position + window
+    buffers = (memoryview(bytearray(block_size)), memoryview(bytearray(block_size)))
+
+    i = 0
+    while True:
+        buffer = buffers[i % 2]
+        n = f.readinto(buffer)
+        if not n:
+            break
+
+        yield buffer[:n]
+        i += 1
+
+        position += n
+        if fadvise_supported and position >= next_advice:
+            drop_pages(fd, dropped, position, getattr(f, "resident_pages", None))
+            dropped = position
+            advise(fd, position, window, os.POSIX_FADV_WILLNEED)
+            next_advice = position + window
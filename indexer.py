@@ -12,10 +12,13 @@ class Indexer:
 
         self.index_name = index
         self.es = elasticsearch.Elasticsearch()
+        # Number of documents rejected because elasticsearch was overloaded
+        self.rejections = 0
 
         requests.head(config.elasticsearch_url)
         if self.es.indices.exists(self.index_name):
             print("Index is already setup")
+            self.upgrade_mapping()
         else:
             print("First time setup...")
             self.init()
@@ -37,16 +40,84 @@ class Indexer:
 
         return result
 
-    def index(self, docs: list, directory: int):
+    @staticmethod
+    def create_bulk_delete_string(doc_ids: list):
+        """
+        Creates a delete string for sending to elasticsearch
+        """
+
+        result = ""
+
+        for doc_id in doc_ids:
+            result += json.dumps({"delete": {"_id": doc_id}}) + "\n"
+
+        return result
+
+    @staticmethod
+    def create_bulk_update_string(updates: dict):
+        """
+        Creates an update string for sending to elasticsearch
+        """
+
+        result = ""
+
+        for doc_id, fields in updates.items():
+            result += json.dumps({"update": {"_id": doc_id}}) + "\n"
+            result += json.dumps({"doc": fields}) + "\n"
+
+        return result
+
+    def index(self, docs: list, directory: int) -> list:
+        """
+        Index documents
+        :return: ids of the indexed documents
+        """
         print("Indexing " + str(len(docs)) + " docs")
         index_string = Indexer.create_bulk_index_string(docs, directory)
-        self.es.bulk(body=index_string, index=self.index_name, doc_type="file", refresh="true")
+        try:
+            result = self.es.bulk(body=index_string, index=self.index_name, doc_type="file", refresh="true")
+        except elasticsearch.TransportError as e:
+            if e.status_code == 429:
+                self.rejections += len(docs)
+            raise
+
+        if result["errors"]:
+            self.rejections += sum(1 for item in result["items"] if item["index"].get("status") == 429)
+
+        return [item["index"]["_id"] for item in result["items"]]
+
+    def delete(self, doc_ids: list):
+        print("Deleting " + str(len(doc_ids)) + " docs")
+        delete_string = Indexer.create_bulk_delete_string(doc_ids)
+        self.es.bulk(body=delete_string, index=self.index_name, doc_type="file", refresh="true")
+
+    def update(self, updates: dict):
+        """
+        Add fields to indexed documents
+        :param updates: doc_id -> dict of fields
+        """
+        print("Updating " + str(len(updates)) + " docs")
+        update_string = Indexer.create_bulk_update_string(updates)
+        self.es.bulk(body=update_string, index=self.index_name, doc_type="file", refresh="true")
 
     def clear(self):
 
         self.es.indices.delete(self.index_name)
         self.es.indices.create(self.index_name)
 
+    def upgrade_mapping(self):
+        """
+        Add the mapping of the fields that are missing from indices created by older versions
+        """
+
+        try:
+            self.es.indices.put_mapping(body={"properties": {
+                "fingerprint": {"type": "keyword"},
+            }}, doc_type="file", index=self.index_name, include_type_name=True)
+        except elasticsearch.exceptions.RequestError as e:
+            # The field was already mapped dynamically, its keyword sub-field is used instead
+            print("Could not update the mapping of the index: " + str(e))
+
     def init(self):
         if self.es.indices.exists(self.index_name):
             self.es.indices.delete(index=self.index_name)
@@ -76,6 +147,7 @@ class Indexer:
             "suggest-path": {"type": "completion", "analyzer": "keyword"},
             "mime": {"type": "keyword"},
             "encoding": {"type": "keyword"},
+            "fingerprint": {"type": "keyword"},
             "format_name": {"type": "keyword"},
             "format_long_name": {"type": "keyword"},
             "duration": {"type": "float"},
@@ -83,6 +155,7 @@ class Indexer:
             "height": {"type": "integer"},
             "mtime": {"type": "integer"},
             "size": {"type": "long"},
+            "inode": {"type": "long"},
             "directory": {"type": "short"},
             "name": {"analyzer": "content_analyser", "type": "text",
                      "fields": {"nGram": {"type": "text", "analyzer": "my_nGram"}}
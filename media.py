@@ -0,0 +1,413 @@
+import os
+import struct
+
+from fileio import open_file
+
+# The values match the output of ffprobe -show_format, so that documents don't depend on the parser that read them
+WAV_FORMAT = ("wav", "WAV / WAVE (Waveform Audio)")
+FLAC_FORMAT = ("flac", "raw FLAC")
+MP3_FORMAT = ("mp3", "MP2/3 (MPEG audio layer 2/3)")
+MP4_FORMAT = ("mov,mp4,m4a,3gp,3g2,mj2", "QuickTime / MOV")
+
+# Tags of the formats -> tags of ffprobe
+VORBIS_TAGS = {"TITLE": "title", "ALBUM": "album", "GENRE": "genre", "ALBUMARTIST": "album_artist",
+               "ALBUM ARTIST": "album_artist", "ARTIST": "artist"}
+ID3_TAGS = {b"TIT2": "title", b"TALB": "album", b"TCON": "genre", b"TPE2": "album_artist", b"TPE1": "artist",
+            b"TT2": "title", b"TAL": "album", b"TCO": "genre", b"TP2": "album_artist", b"TP1": "artist"}
+RIFF_TAGS = {b"INAM": "title", b"IPRD": "album", b"IGNR": "genre", b"IART": "artist"}
+MP4_TAGS = {b"\xa9nam": "title", b"\xa9alb": "album", b"\xa9gen": "genre", b"aART": "album_artist",
+            b"\xa9ART": "artist"}
+
+# MPEG audio layer III, kbit/s by version and bitrate index
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+# Metadata is only searched in the first bytes of the files
+MAX_HEADER_SIZE = 1024 * 1024
+# The first MP3 frame is searched in the first bytes after the ID3 tag (some encoders pad the tag)
+MP3_SYNC_WINDOW = 4096
+
+
+def read_media_info(full_path: str):
+    """
+    Read the duration and the tags of common audio and video files from their headers, without ffprobe
+    :param full_path: path of the file
+    :return: dict in the format of the "format" object of ffprobe -show_format, None if the format isn't supported
+    """
+
+    try:
+        with open_file(full_path, sequential=False, length=65536) as f:
+            size = os.fstat(f.fileno()).st_size
+            magic = f.read(12)
+
+            if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+                return read_wav(f, size)
+            if magic[:4] == b"fLaC":
+                return read_flac(f)
+            if magic[4:8] == b"ftyp":
+                return read_mp4(f, size)
+            if magic[:3] == b"ID3":
+                # Other formats than MP3 can start with an ID3 tag
+                f.seek(id3_size(magic))
+                if f.read(4) == b"fLaC":
+                    return read_flac(f, id3_size(magic))
+                return read_mp3(f, size)
+            if len(magic) > 1 and magic[0] == 0xFF and magic[1] & 0xE0 == 0xE0:
+                return read_mp3(f, size)
+    except (OSError, struct.error, ValueError, IndexError, ZeroDivisionError):
+        pass
+
+    return None
+
+
+def make_format(format_names: tuple, duration: float, tags: dict) -> dict:
+    return {
+        "format_name": format_names[0],
+        "format_long_name": format_names[1],
+        "duration": duration,
+        "tags": {key: value for key, value in tags.items() if value},
+    }
+
+
+def read_wav(f, size: int):
+
+    byte_rate = None
+    data_size = None
+    tags = {}
+
+    position = 12
+    while position + 8 <= size:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack("<4sI", f.read(8))
+
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", f.read(16)[8:12])[0]
+        elif chunk_id == b"data":
+            data_size = min(chunk_size, size - position - 8)
+        elif chunk_id == b"LIST":
+            data = f.read(min(chunk_size, 65536))
+            if data[:4] == b"INFO":
+                read_riff_info(data[4:], tags)
+
+        position += 8 + chunk_size + (chunk_size & 1)
+
+    if not byte_rate or data_size is None:
+        return None
+
+    return make_format(WAV_FORMAT, data_size / byte_rate, tags)
+
+
+def read_riff_info(data: bytes, tags: dict):
+
+    position = 0
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack("<4sI", data[position:position + 8])
+        if chunk_id in RIFF_TAGS:
+            value = data[position + 8:position + 8 + chunk_size]
+            tags[RIFF_TAGS[chunk_id]] = value.split(b"\0")[0].decode("utf-8", "replace").strip()
+        position += 8 + chunk_size + (chunk_size & 1)
+
+
+def read_flac(f, start: int = 0):
+    """
+    :param start: offset of the fLaC marker, after the ID3 tag of the files that have one
+    """
+
+    duration = None
+    tags = {}
+
+    f.seek(start + 4)
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+
+        last = header[0] & 0x80
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:4], "big")
+
+        if block_type == 0:
+            data = f.read(length)
+            sample_rate = int.from_bytes(data[10:13], "big") >> 4
+            total_samples = int.from_bytes(data[13:18], "big") & 0xFFFFFFFFF
+            if sample_rate and total_samples:
+                duration = total_samples / sample_rate
+        elif block_type == 4:
+            read_vorbis_comment(f.read(length), tags)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+    if duration is None:
+        return None
+
+    return make_format(FLAC_FORMAT, duration, tags)
+
+
+def read_vorbis_comment(data: bytes, tags: dict):
+
+    vendor_length = struct.unpack("<I", data[:4])[0]
+    position = 4 + vendor_length
+    count = struct.unpack("<I", data[position:position + 4])[0]
+    position += 4
+
+    for _ in range(count):
+        length = struct.unpack("<I", data[position:position + 4])[0]
+        comment = data[position + 4:position + 4 + length].decode("utf-8", "replace")
+        position += 4 + length
+
+        key, _, value = comment.partition("=")
+        key = VORBIS_TAGS.get(key.upper())
+        if key is not None and key not in tags:
+            tags[key] = value
+
+
+def read_mp3(f, size: int):
+
+    tags = {}
+
+    f.seek(0)
+    header = f.read(10)
+    audio_start = 0
+    if header[:3] == b"ID3":
+        tag_size = synchsafe(header[6:10])
+        audio_start = id3_size(header)
+        read_id3v2(f.read(min(tag_size, MAX_HEADER_SIZE)), header[3], tags)
+
+    audio_end = size
+    if size >= 128:
+        f.seek(size - 128)
+        trailer = f.read(128)
+        if trailer[:3] == b"TAG":
+            audio_end -= 128
+            read_id3v1(trailer, tags)
+
+    # First frame of the audio, it must be followed by another frame of the same stream
+    f.seek(audio_start)
+    data = f.read(65536)
+    for offset in range(min(len(data) - 4, MP3_SYNC_WINDOW)):
+        if data[offset] == 0xFF and data[offset + 1] & 0xE0 == 0xE0:
+            frame = parse_mp3_frame_header(data[offset:offset + 4])
+            if frame is not None and is_next_mp3_frame(data, offset, frame, audio_end - audio_start):
+                break
+    else:
+        return None
+
+    version, bitrate, sample_rate, samples_per_frame, mono = frame
+    audio_start += offset
+
+    # Variable bit rate files have the number of frames in a Xing or VBRI header
+    frame_count = None
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = data[offset + 4 + side_info:offset + 4 + side_info + 12]
+    vbri = data[offset + 36:offset + 36 + 18]
+    if xing[:4] in (b"Xing", b"Info") and struct.unpack(">I", xing[4:8])[0] & 1:
+        frame_count = struct.unpack(">I", xing[8:12])[0]
+    elif vbri[:4] == b"VBRI":
+        frame_count = struct.unpack(">I", vbri[14:18])[0]
+
+    if frame_count:
+        duration = frame_count * samples_per_frame / sample_rate
+    else:
+        duration = (audio_end - audio_start) * 8 / (bitrate * 1000)
+
+    return make_format(MP3_FORMAT, duration, tags)
+
+
+def parse_mp3_frame_header(header: bytes):
+    """
+    :return: (version, kbit/s, sample rate, samples per frame, mono) tuple, None if it isn't a layer III header
+    """
+
+    version = {3: 1, 2: 2, 0: 2.5}.get((header[1] >> 3) & 3)
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+
+    if version is None or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index]
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if version == 1 else 576
+    mono = header[3] >> 6 == 3
+
+    return version, bitrate, sample_rate, samples_per_frame, mono
+
+
+def mp3_frame_length(header: bytes, frame: tuple) -> int:
+    version, bitrate, sample_rate, samples_per_frame, mono = frame
+    padding = (header[2] >> 1) & 1
+    return samples_per_frame // 8 * bitrate * 1000 // sample_rate + padding
+
+
+def is_next_mp3_frame(data: bytes, offset: int, frame: tuple, audio_size: int) -> bool:
+    """
+    Check that a frame header is followed by the header of another frame with the same version and sample rate,
+    or by the end of the audio
+    :param data: audio data
+    :param offset: offset of the frame header in data
+    :param frame: result of parse_mp3_frame_header() for the header
+    :param audio_size: size of the audio, from the start of data
+    """
+
+    next_offset = offset + mp3_frame_length(data[offset:offset + 4], frame)
+    if next_offset == audio_size:
+        return True
+
+    header = data[next_offset:next_offset + 4]
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return False
+
+    next_frame = parse_mp3_frame_header(header)
+    return next_frame is not None and next_frame[0] == frame[0] and next_frame[2] == frame[2]
+
+
+def id3_size(header: bytes) -> int:
+    """
+    :param header: first 10 bytes of an ID3v2 tag
+    :return: size of the tag, with its header and footer
+    """
+    return 10 + synchsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+
+
+def synchsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def read_id3v2(data: bytes, major_version: int, tags: dict):
+
+    if major_version == 2:
+        id_size, header_size = 3, 6
+    else:
+        id_size, header_size = 4, 10
+
+    position = 0
+    while position + header_size <= len(data):
+        frame_id = data[position:position + id_size]
+        if not frame_id.strip(b"\0"):
+            # Padding
+            break
+
+        if major_version == 2:
+            frame_size = int.from_bytes(data[position + 3:position + 6], "big")
+        elif major_version == 4:
+            frame_size = synchsafe(data[position + 4:position + 8])
+        else:
+            frame_size = int.from_bytes(data[position + 4:position + 8], "big")
+
+        if frame_id in ID3_TAGS:
+            value = decode_id3_text(data[position + header_size:position + header_size + frame_size])
+            if value:
+                tags[ID3_TAGS[frame_id]] = value
+
+        position += header_size + frame_size
+
+
+def decode_id3_text(data: bytes) -> str:
+
+    if not data:
+        return ""
+
+    encoding = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(data[0], "latin-1")
+    text = data[1:].decode(encoding, "replace")
+    # Multiple values are separated by null characters, only the first one is kept
+    return text.split("\0")[0].strip()
+
+
+def read_id3v1(data: bytes, tags: dict):
+
+    for key, start, end in (("title", 3, 33), ("artist", 33, 63), ("album", 63, 93)):
+        if key not in tags:
+            tags[key] = data[start:end].split(b"\0")[0].decode("latin-1").strip()
+
+
+def read_mp4(f, size: int):
+
+    duration = None
+    tags = {}
+
+    for atom_type, start, end in mp4_atoms(f, 0, size):
+        if atom_type != b"moov":
+            continue
+
+        for child_type, child_start, child_end in mp4_atoms(f, start, end):
+            if child_type == b"mvhd":
+                f.seek(child_start)
+                data = f.read(32)
+                if data[0] == 1:
+                    timescale, length = struct.unpack(">IQ", data[20:32])
+                else:
+                    timescale, length = struct.unpack(">II", data[12:20])
+                if timescale:
+                    duration = length / timescale
+            elif child_type == b"udta":
+                read_mp4_udta(f, child_start, child_end, tags)
+        break
+
+    if duration is None:
+        return None
+
+    return make_format(MP4_FORMAT, duration, tags)
+
+
+def mp4_atoms(f, start: int, end: int):
+    """
+    :return: generator of (type, start of the content, end) tuples of the atoms between two offsets
+    """
+
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        atom_size, atom_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+
+        if atom_size == 1:
+            atom_size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif atom_size == 0:
+            atom_size = end - position
+
+        if atom_size < header_size:
+            break
+
+        yield atom_type, position + header_size, min(position + atom_size, end)
+        position += atom_size
+
+
+def read_mp4_udta(f, start: int, end: int, tags: dict):
+
+    for atom_type, atom_start, atom_end in mp4_atoms(f, start, end):
+        if atom_type == b"meta":
+            # meta is a full box in MP4 files (version and flags before the children), but not in QuickTime files
+            f.seek(atom_start)
+            if f.read(4) == b"\0\0\0\0":
+                atom_start += 4
+
+            for child_type, child_start, child_end in mp4_atoms(f, atom_start, atom_end):
+                if child_type == b"ilst":
+                    read_mp4_ilst(f, child_start, child_end, tags)
+
+        elif atom_type in MP4_TAGS and atom_end - atom_start > 4:
+            # QuickTime text atom: length, language, text
+            f.seek(atom_start)
+            length = struct.unpack(">H", f.read(4)[:2])[0]
+            tags.setdefault(MP4_TAGS[atom_type], f.read(min(length, 65536)).decode("utf-8", "replace"))
+
+
+def read_mp4_ilst(f, start: int, end: int, tags: dict):
+
+    for item_type, item_start, item_end in mp4_atoms(f, start, end):
+        if item_type not in MP4_TAGS:
+            continue
+
+        for data_type, data_start, data_end in mp4_atoms(f, item_start, item_end):
+            if data_type == b"data" and data_end - data_start > 8:
+                # Type indicator and locale, then the value
+                f.seek(data_start + 8)
+                tags[MP4_TAGS[item_type]] = f.read(min(data_end - data_start - 8, 65536)).decode("utf-8",
+                                                                                                  "replace")
+                break
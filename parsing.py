@@ -1,3 +1,4 @@
+import codecs
 import hashlib
 import os
 import mimetypes
@@ -5,6 +6,8 @@ import subprocess
 import json
 import chardet
 import warnings
+from collections import Counter
+from threading import Thread, Lock
 import docx2txt
 import xlrd
 from pdfminer.pdfparser import PDFParser, PDFSyntaxError
@@ -13,6 +16,8 @@ from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.layout import LAParams, LTTextBox, LTTextLine
 from pdfminer.converter import PDFPageAggregator
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
 import html2text
 from ebooklib import epub
 import ebooklib
@@ -21,6 +26,10 @@ from fontTools.ttLib import TTFont, TTLibError
 import six
 from six.moves import xrange
 
+from fileio import open_file, read_views, device_slot
+from media import read_media_info
+import config
+
 
 class MimeGuesser:
     def guess_mime(self, full_path):
@@ -33,6 +42,13 @@ class ContentMimeGuesser(MimeGuesser):
         import magic
         self.libmagic = magic.Magic(mime=True)
 
+    def __getstate__(self):
+        # libmagic handles can't be sent to another process
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
     def guess_mime(self, full_path):
         try:
             return self.libmagic.from_file(full_path)
@@ -48,78 +64,135 @@ class ExtensionMimeGuesser(MimeGuesser):
 class FileParser:
     mime_types = []
     is_default = False
+    # Increment when the output of the parser changes, cached results of older versions are ignored
+    version = 1
 
-    def parse(self, full_path: str):
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
         raise NotImplemented
 
 
 class FileCheckSumCalculator:
+    name = None
+    # False if files with different content may get the same checksum
+    exact = True
+    # True if the checksum is calculated from the whole content of the file, see new()
+    streaming = True
+
+    def new(self):
+        """
+        :return: hashlib object that calculates the checksum
+        """
+        raise NotImplementedError()
+
     def checksum(self, path: str) -> str:
         """
         Calculate the checksum of a file
         :param path: path of the file
         :return: checksum
         """
-        raise NotImplementedError()
+        return compute_checksums(path, [self])[self.name]
 
 
 class Md5CheckSumCalculator(FileCheckSumCalculator):
     def __init__(self):
         self.name = "md5"
 
-    def checksum(self, path: str) -> str:
-        """
-        Calculate the md5 checksum of a file
-        :param path: path of the file
-        :return: md5 checksum
-        """
-        result = hashlib.md5()
-
-        with open(path, "rb") as f:
-            for block in iter(lambda: f.read(65536), b""):
-                result.update(block)
-
-        return result.hexdigest().upper()
+    def new(self):
+        return hashlib.md5()
 
 
 class Sha1CheckSumCalculator(FileCheckSumCalculator):
     def __init__(self):
         self.name = "sha1"
 
-    def checksum(self, path: str) -> str:
-        """
-        Calculate the sha1 checksum of a file
-        :param path: path of the file
-        :return: sha1 checksum
-        """
-        result = hashlib.sha1()
-
-        with open(path, "rb") as f:
-            for block in iter(lambda: f.read(65536), b""):
-                result.update(block)
-
-        return result.hexdigest().upper()
+    def new(self):
+        return hashlib.sha1()
 
 
 class Sha256CheckSumCalculator(FileCheckSumCalculator):
     def __init__(self):
         self.name = "sha256"
 
+    def new(self):
+        return hashlib.sha256()
+
+
+class FingerprintCheckSumCalculator(FileCheckSumCalculator):
+    """
+    Fingerprint calculated from the size of a file and samples of its start, middle and end. It is much faster
+    than a full checksum for large files, but files that only differ outside of the samples get the same
+    fingerprint. Files smaller than the samples are hashed completely
+    """
+    exact = False
+    streaming = False
+
+    def __init__(self):
+        self.name = "fingerprint"
+
     def checksum(self, path: str) -> str:
         """
-        Calculate the sha256 checksum of a file
+        Calculate the fingerprint of a file
         :param path: path of the file
-        :return: sha256 checksum
+        :return: fingerprint
         """
-        result = hashlib.sha256()
 
-        with open(path, "rb") as f:
-            for block in iter(lambda: f.read(65536), b""):
-                result.update(block)
+        result = hashlib.sha1()
+        sample_size = config.fingerprint_sample_size
+
+        with open_file(path, sequential=False, length=sample_size) as f:
+            size = os.fstat(f.fileno()).st_size
+            result.update(size.to_bytes(8, "little"))
+
+            if size <= sample_size * 3:
+                result.update(f.read())
+            else:
+                for offset in (0, (size - sample_size) // 2, size - sample_size):
+                    f.seek(offset)
+                    result.update(f.read(sample_size))
 
         return result.hexdigest().upper()
 
 
+def update_hashes(hashes: list, block):
+    for _, result in hashes:
+        result.update(block)
+
+
+def compute_checksums(path: str, calculators: list) -> dict:
+    """
+    Calculate several checksums of a file, reading it once. Each block is hashed in another thread
+    while the next block is read (hashlib releases the GIL)
+    :param path: path of the file
+    :param calculators: list of FileCheckSumCalculator
+    :return: dict of checksum name -> checksum
+    """
+
+    result = {calculator.name: calculator.checksum(path) for calculator in calculators if not calculator.streaming}
+
+    hashes = [(calculator.name, calculator.new()) for calculator in calculators if calculator.streaming]
+    if not hashes:
+        return result
+
+    with open_file(path) as f:
+        hasher = None
+        for block in read_views(f, config.checksum_block_size):
+            if hasher is not None:
+                hasher.join()
+
+            if len(block) < config.checksum_block_size and hasher is None:
+                # Small file, a thread would cost more than it saves
+                update_hashes(hashes, block)
+            else:
+                hasher = Thread(target=update_hashes, args=(hashes, block))
+                hasher.start()
+
+        if hasher is not None:
+            hasher.join()
+
+    result.update((name, digest.hexdigest().upper()) for name, digest in hashes)
+    return result
+
+
 class GenericFileParser(FileParser):
     mime_types = []
     is_default = True
@@ -129,16 +202,24 @@ class GenericFileParser(FileParser):
         self.root_dir = root_dir
         self.root_dir_len = len(root_dir)+1
 
-    def parse(self, full_path: str) -> dict:
+    def cache_key(self) -> str:
         """
-        Parse a generic file
-        :param full_path: path of the file to parse
+        Identifies the parser, its version and the options that change its output
+        """
+
+        return "%s:%d:%s:%s" % (type(self).__name__, self.version, getattr(self, "content_length", ""),
+                                ",".join(calculator.name for calculator in self.checksum_calculators))
+
+    def file_info(self, full_path: str, file_stat: os.stat_result) -> dict:
+        """
+        Get the information about a file that doesn't depend on its content
+        :param full_path: path of the file
+        :param file_stat: stat result of the file
         :return: dict information about the file
         """
 
         info = dict()
 
-        file_stat = os.stat(full_path)
         path, name = os.path.split(full_path)
         name, extension = os.path.splitext(name)
 
@@ -147,20 +228,45 @@ class GenericFileParser(FileParser):
         info["name"] = name
         info["extension"] = extension[1:]
         info["mtime"] = file_stat.st_mtime
+        info["inode"] = file_stat.st_ino
+
+        return info
+
+    def checksums(self, full_path: str) -> dict:
+        """
+        Calculate the checksums of a file
+        :param full_path: path of the file
+        :return: dict of checksum name -> checksum
+        """
+
+        return compute_checksums(full_path, self.checksum_calculators)
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None) -> dict:
+        """
+        Parse a generic file
+        :param full_path: path of the file to parse
+        :param file_stat: stat result of the file, if it is already known
+        :param checksums: checksums of the file, if they are already known
+        :return: dict information about the file
+        """
+
+        if file_stat is None:
+            file_stat = os.stat(full_path)
 
-        # TODO: calculate all checksums at once
-        for calculator in self.checksum_calculators:
-            info[calculator.name] = calculator.checksum(full_path)
+        info = self.file_info(full_path, file_stat)
+        info.update(self.checksums(full_path) if checksums is None else checksums)
 
         return info
 
 
 class MediaFileParser(GenericFileParser):
     is_default = False
+    version = 2
     relevant_properties = ["bit_rate", "nb_streams", "duration", "format_name", "format_long_name"]
 
-    def __init__(self, checksum_calculators: list, root_dir):
+    def __init__(self, checksum_calculators: list, root_dir, ffprobe_timeout: float = 60):
         super().__init__(checksum_calculators, root_dir)
+        self.ffprobe_timeout = ffprobe_timeout
 
         self.mime_types = [
             "video/3gpp", "video/mp4", "video/mpeg", "video/ogg", "video/quicktime",
@@ -172,39 +278,59 @@ class MediaFileParser(GenericFileParser):
             "audio/x-wav", "audio/x-ms-wma", "audio/x-flac",
         ]
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
-        p = subprocess.Popen(["ffprobe", "-v", "quiet", "-print_format", "json=c=1", "-show_format", full_path],
-                             stdout=subprocess.PIPE)
-        out, err = p.communicate()
+        # Headers of common formats are read directly, ffprobe is only started for the other formats
+        media_format = read_media_info(full_path)
+        if media_format is None:
+            with device_slot(full_path, file_stat):
+                media_format = self.ffprobe(full_path)
+        if media_format is None:
+            return info
 
-        try:
-            metadata = json.loads(out.decode("utf-8"))
+        if "duration" in media_format:
+            info["duration"] = float(media_format["duration"])
 
-            if "format" in metadata:
+        if "format_long_name" in media_format:
+            info["format_long_name"] = media_format["format_long_name"]
 
-                if "duration" in metadata["format"]:
-                    info["duration"] = float(metadata["format"]["duration"])
+        if "tags" in media_format:
+            if "genre" in media_format["tags"]:
+                info["genre"] = media_format["tags"]["genre"]
+            if "title" in media_format["tags"]:
+                info["title"] = media_format["tags"]["title"]
+            if "album" in media_format["tags"]:
+                info["album"] = media_format["tags"]["album"]
+            if "album_artist" in media_format["tags"]:
+                info["album_artist"] = media_format["tags"]["album_artist"]
 
-                if "format_long_name" in metadata["format"]:
-                    info["format_long_name"] = metadata["format"]["format_long_name"]
+        return info
+
+    def ffprobe(self, full_path: str):
+        """
+        Read the format of a media file with ffprobe
+        :param full_path: path of the file
+        :return: "format" object of ffprobe -show_format, None if ffprobe failed
+        """
 
-                if "tags" in metadata["format"]:
-                    if "genre" in metadata["format"]["tags"]:
-                        info["genre"] = metadata["format"]["tags"]["genre"]
-                    if "title" in metadata["format"]["tags"]:
-                        info["title"] = metadata["format"]["tags"]["title"]
-                    if "album" in metadata["format"]["tags"]:
-                        info["album"] = metadata["format"]["tags"]["album"]
-                    if "album_artist" in metadata["format"]["tags"]:
-                        info["album_artist"] = metadata["format"]["tags"]["album_artist"]
+        p = subprocess.Popen(["ffprobe", "-v", "quiet", "-print_format", "json=c=1", "-show_format", full_path],
+                             stdout=subprocess.PIPE)
+        try:
+            out, err = p.communicate(timeout=self.ffprobe_timeout)
+        except subprocess.TimeoutExpired:
+            print("ffprobe timed out: " + full_path)
+            return None
+        finally:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
 
+        try:
+            return json.loads(out.decode("utf-8")).get("format")
         except json.decoder.JSONDecodeError:
             print("json decode error:" + full_path)
-            pass
-
-        return info
+            return None
 
 
 class PictureFileParser(GenericFileParser):
@@ -229,12 +355,13 @@ class PictureFileParser(GenericFileParser):
             "image/x-rgb", "image/x-xbitmap", "image/x-xpixmap", "image/x-xwindowdump"
         ]
 
-    def parse(self, full_path: str):
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
 
-        info = super().parse(full_path)
+        info = super().parse(full_path, file_stat, checksums)
 
         try:
-            with open(full_path, "rb") as image_file:
+            # Only the header of the image is read
+            with open_file(full_path, sequential=False, length=65536) as image_file:
                 with Image.open(image_file) as image:
                     info["mode"] = image.mode
                     info["format_name"] = image.format
@@ -246,12 +373,115 @@ class PictureFileParser(GenericFileParser):
         return info
 
 
+class EncodingDetector:
+    """
+    Detects the encoding of text. Byte order marks, ASCII and UTF-8 are recognised without chardet. The encodings
+    found by chardet are counted: once most of the files of the directory have the same multi-byte encoding, it is
+    tried before chardet. Single-byte encodings decode almost any data so they are always left to chardet
+    """
+
+    BOMS = [
+        (codecs.BOM_UTF32_LE, "UTF-32"), (codecs.BOM_UTF32_BE, "UTF-32"), (codecs.BOM_UTF8, "UTF-8-SIG"),
+        (codecs.BOM_UTF16_LE, "UTF-16"), (codecs.BOM_UTF16_BE, "UTF-16"),
+    ]
+
+    def __init__(self):
+        self.encodings = Counter()  # encoding -> number of files, only for the encodings found by chardet
+        self.single_byte = {}  # encoding -> True if it is a single-byte encoding
+        # The detector is shared by the parse threads
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def detect(self, data: bytes, truncated: bool = False):
+        """
+        :param data: start of the text
+        :param truncated: True if data may end in the middle of a character
+        :return: name of the encoding, None if it is unknown
+        """
+
+        for bom, encoding in self.BOMS:
+            if data.startswith(bom):
+                return encoding
+
+        # Null bytes are likely UTF-16 without a byte order mark
+        if b"\0" not in data:
+            if data.isascii():
+                return "ascii"
+            if self.is_valid(data, "utf-8", truncated):
+                return "utf-8"
+
+            encoding = self.usual_encoding()
+            if encoding is not None and self.is_valid(data, encoding, truncated):
+                return encoding
+
+        detector = chardet.UniversalDetector()
+        for i in range(0, len(data), 512):
+            detector.feed(data[i:i + 512])
+            if detector.done:
+                break
+        encoding = detector.close()["encoding"]
+
+        if encoding is not None:
+            with self.lock:
+                self.encodings[encoding] += 1
+        return encoding
+
+    @staticmethod
+    def is_valid(data: bytes, encoding: str, truncated: bool) -> bool:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(data, final=not truncated)
+            return True
+        except (UnicodeDecodeError, LookupError):
+            return False
+
+    def usual_encoding(self):
+        """
+        :return: the encoding of most of the files seen by chardet so far, None if there isn't one yet
+        """
+
+        with self.lock:
+            total = sum(self.encodings.values())
+            if total < config.encoding_stats_min_files:
+                return None
+
+            encoding, count = self.encodings.most_common(1)[0]
+            if count < total * config.encoding_stats_ratio:
+                return None
+
+            single_byte = self.single_byte.get(encoding)
+            if single_byte is None:
+                single_byte = self.single_byte[encoding] = self.is_single_byte(encoding)
+
+        return None if single_byte else encoding
+
+    @staticmethod
+    def is_single_byte(encoding: str) -> bool:
+        """
+        :return: True if every byte is decoded on its own (a decoder of a multi-byte encoding waits for the
+        rest of a character after its first byte)
+        """
+
+        try:
+            return all(codecs.getincrementaldecoder(encoding)("replace").decode(bytes([b])) for b in range(256))
+        except LookupError:
+            return True
+
+
 class TextFileParser(GenericFileParser):
     is_default = False
 
     def __init__(self, checksum_calculators: list, content_length: int, root_dir):
         super().__init__(checksum_calculators, root_dir)
         self.content_length = content_length
+        self.encoding_detector = EncodingDetector()
 
         self.mime_types = [
             "text/asp", "text/css", "text/ecmascript", "text/html", "text/javascript",
@@ -277,15 +507,14 @@ class TextFileParser(GenericFileParser):
             "text/x-makefile", "application/javascript", "application/rtf", "application/json",
         ]
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
         if self.content_length > 0:
-            with open(full_path, "rb") as text_file:
+            with open_file(full_path, length=self.content_length) as text_file:
                 raw_content = text_file.read(self.content_length)
 
-                chardet.detect(raw_content)
-                encoding = chardet.detect(raw_content)["encoding"]
+                encoding = self.encoding_detector.detect(raw_content, len(raw_content) == self.content_length)
 
                 if encoding is not None:
                     info["encoding"] = encoding
@@ -309,11 +538,11 @@ class FontParser(GenericFileParser):
             "application/x-font-ttf"
         ]
 
-    def parse(self, full_path: str):
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
 
-        info = super().parse(full_path)
+        info = super().parse(full_path, file_stat, checksums)
 
-        with open(full_path, "rb") as f:
+        with open_file(full_path, sequential=False) as f:
 
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
@@ -335,23 +564,99 @@ class FontParser(GenericFileParser):
         return info
 
 
+class PdfTextLimitReached(Exception):
+    pass
+
+
+class PdfTextDevice(PDFDevice):
+    """
+    Collects the text of the pages as it is drawn, without layout analysis. Strings drawn at another height
+    than the previous string start a new line
+    """
+
+    def __init__(self, resource_manager: PDFResourceManager, content_length: int):
+        super().__init__(resource_manager)
+        self.content_length = content_length
+        self.parts = []
+        self.length = 0
+        self.last_position = None
+
+    def add(self, text: str):
+        if self.length + len(text) >= self.content_length:
+            self.parts.append(text[:self.content_length - self.length])
+            self.length = self.content_length
+            raise PdfTextLimitReached()
+
+        self.parts.append(text)
+        self.length += len(text)
+
+    def render_string(self, textstate, seq, ncs, graphicstate):
+        font = textstate.font
+        if font is None:
+            return
+
+        position = textstate.matrix[4:6]
+        if self.last_position is not None and position != self.last_position:
+            self.add("\n" if position[1] != self.last_position[1] else " ")
+        self.last_position = position
+
+        chars = []
+        for obj in seq:
+            if isinstance(obj, bytes):
+                for cid in font.decode(obj):
+                    try:
+                        chars.append(font.to_unichr(cid))
+                    except PDFUnicodeNotDefined:
+                        pass
+            elif obj < -200:
+                # Large adjustments between the strings of a TJ array separate words
+                chars.append(" ")
+
+        if chars:
+            self.add("".join(chars))
+
+    def end_page(self, page):
+        self.add("\n")
+        self.last_position = None
+
+    def get_text(self) -> str:
+        return "".join(self.parts)
+
+
 class PdfFileParser(GenericFileParser):
     is_default = False
 
-    def __init__(self, checksum_calculators: list, content_length: int, root_dir):
+    def __init__(self, checksum_calculators: list, content_length: int, root_dir, fast: bool = False,
+                 max_pages: int = 0):
+        """
+        :param fast: extract the text without layout analysis. The text is in the order it is drawn, and
+        columns are not told apart
+        :param max_pages: maximum number of pages read from a document, 0 for no limit
+        """
         super().__init__(checksum_calculators, root_dir)
 
         self.content_length = content_length
+        self.fast = fast
+        self.max_pages = max_pages
 
         self.mime_types = [
             "application/pdf", "application/x-pdf"
         ]
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def cache_key(self) -> str:
+        return "%s:%s:%d" % (super().cache_key(), "fast" if self.fast else "layout", self.max_pages)
+
+    def pages(self, document: PDFDocument):
+        for i, page in enumerate(PDFPage.create_pages(document)):
+            if 0 < self.max_pages <= i:
+                break
+            yield page
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
         if self.content_length > 0:
-            with open(full_path, "rb") as f:
+            with open_file(full_path, sequential=False) as f:
 
                 try:
                     parser = PDFParser(f)
@@ -368,37 +673,60 @@ class PdfFileParser(GenericFileParser):
                         info["content"] += document.info[0]["Title"].resolve().decode("utf-8", "replace") + "\n"
 
                 try:
-                    if document.is_extractable:
-                        resource_manager = PDFResourceManager()
-                        la_params = LAParams()
+                    if not document.is_extractable:
+                        print("PDF is not extractable: " + full_path)
+                    elif self.fast:
+                        info["content"] += self.extract_text(document, self.content_length - len(info["content"]))
+                    else:
+                        info["content"] += self.extract_layout_text(document,
+                                                                    self.content_length - len(info["content"]))
+                except ValueError:
+                    print("Couldn't parse page for " + full_path)
 
-                        device = PDFPageAggregator(resource_manager, laparams=la_params)
-                        interpreter = PDFPageInterpreter(resource_manager, device)
+        return info
 
-                        for page in PDFPage.create_pages(document):
+    def extract_text(self, document: PDFDocument, content_length: int) -> str:
+        """Extract the text of a document as it is drawn, until content_length characters are found"""
 
-                            interpreter.process_page(page)
-                            layout = device.get_result()
+        resource_manager = PDFResourceManager()
+        device = PdfTextDevice(resource_manager, content_length)
+        interpreter = PDFPageInterpreter(resource_manager, device)
 
-                            for lt_obj in layout:
-                                if isinstance(lt_obj, LTTextBox) or isinstance(lt_obj, LTTextLine):
+        try:
+            for page in self.pages(document):
+                interpreter.process_page(page)
+        except PdfTextLimitReached:
+            pass
 
-                                    text = lt_obj.get_text()
+        return device.get_text()
 
-                                    if len(info["content"]) + len(text) <= self.content_length:
-                                        info["content"] += text
-                                    else:
-                                        info["content"] += text[0:self.content_length - len(info["content"])]
-                                        break
-                            else:
-                                continue
-                            break
+    def extract_layout_text(self, document: PDFDocument, content_length: int) -> str:
+        """Extract the text boxes of a document found by layout analysis, until content_length characters are found"""
+
+        content = ""
+
+        resource_manager = PDFResourceManager()
+        la_params = LAParams()
+
+        device = PDFPageAggregator(resource_manager, laparams=la_params)
+        interpreter = PDFPageInterpreter(resource_manager, device)
+
+        for page in self.pages(document):
+
+            interpreter.process_page(page)
+            layout = device.get_result()
+
+            for lt_obj in layout:
+                if isinstance(lt_obj, LTTextBox) or isinstance(lt_obj, LTTextLine):
+
+                    text = lt_obj.get_text()
+
+                    if len(content) + len(text) <= content_length:
+                        content += text
                     else:
-                        print("PDF is not extractable: " + full_path)
-                except ValueError:
-                    print("Couldn't parse page for " + full_path)
+                        return content + text[0:content_length - len(content)]
 
-        return info
+        return content
 
 
 class EbookParser(GenericFileParser):
@@ -417,10 +745,11 @@ class EbookParser(GenericFileParser):
         self.html2text.ignore_images = True
         self.html2text.ignore_emphasis = True
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
-        book = epub.read_epub(full_path)
+        with device_slot(full_path, file_stat):
+            book = epub.read_epub(full_path)
 
         info["content"] = ""
 
@@ -449,12 +778,13 @@ class DocxParser(GenericFileParser):
             "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         ]
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
         if self.content_length > 0:
             try:
-                text = docx2txt.process(full_path)
+                with device_slot(full_path, file_stat):
+                    text = docx2txt.process(full_path)
 
                 if len(text) < self.content_length:
                     info["content"] = text
@@ -478,15 +808,16 @@ class SpreadSheetParser(GenericFileParser):
             "application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         ]
 
-    def parse(self, full_path: str):
-        info = super().parse(full_path)
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        info = super().parse(full_path, file_stat, checksums)
 
         # The MIT License (MIT)
         # Copyright (c) 2014 Dean Malmgren
         # https://github.com/deanmalmgren/textract/blob/master/textract/parsers/xlsx_parser.py
 
         try:
-            workbook = xlrd.open_workbook(full_path)
+            with device_slot(full_path, file_stat):
+                workbook = xlrd.open_workbook(full_path)
 
             sheets_name = workbook.sheet_names()
             info["content"] = ""
@@ -2,23 +2,25 @@ import json
 import logging
 import os
 import shutil
+import time
 from io import BytesIO
 
 import bcrypt
 import humanfriendly
 from PIL import Image
-from flask import Flask, render_template, request, redirect, flash, session, abort, send_file
+from flask import Flask, render_template, request, redirect, flash, session, abort, send_file, Response
 
 import config
 from crawler import TaskManager
 from search import Search
 from storage import Directory, Option, Task, User
-from storage import LocalStorage, DuplicateDirectoryException, DuplicateUserException
+from storage import LocalStorage, DuplicateDirectoryException, DuplicateUserException, InvalidOptionException
 from thumbnail import ThumbnailGenerator
 
 app = Flask(__name__)
 app.secret_key = "A very secret key"
 storage = LocalStorage(config.db_path)
+storage.upgrade_db()
 
 # Disable flask logging
 flaskLogger = logging.getLogger('werkzeug')
@@ -278,7 +280,9 @@ def search_route():
 
     path = request.json["path"]
 
+    start = time.time()
     page = search.search(query, size_min, size_max, mime_types, must_match, directories, path)
+    tm.search_latency.record(time.time() - start)
 
     return json.dumps(page)
 
@@ -329,8 +333,12 @@ def directory_manage(dir_id):
         tn_size = get_dir_size("static/thumbnails/" + str(dir_id))
         tn_size_formatted = humanfriendly.format_size(tn_size)
 
+        benchmarks = storage.benchmarks(dir_id)
+        for benchmark in benchmarks:
+            benchmark["time"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(benchmark["time"]))
+
         return render_template("directory_manage.html", directory=directory, tn_size=tn_size,
-                               tn_size_formatted=tn_size_formatted)
+                               tn_size_formatted=tn_size_formatted, benchmarks=benchmarks)
     flash("You are not authorized to access this page", "warning")
     return redirect("/")
 
@@ -373,7 +381,10 @@ def directory_update_opt(dir_id):
         opt_key = request.args.get("key")
         opt_value = request.args.get("value")
 
-        storage.update_option(Option(opt_key, opt_value, dir_id, opt_id))
+        try:
+            storage.update_option(Option(opt_key, opt_value, dir_id, opt_id))
+        except InvalidOptionException as e:
+            flash("<strong>The option couldn't be updated</strong> " + str(e), "danger")
 
         return redirect("/directory/" + str(dir_id))
     flash("You are not authorized to access this page", "warning")
@@ -432,9 +443,31 @@ def task():
 def get_current_task():
     if "admin" in session and session["admin"]:
 
-        if tm and tm.current_task:
-            return tm.current_task.to_json()
-        return ""
+        if tm:
+            return json.dumps([running_task.to_dict() for running_task in list(tm.running_tasks.values())])
+        return "[]"
+    flash("You are not authorized to access this page", "warning")
+    return redirect("/")
+
+
+@app.route("/task/progress")
+def task_progress():
+    if "admin" in session and session["admin"]:
+
+        def stream():
+            # The stream ends once no task is running, or after progress_stream_duration seconds so that
+            # the server doesn't hold the connection forever. The EventSource of the page reconnects after
+            # task_check_interval, when the waiting tasks may have started
+            yield "retry: " + str(config.task_check_interval * 1000) + "\n\n"
+            end_time = time.time() + config.progress_stream_duration
+            while True:
+                progress = [running_task.to_dict() for running_task in list(tm.running_tasks.values())]
+                yield "data: " + json.dumps(progress) + "\n\n"
+                if not progress or time.time() >= end_time:
+                    break
+                time.sleep(config.progress_interval)
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
     flash("You are not authorized to access this page", "warning")
     return redirect("/")
 
@@ -445,7 +478,7 @@ def task_add():
         task_type = request.args.get("type")
         directory = request.args.get("directory")
 
-        if task_type not in ("1", "2"):
+        if task_type not in ("1", "2", "3", "4", "5"):
             flash("Please choose a task type", "danger")
             return redirect("/task")
 
@@ -464,9 +497,26 @@ def task_del(task_id):
     if "admin" in session and session["admin"]:
         storage.del_task(task_id)
 
-        if tm.current_task is not None and task_id == tm.current_task.task.id:
-            tm.cancel_task()
+        tm.cancel_task(task_id)
+
+        return redirect("/task")
+    flash("You are not authorized to access this page", "warning")
+    return redirect("/")
+
+
+@app.route("/task/<int:task_id>/pause")
+def task_pause(task_id):
+    if "admin" in session and session["admin"]:
+        tm.pause_task(task_id)
+        return redirect("/task")
+    flash("You are not authorized to access this page", "warning")
+    return redirect("/")
+
 
+@app.route("/task/<int:task_id>/resume")
+def task_resume(task_id):
+    if "admin" in session and session["admin"]:
+        tm.resume_task(task_id)
         return redirect("/task")
     flash("You are not authorized to access this page", "warning")
     return redirect("/")
@@ -28,6 +28,84 @@ class Search:
                                    "query": {"term": {"directory": dir_id}}},
                             index=self.index_name)
 
+    @staticmethod
+    def get_rel_path(doc: dict) -> str:
+        """
+        Get the path of a document's file relative to its directory
+        """
+
+        extension = "" if not doc.get("extension") else "." + doc["extension"]
+        return os.path.normpath(os.path.join(doc["path"], doc["name"] + extension))
+
+    def get_file_states(self, dir_id: int) -> dict:
+        """
+        Get the state of every file indexed for a directory
+        :param dir_id: id of the directory
+        :return: dict of relative file path -> {"id", "size", "mtime", "inode"}
+        """
+
+        states = {}
+
+        for doc in helpers.scan(client=self.es,
+                                query={"_source": {"includes": ["path", "name", "extension", "size", "mtime",
+                                                                "inode"]},
+                                       "query": {"term": {"directory": dir_id}}},
+                                index=self.index_name):
+            states[Search.get_rel_path(doc["_source"])] = {
+                "id": doc["_id"],
+                "size": doc["_source"].get("size"),
+                "mtime": doc["_source"].get("mtime"),
+                "inode": doc["_source"].get("inode"),
+            }
+
+        return states
+
+    def get_fingerprint_collisions(self, dir_id: int):
+        """
+        Get the documents of a directory whose fingerprint is shared with other documents of the directory.
+        The fingerprints are paged through with a composite aggregation
+        :param dir_id: id of the directory
+        :return: generator of documents with their path, name, extension and sha256 fields
+        """
+
+        field = "fingerprint"
+        after_key = None
+
+        while True:
+            composite = {"size": 1000, "sources": [{"fingerprint": {"terms": {"field": field}}}]}
+            if after_key is not None:
+                composite["after"] = after_key
+
+            try:
+                query = self.es.search(body={
+                    "size": 0,
+                    "query": {"term": {"directory": dir_id}},
+                    "aggs": {"fingerprints": {"composite": composite}}
+                }, index=self.index_name)
+            except elasticsearch.exceptions.RequestError:
+                if field != "fingerprint":
+                    raise
+                # The field is mapped as text in indices created before fingerprints were added, the
+                # dynamic mapping has a keyword sub-field
+                field = "fingerprint.keyword"
+                continue
+
+            aggregation = query["aggregations"]["fingerprints"]
+            # Composite aggregations don't support min_doc_count
+            fingerprints = [bucket["key"]["fingerprint"] for bucket in aggregation["buckets"]
+                            if bucket["doc_count"] >= 2]
+
+            if fingerprints:
+                yield from helpers.scan(client=self.es,
+                                        query={"_source": {"includes": ["path", "name", "extension", "sha256"]},
+                                               "query": {"bool": {"filter": [{"term": {"directory": dir_id}},
+                                                                             {"terms": {field: fingerprints}}]}}},
+                                        index=self.index_name)
+
+            if not aggregation["buckets"] or "after_key" not in aggregation:
+                break
+            after_key = aggregation["after_key"]
+
     def get_index_size(self):
 
         try:
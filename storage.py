@@ -1,5 +1,8 @@
+import json
 import os
+import re
 import sqlite3
+import threading
 import time
 
 import flask_bcrypt
@@ -24,6 +27,10 @@ class DuplicateUserException(Exception):
     pass
 
 
+class InvalidOptionException(Exception):
+    pass
+
+
 class User:
     """
     Data structure to hold user information
@@ -47,6 +54,27 @@ class Option:
         self.id = opt_id
         self.dir_id = dir_id
 
+    def check(self):
+        """
+        Check the value of the option before it is saved, so that the tasks of the directory don't fail on it
+        :raise InvalidOptionException: if the value is invalid
+        """
+
+        value = self.value.strip()
+        try:
+            if self.key == "MaxDepth" and value and int(value) < 0:
+                raise ValueError("must be empty or at least 0")
+            elif self.key in ("MaxFileSize", "MaxReadRate", "ThumbnailSize", "ThumbnailQuality"):
+                int(value)
+            elif self.key in ("MaxFileRate", "MaxIndexRate"):
+                float(value)
+            elif self.key == "Exclude":
+                for pattern in value.split(","):
+                    if pattern.strip().startswith("re:"):
+                        re.compile(pattern.strip()[3:])
+        except (ValueError, re.error) as e:
+            raise InvalidOptionException("Invalid value for " + self.key + ": " + str(e))
+
 
 class Directory:
     """
@@ -69,7 +97,8 @@ class Directory:
             if option.key == key:
                 return option.value
 
-        return None
+        # Directories created before the option was added
+        return config.default_options.get(key)
 
     def set_default_options(self):
 
@@ -82,14 +111,19 @@ class Directory:
 class Task:
     INDEX = 1
     GEN_THUMBNAIL = 2
+    INCREMENTAL_INDEX = 3
+    BENCHMARK = 4
+    DISTRIBUTED_INDEX = 5
 
     def __init__(self, task_type: int, dir_id: int, completed: bool = False, completed_time: time.time = None,
-                 task_id: int = None):
+                 task_id: int = None, paused: bool = False, failed: bool = False):
         self.id = task_id
         self.type = task_type
         self.dir_id = dir_id
         self.completed = completed
         self.completed_time = completed_time
+        self.paused = paused
+        self.failed = failed
 
 
 class LocalStorage:
@@ -106,6 +140,14 @@ class LocalStorage:
         self.dir_cache_outdated = True  # Indicates that the database was changed since it was cached in memory
         self.user_cache_outdated = True
         self.task_cache_outdated = True
+        self.task_listeners = []  # Called when a task is added, modified or deleted
+
+    def add_task_listener(self, callback):
+        self.task_listeners.append(callback)
+
+    def notify_task_listeners(self):
+        for callback in self.task_listeners:
+            callback()
 
     def init_db(self, script_path):
         """Creates a blank database. Overwrites the old one"""
@@ -121,6 +163,29 @@ class LocalStorage:
         c.close()
         conn.close()
 
+    def upgrade_db(self):
+        """Add the tables and columns that are missing from databases created by older versions"""
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+
+        c.execute("PRAGMA table_info(Task)")
+        columns = [column[1] for column in c.fetchall()]
+        if "paused" not in columns:
+            c.execute("ALTER TABLE Task ADD COLUMN paused BOOLEAN DEFAULT 0")
+        if "failed" not in columns:
+            c.execute("ALTER TABLE Task ADD COLUMN failed BOOLEAN DEFAULT 0")
+
+        c.execute("CREATE TABLE IF NOT EXISTS CrawlJournal (task_id INTEGER, path TEXT, "
+                  "FOREIGN KEY (task_id) REFERENCES Task(id))")
+        c.execute("CREATE INDEX IF NOT EXISTS CrawlJournal_task_id ON CrawlJournal (task_id)")
+        c.execute("CREATE TABLE IF NOT EXISTS Benchmark (id INTEGER PRIMARY KEY AUTOINCREMENT, directory_id INTEGER, "
+                  "time INTEGER, report TEXT, FOREIGN KEY (directory_id) REFERENCES Directory(id))")
+
+        conn.commit()
+        c.close()
+        conn.close()
+
     def save_directory(self, directory: Directory):
         """
         Save directory to storage
@@ -161,7 +226,9 @@ class LocalStorage:
         c = conn.cursor()
 
         c.execute("DELETE FROM Option WHERE directory_id=?", (dir_id,))
+        c.execute("DELETE FROM CrawlJournal WHERE task_id IN (SELECT id FROM Task WHERE directory_id=?)", (dir_id,))
         c.execute("DELETE FROM Task WHERE directory_id=?", (dir_id,))
+        c.execute("DELETE FROM Benchmark WHERE directory_id=?", (dir_id,))
         c.execute("DELETE FROM Directory WHERE id=?", (dir_id,))
 
         c.close()
@@ -312,6 +379,7 @@ class LocalStorage:
 
     def save_option(self, option: Option):
 
+        option.check()
         self.dir_cache_outdated = True
 
         conn = sqlite3.connect(self.db_path)
@@ -342,6 +410,7 @@ class LocalStorage:
     def update_option(self, option: Option):
         """Updates an option"""
 
+        option.check()
         self.dir_cache_outdated = True
 
         conn = sqlite3.connect(self.db_path)
@@ -368,6 +437,8 @@ class LocalStorage:
         c.close()
         conn.close()
 
+        self.notify_task_listeners()
+
         return task_id
 
     def tasks(self):
@@ -379,7 +450,7 @@ class LocalStorage:
 
             conn = sqlite3.connect(self.db_path)
             c = conn.cursor()
-            c.execute("SELECT id, directory_id, type, completed, completed_time FROM Task")
+            c.execute("SELECT id, directory_id, type, completed, completed_time, paused, failed FROM Task")
 
             tasks = c.fetchall()
 
@@ -387,7 +458,8 @@ class LocalStorage:
             conn.close()
 
             for db_task in tasks:
-                task = Task(db_task[2], db_task[1], db_task[3], db_task[4], db_task[0])
+                task = Task(db_task[2], db_task[1], db_task[3], db_task[4], db_task[0], bool(db_task[5]),
+                            bool(db_task[6]))
                 self.cached_tasks[task.id] = task
 
             self.task_cache_outdated = False
@@ -403,12 +475,84 @@ class LocalStorage:
 
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
+        c.execute("DELETE FROM CrawlJournal WHERE task_id=?", (task_id,))
         c.execute("DELETE FROM Task WHERE id=?", (task_id,))
 
         conn.commit()
         c.close()
         conn.close()
 
+        self.notify_task_listeners()
+
+    def set_task_paused(self, task_id, paused: bool, failed: bool = False):
+        """
+        Pause or resume a task
+        :param failed: the task is paused because it failed
+        """
+
+        self.task_cache_outdated = True
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute("UPDATE Task SET paused=?, failed=? WHERE id=?", (paused, paused and failed, task_id))
+
+        conn.commit()
+        c.close()
+        conn.close()
+
+        self.notify_task_listeners()
+
+    def save_journal(self, task_id, paths: list):
+        """Record files that were indexed by a crawl task"""
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.executemany("INSERT INTO CrawlJournal (task_id, path) VALUES (?,?)", [(task_id, path) for path in paths])
+
+        conn.commit()
+        c.close()
+        conn.close()
+
+    def journal(self, task_id) -> set:
+        """Get the files that were already indexed by a crawl task"""
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute("SELECT path FROM CrawlJournal WHERE task_id=?", (task_id,))
+
+        paths = set(row[0] for row in c.fetchall())
+
+        c.close()
+        conn.close()
+
+        return paths
+
+    def save_benchmark(self, dir_id, report: dict):
+        """Save the results of a benchmark task"""
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute("INSERT INTO Benchmark (directory_id, time, report) VALUES (?,?,?)",
+                  (dir_id, int(time.time()), json.dumps(report)))
+
+        conn.commit()
+        c.close()
+        conn.close()
+
+    def benchmarks(self, dir_id) -> list:
+        """Get the results of the benchmarks of a directory, most recent first"""
+
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute("SELECT time, report FROM Benchmark WHERE directory_id=? ORDER BY id DESC", (dir_id,))
+
+        benchmarks = [dict(json.loads(row[1]), time=row[0]) for row in c.fetchall()]
+
+        c.close()
+        conn.close()
+
+        return benchmarks
+
     def set_access(self, username, dir_id, has_access):
 
         conn = sqlite3.connect(self.db_path)
@@ -440,3 +584,269 @@ class LocalStorage:
             access_list.append(access[1])
 
         return access_list
+
+
+class ParseCache:
+    """
+    On-disk cache of parser results, keyed by file identity (device, inode, size, mtime)
+    and by the parser's cache key (name, version and options). Results that were not used for
+    parse_cache_max_age seconds, and the least recently used results beyond parse_cache_max_entries, are pruned
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.added = 0
+
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS ParseCache (dev INTEGER, ino INTEGER, size INTEGER, "
+                     "mtime INTEGER, parser TEXT, doc TEXT, used REAL DEFAULT 0, "
+                     "PRIMARY KEY (dev, ino, size, mtime, parser))")
+        # Caches created before the results were pruned, their results count as used now
+        if "used" not in [row[1] for row in conn.execute("PRAGMA table_info(ParseCache)")]:
+            conn.execute("ALTER TABLE ParseCache ADD COLUMN used REAL DEFAULT 0")
+            conn.execute("UPDATE ParseCache SET used=?", (time.time(),))
+        conn.execute("CREATE INDEX IF NOT EXISTS ParseCacheUsed ON ParseCache (used)")
+        conn.commit()
+
+    def connection(self):
+        """Each thread (and each process) gets its own connection"""
+
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.conn = sqlite3.connect(self.db_path, timeout=30)
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn.execute("PRAGMA synchronous=OFF")
+            self.local.pid = os.getpid()
+
+        return self.local.conn
+
+    @staticmethod
+    def file_key(file_stat: os.stat_result) -> tuple:
+        return file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def get(self, parser, file_stat: os.stat_result):
+        """
+        Get the cached result of a parser for a file
+        :return: parsed document, None if it is not in the cache
+        """
+
+        key = self.file_key(file_stat) + (parser.cache_key(),)
+        try:
+            conn = self.connection()
+            c = conn.cursor()
+            c.execute("SELECT doc FROM ParseCache WHERE dev=? AND ino=? AND size=? AND mtime=? AND parser=?", key)
+            row = c.fetchone()
+            c.close()
+
+            if row is not None:
+                conn.execute("UPDATE ParseCache SET used=? WHERE dev=? AND ino=? AND size=? AND mtime=? AND parser=?",
+                             (time.time(),) + key)
+                conn.commit()
+        except sqlite3.Error as e:
+            print("Parse cache error: " + str(e))
+            return None
+
+        return None if row is None else json.loads(row[0])
+
+    def put(self, parser, file_stat: os.stat_result, doc: dict):
+
+        try:
+            conn = self.connection()
+            conn.execute("INSERT OR REPLACE INTO ParseCache (dev, ino, size, mtime, parser, doc, used) "
+                         "VALUES (?,?,?,?,?,?,?)",
+                         self.file_key(file_stat) + (parser.cache_key(), json.dumps(doc), time.time()))
+            conn.commit()
+        except sqlite3.Error as e:
+            print("Parse cache error: " + str(e))
+            return
+
+        # Counted per process, without a lock: the cache is pruned about every parse_cache_prune_interval results
+        self.added += 1
+        if self.added >= config.parse_cache_prune_interval:
+            self.added = 0
+            self.prune()
+
+    def prune(self):
+        """Remove the results that are too old, then the least recently used results beyond the maximum count"""
+
+        try:
+            conn = self.connection()
+            conn.execute("DELETE FROM ParseCache WHERE used < ?", (time.time() - config.parse_cache_max_age,))
+            conn.execute("DELETE FROM ParseCache WHERE rowid IN (SELECT rowid FROM ParseCache ORDER BY used DESC "
+                         "LIMIT -1 OFFSET ?)", (config.parse_cache_max_entries,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print("Parse cache error: " + str(e))
+
+    def clear(self):
+        conn = self.connection()
+        conn.execute("DELETE FROM ParseCache")
+        conn.commit()
+
+    def __getstate__(self):
+        # Connections can't be shared with other processes
+        return {"db_path": self.db_path}
+
+    def __setstate__(self, state):
+        self.db_path = state["db_path"]
+        self.local = threading.local()
+        self.added = 0
+
+
+class WorkQueue:
+    """
+    Durable queue of the work units (sub-trees of a directory) of distributed crawls. The database can be
+    shared by workers on several hosts. The units of workers that stop sending heartbeats are handed out again
+    """
+
+    PENDING = 0
+    CLAIMED = 1
+    DONE = 2
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS WorkTask (task_id INTEGER PRIMARY KEY, directory TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS WorkUnit (id INTEGER PRIMARY KEY AUTOINCREMENT, task_id INTEGER, "
+                     "path TEXT, recursive BOOLEAN, state INTEGER DEFAULT 0, worker TEXT, heartbeat REAL, "
+                     "attempts INTEGER DEFAULT 0, parsed_files INTEGER DEFAULT 0, total_files INTEGER DEFAULT 0)")
+        conn.execute("CREATE INDEX IF NOT EXISTS WorkUnit_task_id_state ON WorkUnit (task_id, state)")
+        conn.execute("CREATE TABLE IF NOT EXISTS WorkJournal (unit_id INTEGER, path TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS WorkJournal_unit_id ON WorkJournal (unit_id)")
+
+    def connection(self):
+        """Each thread (and each process) gets its own connection. Transactions are started explicitly"""
+
+        if getattr(self.local, "pid", None) != os.getpid():
+            # No WAL, it doesn't work with databases on network file systems
+            self.local.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            self.local.pid = os.getpid()
+
+        return self.local.conn
+
+    def add_task(self, task_id: int, directory: Directory, units: list):
+        """
+        Queue the work units of a crawl task
+        :param directory: directory to crawl, the workers read its options from the queue
+        :param units: (path, recursive) tuples
+        """
+
+        directory_json = json.dumps({"id": directory.id, "path": directory.path, "name": directory.name,
+                                     "options": {option.key: option.value for option in directory.options}})
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR REPLACE INTO WorkTask (task_id, directory) VALUES (?,?)", (task_id, directory_json))
+        conn.executemany("INSERT INTO WorkUnit (task_id, path, recursive) VALUES (?,?,?)",
+                         [(task_id, path, recursive) for path, recursive in units])
+        conn.execute("COMMIT")
+
+    def has_task(self, task_id: int) -> bool:
+        c = self.connection().execute("SELECT 1 FROM WorkTask WHERE task_id=?", (task_id,))
+        return c.fetchone() is not None
+
+    def directory(self, task_id: int):
+        """Get the directory of a crawl task, None if the task was removed"""
+
+        row = self.connection().execute("SELECT directory FROM WorkTask WHERE task_id=?", (task_id,)).fetchone()
+        if row is None:
+            return None
+
+        data = json.loads(row[0])
+        directory = Directory(data["path"], True, [Option(key, value, data["id"]) for key, value in
+                                                   data["options"].items()], data["name"])
+        directory.id = data["id"]
+        return directory
+
+    def claim(self, worker: str, task_id: int = None):
+        """
+        Claim the next pending unit, or a unit whose worker stopped sending heartbeats
+        :param worker: id of the worker
+        :param task_id: only claim the units of this task
+        :return: (unit id, task id, path, recursive, attempts) tuple, None if there is no unit to claim
+        """
+
+        now = time.time()
+        expired = now - config.work_unit_lease
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            query = "SELECT id, task_id, path, recursive, attempts FROM WorkUnit " \
+                    "WHERE (state=? OR (state=? AND heartbeat<?))"
+            args = (WorkQueue.PENDING, WorkQueue.CLAIMED, expired)
+            if task_id is not None:
+                query += " AND task_id=?"
+                args += (task_id,)
+
+            row = conn.execute(query + " ORDER BY id LIMIT 1", args).fetchone()
+            if row is not None:
+                conn.execute("UPDATE WorkUnit SET state=?, worker=?, heartbeat=?, attempts=attempts+1 WHERE id=?",
+                             (WorkQueue.CLAIMED, worker, now, row[0]))
+        finally:
+            conn.execute("COMMIT")
+
+        return None if row is None else (row[0], row[1], row[2], bool(row[3]), row[4] + 1)
+
+    def heartbeat(self, unit_id: int, worker: str, parsed_files: int, total_files: int) -> bool:
+        """
+        Extend the lease of a claimed unit and report its progress
+        :return: False if the unit was handed to another worker or removed
+        """
+
+        c = self.connection().execute("UPDATE WorkUnit SET heartbeat=?, parsed_files=?, total_files=? "
+                                      "WHERE id=? AND worker=? AND state=?",
+                                      (time.time(), parsed_files, total_files, unit_id, worker, WorkQueue.CLAIMED))
+        return c.rowcount == 1
+
+    def complete(self, unit_id: int, worker: str, parsed_files: int, total_files: int):
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.execute("UPDATE WorkUnit SET state=?, parsed_files=?, total_files=? WHERE id=? AND worker=?",
+                         (WorkQueue.DONE, parsed_files, total_files, unit_id, worker))
+        if c.rowcount == 1:
+            # The journal of a unit that was handed to another worker is still used by that worker
+            conn.execute("DELETE FROM WorkJournal WHERE unit_id=?", (unit_id,))
+        conn.execute("COMMIT")
+
+    def progress(self, task_id: int) -> tuple:
+        """
+        :return: (completed units, units, parsed files, total files) tuple
+        """
+
+        row = self.connection().execute("SELECT SUM(state=?), COUNT(*), SUM(parsed_files), SUM(total_files) "
+                                        "FROM WorkUnit WHERE task_id=?", (WorkQueue.DONE, task_id)).fetchone()
+        return tuple(value or 0 for value in row)
+
+    def remove_task(self, task_id: int):
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM WorkJournal WHERE unit_id IN (SELECT id FROM WorkUnit WHERE task_id=?)",
+                     (task_id,))
+        conn.execute("DELETE FROM WorkUnit WHERE task_id=?", (task_id,))
+        conn.execute("DELETE FROM WorkTask WHERE task_id=?", (task_id,))
+        conn.execute("COMMIT")
+
+    def save_journal(self, unit_id: int, paths: list):
+        """Record the files indexed by a unit, a unit that is handed out again skips them"""
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO WorkJournal (unit_id, path) VALUES (?,?)", [(unit_id, path) for path in paths])
+        conn.execute("COMMIT")
+
+    def journal(self, unit_id: int) -> set:
+        c = self.connection().execute("SELECT path FROM WorkJournal WHERE unit_id=?", (unit_id,))
+        return set(row[0] for row in c.fetchall())
+
+    def __getstate__(self):
+        # Connections can't be shared with other processes
+        return {"db_path": self.db_path}
+
+    def __setstate__(self, state):
+        self.db_path = state["db_path"]
+        self.local = threading.local()
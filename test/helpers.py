@@ -0,0 +1,52 @@
+import os
+
+from parsing import GenericFileParser
+
+
+class FakeIndexer:
+    """Stands in for the Indexer, the documents are kept in memory and their names are used as ids"""
+
+    def __init__(self):
+        self.indexed = []
+        self.deleted = []
+        self.batches = 0
+
+    def index(self, docs: list, directory: int):
+        self.batches += 1
+        self.indexed.extend(docs)
+        return [doc["name"] for doc in docs]
+
+    def delete(self, doc_ids: list):
+        self.deleted.extend(doc_ids)
+
+
+class FailingIndexer(FakeIndexer):
+    """Fails the first requests, as elasticsearch does while it is down"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def index(self, docs: list, directory: int):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("elasticsearch is down")
+        return super().index(docs, directory)
+
+    def delete(self, doc_ids: list):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("elasticsearch is down")
+        super().delete(doc_ids)
+
+
+class CountingFileParser(GenericFileParser):
+    """Records the files that were parsed"""
+
+    def __init__(self, checksum_calculators: list, root_dir: str):
+        super().__init__(checksum_calculators, root_dir)
+        self.parsed_files = []
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        self.parsed_files.append(full_path)
+        return super().parse(full_path, file_stat, checksums)
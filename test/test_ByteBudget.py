@@ -0,0 +1,80 @@
+import time
+from threading import Thread
+from unittest import TestCase
+
+from tuning import ByteBudget
+
+
+class ByteBudgetTest(TestCase):
+
+    def test_acquire_within_limit(self):
+
+        budget = ByteBudget(100)
+        budget.acquire(60)
+        budget.acquire(40)
+
+        self.assertEqual(budget.used, 100)
+
+    def test_wait_for_release(self):
+
+        budget = ByteBudget(100)
+        budget.acquire(80)
+
+        def release():
+            time.sleep(0.2)
+            budget.release(80)
+
+        Thread(target=release).start()
+
+        start = time.time()
+        budget.acquire(50)
+
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertEqual(budget.used, 50)
+
+    def test_large_item_admitted_when_empty(self):
+
+        budget = ByteBudget(100)
+        budget.acquire(500)
+
+        self.assertEqual(budget.used, 500)
+
+    def test_memory_limit(self):
+
+        budget = ByteBudget(100, memory_limit=1)
+        budget.acquire(10)
+
+        self.assertTrue(budget.over_memory_limit())
+        budget.release(10)
+        # Nothing is held, the item is admitted anyway
+        budget.acquire(10)
+
+    def test_memory_floor(self):
+
+        budget = ByteBudget(100, memory_limit=1, memory_floor=50)
+        budget.acquire(30)
+        # Below the floor, the memory limit doesn't hold the item back
+        budget.acquire(30)
+
+        thread = Thread(target=budget.acquire, args=(10,))
+        thread.start()
+        time.sleep(0.1)
+
+        self.assertEqual(budget.waiting, 1)
+        budget.release(60)
+        thread.join()
+        self.assertEqual(budget.used, 10)
+
+    def test_waiting(self):
+
+        budget = ByteBudget(100)
+        budget.acquire(80)
+
+        thread = Thread(target=budget.acquire, args=(50,))
+        thread.start()
+        time.sleep(0.1)
+
+        self.assertEqual(budget.waiting, 1)
+        budget.release(80)
+        thread.join()
+        self.assertEqual(budget.waiting, 0)
@@ -0,0 +1,80 @@
+import time
+from unittest import TestCase
+
+import config
+from tuning import RateLimiter, CrawlThrottle, SearchLatency
+
+
+class RejectingIndexer:
+    def __init__(self):
+        self.rejections = 0
+
+
+class CrawlThrottleTest(TestCase):
+
+    def test_rate_limit(self):
+
+        limiter = RateLimiter(100)
+
+        start = time.time()
+        for _ in range(5):
+            limiter.acquire(10)
+        limiter.acquire(10)
+
+        # The first second is admitted at once
+        self.assertLess(time.time() - start, 0.2)
+
+        for _ in range(10):
+            limiter.acquire(10)
+
+        self.assertGreaterEqual(time.time() - start, 0.5)
+
+    def test_no_limit(self):
+
+        limiter = RateLimiter()
+        start = time.time()
+        limiter.acquire(10 ** 12)
+
+        self.assertLess(time.time() - start, 0.1)
+        self.assertEqual(limiter.total, 10 ** 12)
+
+    def test_back_off_on_rejections(self):
+
+        indexer = RejectingIndexer()
+        throttle = CrawlThrottle(index_rate=0, adaptive=True, indexer=indexer)
+
+        throttle.docs.total = 1000
+        throttle.last_time -= config.throttle_check_interval
+        indexer.rejections = 5
+        throttle.adapt()
+
+        measured = 1000 / config.throttle_check_interval
+        self.assertAlmostEqual(throttle.docs.limit, measured / 2, delta=measured / 20)
+
+        # Recovered, the limit is removed once it doesn't slow the crawl down
+        for _ in range(10):
+            throttle.last_time -= config.throttle_check_interval
+            throttle.adapt()
+
+        self.assertEqual(throttle.docs.limit, 0)
+
+    def test_back_off_on_search_latency(self):
+
+        latency = SearchLatency()
+        throttle = CrawlThrottle(file_rate=50, adaptive=True, search_latency=latency)
+
+        latency.record(config.throttle_max_search_latency * 2)
+        throttle.files.total = 1000
+        throttle.last_time -= config.throttle_check_interval
+        throttle.adapt()
+
+        self.assertEqual(throttle.files.limit, 25)
+
+        latency.last_time.value -= config.throttle_latency_window + 1
+        self.assertEqual(latency.value(), 0)
+
+        for _ in range(5):
+            throttle.last_time -= config.throttle_check_interval
+            throttle.adapt()
+
+        self.assertEqual(throttle.files.limit, 50)
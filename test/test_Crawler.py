@@ -1,12 +1,126 @@
+import signal
+import time
+import shutil
+from multiprocessing import Value
+from threading import Lock, Event, current_thread, main_thread
 from unittest import TestCase
 
-from parsing import GenericFileParser, Sha1CheckSumCalculator, ExtensionMimeGuesser
-from crawler import Crawler
+from parsing import GenericFileParser, Sha1CheckSumCalculator, ExtensionMimeGuesser, Md5CheckSumCalculator, MimeGuesser
+from crawler import Crawler, CrawlWorker, TaskManager, DeviceQueue
+from fileio import open_file
+from benchmark import Benchmark
+from storage import LocalStorage, Task, WorkQueue, Directory, Option
+from walker import split_tree, WalkFilter
+from search import Search
+from test.helpers import FakeIndexer, FailingIndexer, CountingFileParser
+import config
 import os
 
 dir_name = os.path.dirname(os.path.abspath(__file__))
 
 
+class SlowIndexer(FakeIndexer):
+
+    def __init__(self):
+        super().__init__()
+        self.crawler = None
+        self.max_pending = 0
+
+    def index(self, docs: list, directory: int):
+        self.max_pending = max(self.max_pending, self.crawler.pending_size.used)
+        time.sleep(0.05)
+        return super().index(docs, directory)
+
+
+class LaggingIndexer(FakeIndexer):
+
+    def index(self, docs: list, directory: int):
+        time.sleep(0.05)
+        return super().index(docs, directory)
+
+
+class SlowFileParser(GenericFileParser):
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        if full_path.endswith("books.csv"):
+            time.sleep(5)
+        return super().parse(full_path, file_stat, checksums)
+
+
+class HangingFileParser(GenericFileParser):
+
+    def __init__(self, checksum_calculators: list, root_dir: str):
+        super().__init__(checksum_calculators, root_dir)
+        self.release = Event()
+
+    def hangs(self, full_path: str, file_stat: os.stat_result) -> bool:
+        return full_path.endswith("books.csv")
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        if self.hangs(full_path, file_stat):
+            with open_file(full_path):
+                self.release.wait()
+        return super().parse(full_path, file_stat, checksums)
+
+
+class HangingLinkParser(HangingFileParser):
+
+    def hangs(self, full_path: str, file_stat: os.stat_result) -> bool:
+        return file_stat.st_nlink > 1
+
+
+class XmlFileParser(GenericFileParser):
+    is_default = False
+    mime_types = ["application/xml"]
+
+    def __init__(self, checksum_calculators: list, root_dir: str):
+        super().__init__(checksum_calculators, root_dir)
+        self.running = 0
+        self.max_running = 0
+        self.lock = Lock()
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return super().parse(full_path, file_stat, checksums)
+
+
+class ReadingXmlParser(XmlFileParser):
+
+    def __init__(self, checksum_calculators: list, root_dir: str):
+        super().__init__(checksum_calculators, root_dir)
+        self.processing = 0
+        self.max_processing = 0
+
+    def parse(self, full_path: str, file_stat: os.stat_result = None, checksums: dict = None):
+        # Reading is counted by XmlFileParser, processing after the file is closed isn't limited by the device
+        with open_file(full_path):
+            doc = super().parse(full_path, file_stat, checksums)
+
+        with self.lock:
+            self.processing += 1
+            self.max_processing = max(self.max_processing, self.processing)
+        time.sleep(0.2)
+        with self.lock:
+            self.processing -= 1
+        return doc
+
+
+class ThreadRecordingMimeGuesser(MimeGuesser):
+
+    def __init__(self):
+        self.guesser = ExtensionMimeGuesser()
+        self.threads = set()
+
+    def guess_mime(self, full_path):
+        self.threads.add(current_thread())
+        return self.guesser.guess_mime(full_path)
+
+
 class CrawlerTest(TestCase):
 
     def test_dir_walk(self):
@@ -17,6 +131,272 @@ class CrawlerTest(TestCase):
 
         self.assertEqual(len(c.documents), 31)
 
+    def test_stopped(self):
+
+        c = Crawler([GenericFileParser([], dir_name + "/test_folder")])
+        c.stopped.set()
+        c.crawl(dir_name + "/test_folder")
+
+        self.assertEqual(len(c.documents), 0)
+
+    def test_dir_walk_processes(self):
+
+        parse_processes = config.parse_processes
+        config.parse_processes = 2
+
+        try:
+            c = Crawler([GenericFileParser([Sha1CheckSumCalculator()], dir_name + "/test_folder")])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.parse_processes = parse_processes
+
+        self.assertEqual(len(c.documents), 31)
+        self.assertTrue(all("sha1" in doc for doc in c.documents))
+
+    def test_parse_timeout(self):
+
+        config.parser_timeouts["SlowFileParser"] = 0.5
+
+        try:
+            c = Crawler([SlowFileParser([], dir_name + "/test_folder")])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            del config.parser_timeouts["SlowFileParser"]
+
+        self.assertEqual(len(c.documents), 30)
+        self.assertEqual(c.timed_out_files, [dir_name + "/test_folder/books.csv"])
+
+    def test_parse_timeout_processes(self):
+
+        parse_processes = config.parse_processes
+        config.parse_processes = 2
+        config.parser_timeouts["SlowFileParser"] = 0.5
+
+        try:
+            c = Crawler([SlowFileParser([], dir_name + "/test_folder")])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.parse_processes = parse_processes
+            del config.parser_timeouts["SlowFileParser"]
+
+        self.assertEqual(len(c.documents), 30)
+        self.assertEqual(c.timed_out_files, [dir_name + "/test_folder/books.csv"])
+
+    def test_parser_lanes(self):
+
+        parser_lanes = config.parser_lanes
+        config.parser_lanes = {"XmlFileParser": 2}
+
+        try:
+            xml_parser = XmlFileParser([], dir_name + "/test_folder")
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder"), xml_parser])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.parser_lanes = parser_lanes
+
+        self.assertEqual(len(c.documents), 31)
+        self.assertEqual(xml_parser.max_running, 2)
+        self.assertEqual(len([doc for doc in c.documents if doc["mime"] == "application/xml"]), 15)
+
+    def test_parser_lanes_processes(self):
+
+        parser_lanes = config.parser_lanes
+        parse_processes = config.parse_processes
+        parse_batch_size = config.parse_batch_size
+        config.parser_lanes = {"XmlFileParser": 1}
+        config.parse_processes = 2
+        config.parse_batch_size = 1
+
+        try:
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder"),
+                         XmlFileParser([], dir_name + "/test_folder")])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.parser_lanes = parser_lanes
+            config.parse_processes = parse_processes
+            config.parse_batch_size = parse_batch_size
+
+        self.assertEqual(len(c.documents), 31)
+        # The walk doesn't wait for the slow lane, the other files are parsed in the meantime
+        mimes = [doc["mime"] for doc in c.documents]
+        self.assertEqual(mimes.count("application/xml"), 15)
+        xml_indices = [i for i, mime in enumerate(mimes) if mime == "application/xml"]
+        self.assertEqual(xml_indices[3:], list(range(19, 31)))
+
+    def test_content_guess_in_lanes(self):
+
+        parser_lanes = config.parser_lanes
+        config.parser_lanes = {"XmlFileParser": 2}
+
+        try:
+            guesser = ThreadRecordingMimeGuesser()
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder"),
+                         XmlFileParser([], dir_name + "/test_folder")], guesser)
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.parser_lanes = parser_lanes
+
+        self.assertEqual(len([doc for doc in c.documents if doc["mime"] == "application/xml"]), 15)
+        # The walk thread doesn't guess mime types from the content
+        self.assertNotIn(main_thread(), guesser.threads)
+
+    def test_device_queue_depth(self):
+
+        device_queue_depths = config.device_queue_depths
+        config.device_queue_depths = {"rotational": 1, "ssd": 1, "other": 1}
+
+        try:
+            xml_parser = ReadingXmlParser([], dir_name + "/test_folder")
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder"), xml_parser])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.device_queue_depths = device_queue_depths
+
+        self.assertEqual(len(c.documents), 31)
+        self.assertEqual(xml_parser.max_running, 1)
+        self.assertGreater(xml_parser.max_processing, 1)
+
+    def test_parse_timeout_device_slot(self):
+
+        device_queue_depths = config.device_queue_depths
+        config.device_queue_depths = {"rotational": 1, "ssd": 1, "other": 1}
+        config.parser_timeouts["HangingFileParser"] = 0.5
+        parser = HangingFileParser([], dir_name + "/test_folder")
+
+        try:
+            # The slot of the abandoned thread is given to the other files of the device
+            c = Crawler([parser])
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            parser.release.set()
+            config.device_queue_depths = device_queue_depths
+            del config.parser_timeouts["HangingFileParser"]
+
+        self.assertEqual(len(c.documents), 30)
+        self.assertEqual(c.timed_out_files, [dir_name + "/test_folder/books.csv"])
+
+    def test_benchmark(self):
+
+        benchmark = Benchmark()
+        c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=benchmark, benchmark=benchmark)
+        benchmark.start()
+        c.crawl(dir_name + "/test_folder")
+        benchmark.stop()
+
+        report = benchmark.report()
+        self.assertEqual(c.documents, [])
+        self.assertEqual(report["walked_files"], 31)
+        self.assertEqual(report["parsers"]["GenericFileParser"]["files"], 31)
+        self.assertEqual(report["parsers"]["GenericFileParser"]["errors"], 0)
+        self.assertGreater(report["parsers"]["GenericFileParser"]["bytes"], 0)
+        self.assertLessEqual(report["parsers"]["GenericFileParser"]["p50"],
+                             report["parsers"]["GenericFileParser"]["p99"])
+
+    def test_benchmark_sample(self):
+
+        parse_processes = config.parse_processes
+        config.parse_processes = 2
+
+        try:
+            benchmark = Benchmark(0.5)
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=benchmark, benchmark=benchmark)
+            benchmark.start()
+            c.crawl(dir_name + "/test_folder")
+            benchmark.stop()
+        finally:
+            config.parse_processes = parse_processes
+
+        report = benchmark.report()
+        self.assertEqual(report["walked_files"], 31)
+        self.assertEqual(report.get("parsers", {}).get("GenericFileParser", {}).get("files", 0),
+                         report["sampled_files"])
+
+    def test_walk_filter(self):
+
+        walk_filter = WalkFilter(dir_name + "/test_folder", ["sub2", "*.json"])
+        c = Crawler([GenericFileParser([], dir_name + "/test_folder")], walk_filter=walk_filter)
+        c.crawl(dir_name + "/test_folder")
+
+        self.assertEqual(len(c.documents), 24)
+        self.assertFalse(any(doc["path"].startswith("sub2") for doc in c.documents))
+
+    def test_pending_bytes(self):
+
+        index_every = config.index_every
+        index_batch_bytes = config.index_batch_bytes
+        max_pending_bytes = config.max_pending_bytes
+        config.index_every = 2
+        config.index_batch_bytes = 1000
+        config.max_pending_bytes = 2000
+
+        try:
+            indexer = SlowIndexer()
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=indexer)
+            indexer.crawler = c
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.index_every = index_every
+            config.index_batch_bytes = index_batch_bytes
+            config.max_pending_bytes = max_pending_bytes
+
+        self.assertEqual(len(indexer.indexed), 31)
+        self.assertLess(indexer.max_pending, 3000)
+        self.assertEqual(c.pending_size.used, 0)
+
+    def test_memory_limit(self):
+
+        crawl_memory_limit = config.crawl_memory_limit
+        config.crawl_memory_limit = 1
+
+        try:
+            # The documents are smaller than index_min_batch_bytes, they are still indexed in one batch
+            indexer = FakeIndexer()
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=indexer)
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            config.crawl_memory_limit = crawl_memory_limit
+
+        self.assertEqual(len(indexer.indexed), 31)
+        self.assertEqual(indexer.batches, 1)
+        self.assertEqual(c.pending_size.used, 0)
+
+    def test_index_retry(self):
+
+        index_retry_delay = config.index_retry_delay
+        config.index_retry_delay = 0.01
+
+        try:
+            indexer = FailingIndexer(config.index_retries)
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=indexer)
+            c.crawl(dir_name + "/test_folder")
+
+            # Dropped once the retries are exhausted
+            dropping_indexer = FailingIndexer(config.index_retries + 1)
+            c2 = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=dropping_indexer)
+            c2.crawl(dir_name + "/test_folder")
+        finally:
+            config.index_retry_delay = index_retry_delay
+
+        self.assertEqual(len(indexer.indexed), 31)
+        self.assertEqual(len(dropping_indexer.indexed), 0)
+        self.assertEqual(c2.pending_size.used, 0)
+
+    def test_listing(self):
+
+        # The files of the listing don't need to exist, generic files are never opened
+        with open(dir_name + "/test_listing.txt", "w") as f:
+            f.write("sub/missing.bin\t1234\t1500000000\n")
+            f.write("other.bin\t10\t1500000000\n")
+
+        try:
+            c = Crawler([GenericFileParser([], dir_name + "/test_folder")], listing=dir_name + "/test_listing.txt")
+            c.crawl(dir_name + "/test_folder")
+        finally:
+            os.remove(dir_name + "/test_listing.txt")
+
+        self.assertEqual(sorted(Search.get_rel_path(doc) for doc in c.documents), ["other.bin", "sub/missing.bin"])
+        self.assertEqual(sorted(doc["size"] for doc in c.documents), [10, 1234])
+
     def test_file_count(self):
 
         c = Crawler([])
@@ -35,3 +415,264 @@ class CrawlerTest(TestCase):
                 file_count_in_sub2 += 1
 
         self.assertEqual(file_count_in_sub2, 2)
+
+    def test_incremental(self):
+
+        unchanged_stat = os.stat(dir_name + "/test_folder/books.csv")
+        modified_stat = os.stat(dir_name + "/test_folder/sub2/monitor.xml")
+
+        known_files = {
+            "books.csv": {"id": "1", "size": unchanged_stat.st_size, "mtime": unchanged_stat.st_mtime,
+                          "inode": unchanged_stat.st_ino},
+            "sub2/monitor.xml": {"id": "2", "size": modified_stat.st_size + 1, "mtime": modified_stat.st_mtime,
+                                 "inode": modified_stat.st_ino},
+            "deleted.txt": {"id": "3", "size": 0, "mtime": 0, "inode": None},
+        }
+
+        c = Crawler([GenericFileParser([], dir_name + "/test_folder")], known_files=known_files)
+        c.crawl(dir_name + "/test_folder")
+
+        self.assertEqual(len(c.documents), 30)
+        self.assertEqual(sorted(c.outdated_docs), ["2", "3"])
+
+    def test_journal_resume(self):
+
+        if os.path.exists(dir_name + "/test_database.db"):
+            os.remove(dir_name + "/test_database.db")
+        storage = LocalStorage(dir_name + "/test_database.db")
+        storage.init_db(dir_name + "/../database.sql")
+
+        task_id = storage.save_task(Task(Task.INDEX, 1))
+        storage.save_journal(task_id, ["books.csv", "sub2/monitor.xml"])
+
+        indexer = FakeIndexer()
+        c = Crawler([GenericFileParser([], dir_name + "/test_folder")], indexer=indexer, storage=storage,
+                    task_id=task_id)
+        c.crawl(dir_name + "/test_folder")
+
+        self.assertEqual(len(indexer.indexed), 29)
+        self.assertEqual(len(storage.journal(task_id)), 31)
+        self.assertIn("sub2/sub_sub1/mp500.xml", storage.journal(task_id))
+
+
+class DeviceQueueTest(TestCase):
+
+    def test_devices_in_turn(self):
+
+        q = DeviceQueue()
+        for st_dev, name in ((1, "a"), (1, "b"), (2, "c"), (1, "d"), (3, "e")):
+            q.put((name, os.stat_result((0, 0, st_dev, 1, 0, 0, 0, 0, 0, 0)), None))
+
+        self.assertEqual([q.get()[0] for _ in range(5)], ["a", "c", "e", "b", "d"])
+
+    def test_busy_device(self):
+
+        q = DeviceQueue(is_free=lambda st_dev: st_dev != 1)
+        for st_dev, name in ((1, "a"), (1, "b"), (2, "c")):
+            q.put((name, os.stat_result((0, 0, st_dev, 1, 0, 0, 0, 0, 0, 0)), None))
+        q.put(None)
+
+        # The files of the busy device are taken once no other file is waiting
+        self.assertEqual([q.get()[0] for _ in range(3)], ["c", "a", "b"])
+        self.assertIsNone(q.get())
+
+
+class CrawlerDedupTest(TestCase):
+
+    def setUp(self):
+        self.root = dir_name + "/dedup_folder"
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root + "/sub")
+
+        with open(self.root + "/file.txt", "w") as f:
+            f.write("content")
+        os.link(self.root + "/file.txt", self.root + "/link1.txt")
+        os.link(self.root + "/file.txt", self.root + "/sub/link2.txt")
+        shutil.copy(self.root + "/file.txt", self.root + "/sub/copy.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_hard_links(self):
+
+        parser = CountingFileParser([], self.root)
+        c = Crawler([parser])
+        c.crawl(self.root)
+
+        self.assertEqual(len(parser.parsed_files), 2)
+        self.assertEqual(sorted(os.path.join(doc["path"], doc["name"]) for doc in c.documents),
+                         ["./file", "./link1", "sub/copy", "sub/link2"])
+
+    def test_link_cache_size(self):
+
+        link_cache_size = config.link_cache_size
+        config.link_cache_size = 0
+
+        try:
+            parser = CountingFileParser([], self.root)
+            c = Crawler([parser])
+            c.crawl(self.root)
+        finally:
+            config.link_cache_size = link_cache_size
+
+        self.assertEqual(len(c.link_docs), 0)
+        self.assertEqual(sorted(os.path.join(doc["path"], doc["name"]) for doc in c.documents),
+                         ["./file", "./link1", "sub/copy", "sub/link2"])
+
+    def test_hard_links_timeout(self):
+
+        parse_threads = config.parse_threads
+        config.parse_threads = 1
+        config.parser_timeouts["HangingLinkParser"] = 0.5
+        parser = HangingLinkParser([], self.root)
+
+        try:
+            c = Crawler([parser])
+            c.crawl(self.root)
+        finally:
+            parser.release.set()
+            config.parse_threads = parse_threads
+            del config.parser_timeouts["HangingLinkParser"]
+
+        # The links waiting for the file are given up with it
+        self.assertEqual(sorted(c.timed_out_files), sorted(self.root + path for path in
+                                                          ["/file.txt", "/link1.txt", "/sub/link2.txt"]))
+        self.assertEqual(c.pending_links, {})
+        self.assertEqual([doc["name"] for doc in c.documents], ["copy"])
+
+    def test_hard_links_processes(self):
+
+        parse_processes = config.parse_processes
+        config.parse_processes = 2
+
+        try:
+            c = Crawler([GenericFileParser([], self.root)])
+            c.crawl(self.root)
+        finally:
+            config.parse_processes = parse_processes
+
+        self.assertEqual(sorted(os.path.join(doc["path"], doc["name"]) for doc in c.documents),
+                         ["./file", "./link1", "sub/copy", "sub/link2"])
+
+    def test_identical_content(self):
+
+        # Files parsed at the same time by two threads are both parsed
+        parse_threads = config.parse_threads
+        config.parse_threads = 1
+
+        try:
+            parser = CountingFileParser([Md5CheckSumCalculator()], self.root)
+            c = Crawler([parser])
+            c.crawl(self.root)
+        finally:
+            config.parse_threads = parse_threads
+
+        self.assertEqual(len(parser.parsed_files), 1)
+        self.assertEqual(len(c.documents), 4)
+        self.assertEqual(len(set(doc["md5"] for doc in c.documents)), 1)
+
+    def test_benchmark_no_dedup(self):
+
+        # Links and identical files are parsed, their parse times count
+        parser = CountingFileParser([Md5CheckSumCalculator()], self.root)
+        benchmark = Benchmark()
+        c = Crawler([parser], indexer=benchmark, benchmark=benchmark)
+        benchmark.start()
+        c.crawl(self.root)
+        benchmark.stop()
+
+        self.assertEqual(len(parser.parsed_files), 4)
+        self.assertEqual(benchmark.report()["parsers"]["CountingFileParser"]["files"], 4)
+
+
+class CrawlWorkerTest(TestCase):
+
+    def setUp(self):
+        if os.path.exists(dir_name + "/test_work_queue.db"):
+            os.remove(dir_name + "/test_work_queue.db")
+        self.queue = WorkQueue(dir_name + "/test_work_queue.db")
+
+        self.directory = Directory(dir_name + "/test_folder", True, [Option("FileParsers", "")], "test")
+        self.directory.id = 1
+
+        self.parse_cache_path = config.parse_cache_path
+        config.parse_cache_path = None
+
+    def tearDown(self):
+        config.parse_cache_path = self.parse_cache_path
+        os.remove(dir_name + "/test_work_queue.db")
+
+    def test_crawl_units(self):
+
+        self.queue.add_task(1, self.directory, split_tree(self.directory.path, 1))
+
+        indexer = FakeIndexer()
+        CrawlWorker(self.queue, 1, "worker", indexer).run()
+
+        completed_units, units, parsed_files, total_files = self.queue.progress(1)
+        self.assertEqual(completed_units, units)
+        self.assertEqual(parsed_files, 31)
+        self.assertEqual(len(indexer.indexed), 31)
+        self.assertEqual(len(set(Search.get_rel_path(doc) for doc in indexer.indexed)), 31)
+
+    def test_resume_lost_unit(self):
+
+        self.queue.add_task(1, self.directory, [(self.directory.path + "/sub2", True)])
+
+        unit_id = self.queue.claim("lost worker")[0]
+        self.queue.save_journal(unit_id, ["sub2/monitor.xml"])
+
+        lease = config.work_unit_lease
+        config.work_unit_lease = -1
+
+        try:
+            indexer = FakeIndexer()
+            CrawlWorker(self.queue, 1, "worker", indexer).run()
+        finally:
+            config.work_unit_lease = lease
+
+        self.assertEqual(len(indexer.indexed), 4)
+        self.assertNotIn("sub2/monitor.xml", [Search.get_rel_path(doc) for doc in indexer.indexed])
+
+    def test_lost_lease(self):
+
+        self.queue.add_task(1, self.directory, [(self.directory.path + "/sub2", True)])
+        unit = self.queue.claim("worker")
+        self.queue.save_journal(unit[0], ["sub2/monitor.xml"])
+
+        # The unit is handed to another worker during the crawl
+        self.queue.heartbeat = lambda *args: False
+        lease = config.work_unit_lease
+        config.work_unit_lease = 0.004
+
+        try:
+            CrawlWorker(self.queue, 1, "worker", LaggingIndexer()).crawl_unit(*unit)
+        finally:
+            config.work_unit_lease = lease
+
+        completed_units, units, _, _ = self.queue.progress(1)
+        self.assertEqual(completed_units, 0)
+        self.assertIn("sub2/monitor.xml", self.queue.journal(unit[0]))
+
+    def test_worker_error(self):
+
+        self.queue.add_task(1, self.directory, split_tree(self.directory.path, 1))
+
+        def crash(task_id):
+            raise OSError("elasticsearch is not running")
+
+        # The task fails instead of waiting for the units forever
+        task_manager = TaskManager.__new__(TaskManager)
+        task_manager.execute_crawl_worker = crash
+        work_queue_path = config.work_queue_path
+        config.work_queue_path = dir_name + "/test_work_queue.db"
+        on_terminate = signal.getsignal(signal.SIGTERM)
+
+        try:
+            with self.assertRaises(RuntimeError):
+                task_manager.execute_distributed_crawl(self.directory, Value("i", 0), Value("i", 0), Value("i", 0),
+                                                       task_id=1)
+        finally:
+            config.work_queue_path = work_queue_path
+            signal.signal(signal.SIGTERM, on_terminate)
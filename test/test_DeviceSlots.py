@@ -0,0 +1,69 @@
+import time
+from threading import Thread
+from unittest import TestCase
+
+import config
+from tuning import DeviceSlots
+
+
+class DeviceSlotsTest(TestCase):
+
+    def setUp(self):
+        self.device_queue_depths = config.device_queue_depths
+        config.device_queue_depths = {"rotational": 2, "ssd": 2, "other": 2}
+
+    def tearDown(self):
+        config.device_queue_depths = self.device_queue_depths
+
+    def test_queue_depth(self):
+
+        slots = DeviceSlots()
+        tokens = []
+        thread = Thread(target=lambda: tokens.extend([slots.acquire(1), slots.acquire(1)]))
+        thread.start()
+        thread.join()
+
+        self.assertFalse(slots.is_free(1))
+        self.assertTrue(slots.is_free(2))
+
+        def release():
+            time.sleep(0.2)
+            slots.release(tokens[0])
+
+        Thread(target=release).start()
+
+        start = time.time()
+        slots.acquire(1)
+
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertFalse(slots.is_free(1))
+
+    def test_release_thread(self):
+
+        slots = DeviceSlots()
+        tokens = []
+
+        thread = Thread(target=lambda: tokens.extend([slots.acquire(1), slots.acquire(1)]))
+        thread.start()
+        thread.join()
+
+        slots.release_thread(thread)
+        self.assertTrue(slots.is_free(1))
+
+        # The abandoned thread doesn't release its slots again
+        other = slots.acquire(1)
+        slots.release(tokens[0])
+        slots.acquire(1)
+        self.assertFalse(slots.is_free(1))
+        slots.release(other)
+        self.assertTrue(slots.is_free(1))
+
+    def test_nested(self):
+
+        config.device_queue_depths = {"rotational": 1, "ssd": 1, "other": 1}
+        slots = DeviceSlots()
+
+        with slots.slot(1):
+            with slots.slot(1):
+                self.assertFalse(slots.is_free(1))
+        self.assertTrue(slots.is_free(1))
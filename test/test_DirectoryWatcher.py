@@ -0,0 +1,109 @@
+import os
+import shutil
+from unittest import TestCase
+
+from crawler import Crawler
+from parsing import GenericFileParser
+from test.helpers import FakeIndexer, FailingIndexer
+from watcher import DirectoryWatcher
+
+dir_name = os.path.dirname(os.path.abspath(__file__))
+
+
+class DirectoryWatcherTest(TestCase):
+
+    def setUp(self):
+        self.root = dir_name + "/watched_folder"
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root + "/sub")
+
+        with open(self.root + "/sub/old.txt", "w") as f:
+            f.write("old")
+
+        self.indexer = FakeIndexer()
+        crawler = Crawler([GenericFileParser([], self.root)], indexer=self.indexer)
+        self.watcher = DirectoryWatcher(crawler, self.root, {"sub/old.txt": "old"})
+        self.watcher.add_watches(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        self.watcher.inotify.close()
+
+    def test_create(self):
+
+        with open(self.root + "/new.txt", "w") as f:
+            f.write("new")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        self.assertEqual([doc["name"] for doc in self.indexer.indexed], ["new"])
+        self.assertEqual(self.indexer.deleted, [])
+        self.assertEqual(self.watcher.doc_ids["new.txt"], "new")
+
+    def test_modify(self):
+
+        with open(self.root + "/sub/old.txt", "a") as f:
+            f.write("modified")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        self.assertEqual(self.indexer.indexed[0]["size"], 11)
+        self.assertEqual(self.indexer.deleted, ["old"])
+
+    def test_index_error(self):
+
+        indexer = FailingIndexer(1)
+        self.watcher.crawler.indexer = indexer
+
+        with open(self.root + "/sub/old.txt", "a") as f:
+            f.write("modified")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        # The change is kept for the next flush
+        self.assertEqual(indexer.deleted, [])
+        self.assertEqual(indexer.indexed, [])
+
+        self.watcher.flush()
+
+        self.assertEqual(indexer.deleted, ["old"])
+        self.assertEqual(indexer.indexed[0]["size"], 11)
+        self.assertEqual(self.watcher.doc_ids["sub/old.txt"], "old")
+        self.assertEqual(self.watcher.pending, {})
+
+    def test_delete(self):
+
+        os.remove(self.root + "/sub/old.txt")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        self.assertEqual(self.indexer.indexed, [])
+        self.assertEqual(self.indexer.deleted, ["old"])
+
+    def test_move_dir(self):
+
+        os.rename(self.root + "/sub", self.root + "/moved")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        self.assertEqual(self.indexer.deleted, ["old"])
+        self.assertEqual(self.indexer.indexed[0]["path"], "moved")
+
+    def test_new_dir(self):
+
+        os.makedirs(self.root + "/sub/new_dir")
+        self.watcher.process_events(1)
+
+        with open(self.root + "/sub/new_dir/file.txt", "w") as f:
+            f.write("file")
+
+        self.watcher.process_events(1)
+        self.watcher.flush()
+
+        self.assertEqual([doc["path"] for doc in self.indexer.indexed], ["sub/new_dir"])
@@ -0,0 +1,94 @@
+import mmap
+import os
+from unittest import TestCase
+
+import config
+import fileio
+from fileio import open_file, read_views, resident_pages, drop_pages
+from tuning import RateLimiter
+
+dir_name = os.path.dirname(os.path.abspath(__file__))
+
+
+class FileIOTest(TestCase):
+
+    def setUp(self):
+        self.readahead = config.fadvise_readahead
+        self.advise = fileio.advise
+        self.path = dir_name + "/test_blocks.bin"
+
+        with open(self.path, "wb") as f:
+            f.write(os.urandom(100000))
+
+    def tearDown(self):
+        config.fadvise_readahead = self.readahead
+        config.fadvise = True
+        fileio.advise = self.advise
+        fileio.read_limiter = None
+        os.remove(self.path)
+
+    def test_read_views(self):
+
+        config.fadvise_readahead = 4096
+
+        with open_file(self.path) as f:
+            content = b"".join(bytes(block) for block in read_views(f, 1000))
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(content, f.read())
+
+    def test_read_limiter(self):
+
+        fileio.read_limiter = RateLimiter()
+
+        # Only the bytes read are charged, not the size of the file
+        with open_file(self.path, sequential=False, length=10) as f:
+            f.read(10)
+        partial = fileio.read_limiter.total
+        self.assertLess(partial, 100000)
+
+        with open_file(self.path) as f:
+            for _ in read_views(f, 1000):
+                pass
+        self.assertEqual(fileio.read_limiter.total - partial, 100000)
+
+    def test_partial_read(self):
+
+        with open_file(self.path, sequential=False, length=10) as f:
+            f.seek(50000)
+            self.assertEqual(len(f.read(10)), 10)
+
+    def test_disabled(self):
+
+        config.fadvise = False
+
+        with open_file(self.path) as f:
+            self.assertEqual(sum(len(block) for block in read_views(f)), 100000)
+
+    def test_resident_pages(self):
+
+        if not fileio.mincore_supported:
+            self.skipTest("mincore() is not supported")
+
+        with open(self.path, "rb") as f:
+            f.read()
+            pages = resident_pages(f.fileno(), 100000)
+
+        self.assertEqual(len(pages), (100000 + mmap.PAGESIZE - 1) // mmap.PAGESIZE)
+
+    def test_drop_uncached_pages(self):
+
+        dropped = []
+        fileio.advise = lambda fd, offset, length, advice: dropped.append((offset // mmap.PAGESIZE,
+                                                                           length // mmap.PAGESIZE))
+
+        drop_pages(0, 0, 0, bytes([1, 0, 0, 1, 0]))
+        self.assertEqual(dropped, [(1, 2), (4, 1)])
+
+        dropped.clear()
+        drop_pages(0, 0, 0, bytes([1, 1]))
+        self.assertEqual(dropped, [])
+
+        dropped.clear()
+        drop_pages(0, 0, 0, None)
+        self.assertEqual(dropped, [(0, 0)])
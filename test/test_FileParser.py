@@ -1,8 +1,11 @@
+import hashlib
 import os
 from unittest import TestCase
 
+import config
 
-from parsing import GenericFileParser, Md5CheckSumCalculator, Sha1CheckSumCalculator, Sha256CheckSumCalculator, ExtensionMimeGuesser
+from parsing import GenericFileParser, Md5CheckSumCalculator, Sha1CheckSumCalculator, Sha256CheckSumCalculator, ExtensionMimeGuesser, \
+    compute_checksums, FingerprintCheckSumCalculator
 
 
 class GenericFileParserTest(TestCase):
@@ -47,6 +50,15 @@ class GenericFileParserTest(TestCase):
 
         self.assertEqual(result["mtime"], 1330654321)
 
+    def test_parse_known_stat(self):
+
+        file_stat = os.stat("./test_parse.txt")
+        os.utime("test_parse.txt", (1330123456, 1330654322))
+
+        result = self.parser.parse("./test_parse.txt", file_stat)
+
+        self.assertEqual(result["mtime"], 1330654321)
+
 
 class Md5CheckSumCalculatorTest(TestCase):
 
@@ -145,3 +157,88 @@ class Sha256CheckSumCalculatorTest(TestCase):
 
 
 
+
+
+class ComputeChecksumsTest(TestCase):
+
+    def setUp(self):
+        self.content = os.urandom(100000)
+        with open("test_checksums", "wb") as f:
+            f.write(self.content)
+
+        self.checksum_block_size = config.checksum_block_size
+
+    def tearDown(self):
+        os.remove("test_checksums")
+        config.checksum_block_size = self.checksum_block_size
+
+    def check_checksums(self):
+        result = compute_checksums("test_checksums", [Md5CheckSumCalculator(), Sha1CheckSumCalculator(),
+                                                      Sha256CheckSumCalculator()])
+
+        self.assertEqual(result, {
+            "md5": hashlib.md5(self.content).hexdigest().upper(),
+            "sha1": hashlib.sha1(self.content).hexdigest().upper(),
+            "sha256": hashlib.sha256(self.content).hexdigest().upper(),
+        })
+
+    def test_single_block(self):
+        self.check_checksums()
+
+    def test_multiple_blocks(self):
+        config.checksum_block_size = 4096
+        self.check_checksums()
+
+    def test_no_calculator(self):
+        self.assertEqual(compute_checksums("test_checksums", []), {})
+
+
+class FingerprintCheckSumCalculatorTest(TestCase):
+
+    def setUp(self):
+        self.sample_size = config.fingerprint_sample_size
+        config.fingerprint_sample_size = 1000
+
+        self.content = os.urandom(10000)
+        with open("test_fingerprint", "wb") as f:
+            f.write(self.content)
+
+        self.calculator = FingerprintCheckSumCalculator()
+
+    def tearDown(self):
+        os.remove("test_fingerprint")
+        config.fingerprint_sample_size = self.sample_size
+
+    def write(self, content):
+        with open("test_fingerprint", "wb") as f:
+            f.write(content)
+
+    def test_small_file(self):
+
+        self.write(b"12345678")
+
+        self.assertEqual(self.calculator.checksum("test_fingerprint"),
+                         hashlib.sha1((8).to_bytes(8, "little") + b"12345678").hexdigest().upper())
+
+    def test_samples(self):
+
+        fingerprint = self.calculator.checksum("test_fingerprint")
+
+        # Outside of the samples
+        self.write(self.content[:2000] + b"x" * 1000 + self.content[3000:])
+        self.assertEqual(self.calculator.checksum("test_fingerprint"), fingerprint)
+
+        # Middle sample
+        self.write(self.content[:5000] + b"x" + self.content[5001:])
+        self.assertNotEqual(self.calculator.checksum("test_fingerprint"), fingerprint)
+
+        # Size
+        self.write(self.content + b"x")
+        self.assertNotEqual(self.calculator.checksum("test_fingerprint"), fingerprint)
+
+    def test_with_full_checksums(self):
+
+        result = compute_checksums("test_fingerprint", [self.calculator, Md5CheckSumCalculator()])
+
+        self.assertEqual(result["fingerprint"], self.calculator.checksum("test_fingerprint"))
+        self.assertEqual(result["md5"], hashlib.md5(self.content).hexdigest().upper())
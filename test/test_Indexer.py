@@ -19,3 +19,16 @@ class IndexerTest(TestCase):
                                   '{"index":{}}\n'
                                   '{"name": "doc2", "directory": 1}\n')
 
+    def test_create_bulk_delete_query(self):
+
+        result = Indexer.create_bulk_delete_string(["id1", "id2"])
+
+        self.assertEqual(result, '{"delete": {"_id": "id1"}}\n'
+                                 '{"delete": {"_id": "id2"}}\n')
+
+    def test_create_bulk_update_query(self):
+
+        result = Indexer.create_bulk_update_string({"id1": {"sha256": "ABC"}})
+
+        self.assertEqual(result, '{"update": {"_id": "id1"}}\n'
+                                 '{"doc": {"sha256": "ABC"}}\n')
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from storage import LocalStorage, Directory, DuplicateDirectoryException, User, DuplicateUserException, Option, Task
+from storage import LocalStorage, Directory, DuplicateDirectoryException, User, DuplicateUserException, Option, Task, \
+    InvalidOptionException
 import os
 
 dir_name = os.path.dirname(os.path.abspath(__file__))
@@ -192,6 +193,26 @@ class LocalStorageTest(TestCase):
 
         self.assertEqual(s.dirs()[dir_id].options[0].value, "newVal")
 
+    def test_invalid_option(self):
+
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        d = Directory("/some/directory", True, [Option("MaxDepth", "")], "An excellent name")
+        dir_id = s.save_directory(d)
+
+        for key, value in (("MaxDepth", "-1"), ("MaxFileSize", "big"), ("MaxFileRate", "fast"),
+                           ("Exclude", "*.tmp, re:[a-")):
+            with self.assertRaises(InvalidOptionException):
+                s.update_option(Option(key, value, dir_id, 1))
+            with self.assertRaises(InvalidOptionException):
+                s.save_option(Option(key, value, dir_id))
+
+        s.update_option(Option("MaxDepth", " 3", dir_id, 1))
+        s.save_option(Option("Exclude", "*.tmp, re:\\.bak$", dir_id))
+
+        self.assertEqual(len(s.dirs()[dir_id].options), 2)
+        self.assertEqual(s.dirs()[dir_id].options[0].value, " 3")
+
     def test_save_task(self):
 
         s = LocalStorage(dir_name + "/test_database.db")
@@ -234,3 +255,83 @@ class LocalStorageTest(TestCase):
 
 
 
+
+    def test_default_option(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        dir_id = s.save_directory(Directory("/some/dir", True, [Option("Watch", "1")], "my dir"))
+
+        self.assertEqual(s.dirs()[dir_id].get_option("Watch"), "1")
+        self.assertEqual(s.dirs()[dir_id].get_option("MimeGuesser"), "extension")
+        self.assertIsNone(s.dirs()[dir_id].get_option("unknown"))
+
+    def test_pause_task(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        task_id = s.save_task(Task(1, 1))
+        self.assertFalse(s.tasks()[task_id].paused)
+
+        s.set_task_paused(task_id, True)
+        self.assertTrue(s.tasks()[task_id].paused)
+
+        s.set_task_paused(task_id, False)
+        self.assertFalse(s.tasks()[task_id].paused)
+
+    def test_fail_task(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        task_id = s.save_task(Task(1, 1))
+        s.set_task_paused(task_id, True, failed=True)
+        self.assertTrue(s.tasks()[task_id].paused)
+        self.assertTrue(s.tasks()[task_id].failed)
+
+        s.set_task_paused(task_id, False)
+        self.assertFalse(s.tasks()[task_id].paused)
+        self.assertFalse(s.tasks()[task_id].failed)
+
+    def test_task_listener(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        calls = []
+        s.add_task_listener(lambda: calls.append(len(s.tasks())))
+
+        task_id = s.save_task(Task(1, 1))
+        s.set_task_paused(task_id, True)
+        s.del_task(task_id)
+
+        self.assertEqual(calls, [1, 1, 0])
+
+    def test_journal(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        task_id = s.save_task(Task(1, 1))
+        s.save_journal(task_id, ["a.txt", "sub/b.txt"])
+        s.save_journal(task_id, ["c.txt"])
+
+        self.assertEqual(s.journal(task_id), {"a.txt", "sub/b.txt", "c.txt"})
+
+        s.del_task(task_id)
+        self.assertEqual(s.journal(task_id), set())
+
+    def test_benchmarks(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        dir_id = s.save_directory(Directory("/some/dir", True, [], "my dir"))
+        s.save_benchmark(dir_id, {"walked_files": 10})
+        s.save_benchmark(dir_id, {"walked_files": 20})
+
+        benchmarks = s.benchmarks(dir_id)
+        self.assertEqual([b["walked_files"] for b in benchmarks], [20, 10])
+        self.assertIn("time", benchmarks[0])
+
+        s.remove_directory(dir_id)
+        self.assertEqual(s.benchmarks(dir_id), [])
+
+    def test_upgrade_db(self):
+        s = LocalStorage(dir_name + "/test_database.db")
+
+        s.upgrade_db()
+        task_id = s.save_task(Task(1, 1))
+        s.save_journal(task_id, ["a.txt"])
+
+        self.assertEqual(s.journal(task_id), {"a.txt"})
@@ -1,5 +1,6 @@
 from unittest import TestCase
 from parsing import MediaFileParser
+from media import read_media_info
 import os
 
 dir_name = os.path.dirname(os.path.abspath(__file__))
@@ -39,3 +40,102 @@ class MediaFileParserTest(TestCase):
 
         self.assertEqual(info["format_long_name"], "Ogg")
         self.assertEqual(info["duration"], 10.618867)
+
+    def test_audio_mp3(self):
+        parser = MediaFileParser([], dir_name)
+
+        def text_frame(frame_id, text):
+            data = b"\x03" + text.encode("utf-8")
+            return frame_id + len(data).to_bytes(4, "big") + b"\0\0" + data
+
+        frames = text_frame(b"TIT2", "Song") + text_frame(b"TALB", "Album") + text_frame(b"TCON", "Rock") + \
+            text_frame(b"TPE2", "Band")
+        tag_size = len(frames) + 100
+        id3 = b"ID3\x03\x00\x00" + bytes([(tag_size >> 21) & 0x7F, (tag_size >> 14) & 0x7F,
+                                          (tag_size >> 7) & 0x7F, tag_size & 0x7F]) + frames + b"\0" * 100
+
+        # 100 frames of MPEG 1 layer III, 128 kbit/s, 44100 Hz
+        audio = (b"\xFF\xFB\x90\x00" + b"\0" * 413) * 100
+
+        with open(dir_name + "/test_audio.mp3", "wb") as f:
+            f.write(id3 + audio)
+
+        try:
+            info = parser.parse(dir_name + "/test_audio.mp3")
+        finally:
+            os.remove(dir_name + "/test_audio.mp3")
+
+        self.assertEqual(info["format_long_name"], "MP2/3 (MPEG audio layer 2/3)")
+        self.assertAlmostEqual(info["duration"], 2.60625)
+        self.assertEqual(info["title"], "Song")
+        self.assertEqual(info["album"], "Album")
+        self.assertEqual(info["genre"], "Rock")
+        self.assertEqual(info["album_artist"], "Band")
+
+    def test_audio_flac(self):
+        parser = MediaFileParser([], dir_name)
+
+        # 441000 samples at 44100 Hz, 2 channels, 16 bits
+        stream_info = b"\x10\x00\x10\x00" + b"\0" * 6 + \
+            ((44100 << 44) | (1 << 41) | (15 << 36) | 441000).to_bytes(8, "big") + b"\0" * 16
+
+        comments = [b"TITLE=Song", b"ALBUM=Album", b"GENRE=Jazz", b"ALBUMARTIST=Band"]
+        vorbis_comment = (6).to_bytes(4, "little") + b"vendor" + len(comments).to_bytes(4, "little") + \
+            b"".join(len(c).to_bytes(4, "little") + c for c in comments)
+
+        with open(dir_name + "/test_audio.flac", "wb") as f:
+            f.write(b"fLaC" + b"\x00" + len(stream_info).to_bytes(3, "big") + stream_info +
+                    b"\x84" + len(vorbis_comment).to_bytes(3, "big") + vorbis_comment)
+
+        try:
+            info = parser.parse(dir_name + "/test_audio.flac")
+        finally:
+            os.remove(dir_name + "/test_audio.flac")
+
+        self.assertEqual(info["format_long_name"], "raw FLAC")
+        self.assertEqual(info["duration"], 10)
+        self.assertEqual(info["title"], "Song")
+        self.assertEqual(info["album"], "Album")
+        self.assertEqual(info["genre"], "Jazz")
+        self.assertEqual(info["album_artist"], "Band")
+
+    def test_video_mp4_title(self):
+        parser = MediaFileParser([], dir_name + "/test_files")
+
+        info = parser.parse(dir_name + "/test_files/vid3.mp4")
+
+        self.assertEqual(info["duration"], 10.64)
+        self.assertTrue(info["title"].startswith("Helicopter"))
+
+    def test_id3_flac(self):
+
+        stream_info = b"\x10\x00\x10\x00" + b"\0" * 6 + \
+            ((44100 << 44) | (1 << 41) | (15 << 36) | 441000).to_bytes(8, "big") + b"\0" * 16
+        id3 = b"ID3\x03\x00\x00\x00\x00\x00\x14" + b"\0" * 20
+
+        with open(dir_name + "/test_audio.flac", "wb") as f:
+            f.write(id3 + b"fLaC" + b"\x80" + len(stream_info).to_bytes(3, "big") + stream_info)
+
+        try:
+            info = read_media_info(dir_name + "/test_audio.flac")
+        finally:
+            os.remove(dir_name + "/test_audio.flac")
+
+        self.assertEqual(info["format_long_name"], "raw FLAC")
+        self.assertEqual(info["duration"], 10)
+
+    def test_id3_unknown_format(self):
+
+        id3 = b"ID3\x03\x00\x00\x00\x00\x00\x14" + b"\0" * 20
+        # A frame header that isn't followed by another frame is not MP3 audio
+        data = os.urandom(2000).replace(b"\xFF", b"\xFE") + b"\xFF\xFB\x90\x00" + b"\0" * 1000
+
+        with open(dir_name + "/test_audio.bin", "wb") as f:
+            f.write(id3 + data)
+
+        try:
+            info = read_media_info(dir_name + "/test_audio.bin")
+        finally:
+            os.remove(dir_name + "/test_audio.bin")
+
+        self.assertIsNone(info)
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import time
+from unittest import TestCase
+
+import config
+from crawler import Crawler
+from parsing import GenericFileParser, TextFileParser
+from storage import ParseCache
+from test.helpers import CountingFileParser
+
+dir_name = os.path.dirname(os.path.abspath(__file__))
+
+
+class ParseCacheTest(TestCase):
+
+    def setUp(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(dir_name + "/test_cache.db" + suffix):
+                os.remove(dir_name + "/test_cache.db" + suffix)
+
+        self.cache = ParseCache(dir_name + "/test_cache.db")
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(dir_name + "/test_cache.db" + suffix):
+                os.remove(dir_name + "/test_cache.db" + suffix)
+
+    def test_put_get(self):
+
+        parser = GenericFileParser([], dir_name)
+        file_stat = os.stat(dir_name + "/test_files/text.csv")
+
+        self.assertIsNone(self.cache.get(parser, file_stat))
+
+        self.cache.put(parser, file_stat, {"content": "abc"})
+
+        self.assertEqual(self.cache.get(parser, file_stat), {"content": "abc"})
+
+    def test_parser_options(self):
+
+        file_stat = os.stat(dir_name + "/test_files/text.csv")
+
+        self.cache.put(TextFileParser([], 100, dir_name), file_stat, {"content": "abc"})
+
+        self.assertIsNone(self.cache.get(TextFileParser([], 200, dir_name), file_stat))
+        self.assertIsNone(self.cache.get(GenericFileParser([], dir_name), file_stat))
+
+    def test_parser_version(self):
+
+        parser = GenericFileParser([], dir_name)
+        file_stat = os.stat(dir_name + "/test_files/text.csv")
+
+        self.cache.put(parser, file_stat, {"content": "abc"})
+        parser.version += 1
+
+        self.assertIsNone(self.cache.get(parser, file_stat))
+
+    def test_prune_max_entries(self):
+
+        max_entries = config.parse_cache_max_entries
+        config.parse_cache_max_entries = 2
+
+        parser = GenericFileParser([], dir_name)
+        stats = [os.stat(dir_name + "/test_files/" + name) for name in ("text.csv", "docx1.docx", "epub1.epub")]
+
+        try:
+            for file_stat in stats:
+                self.cache.put(parser, file_stat, {"content": "abc"})
+                time.sleep(0.01)
+            # The first result was used last
+            self.cache.get(parser, stats[0])
+            self.cache.prune()
+        finally:
+            config.parse_cache_max_entries = max_entries
+
+        self.assertIsNotNone(self.cache.get(parser, stats[0]))
+        self.assertIsNone(self.cache.get(parser, stats[1]))
+        self.assertIsNotNone(self.cache.get(parser, stats[2]))
+
+    def test_prune_max_age(self):
+
+        max_age = config.parse_cache_max_age
+        prune_interval = config.parse_cache_prune_interval
+        config.parse_cache_max_age = 0.05
+        config.parse_cache_prune_interval = 1
+
+        parser = GenericFileParser([], dir_name)
+        old_stat = os.stat(dir_name + "/test_files/text.csv")
+        new_stat = os.stat(dir_name + "/test_files/docx1.docx")
+
+        try:
+            self.cache.put(parser, old_stat, {"content": "abc"})
+            time.sleep(0.1)
+            # Pruned as results are added
+            self.cache.put(parser, new_stat, {"content": "def"})
+        finally:
+            config.parse_cache_max_age = max_age
+            config.parse_cache_prune_interval = prune_interval
+
+        self.assertIsNone(self.cache.get(parser, old_stat))
+        self.assertEqual(self.cache.get(parser, new_stat), {"content": "def"})
+
+    def test_upgrade(self):
+
+        os.remove(dir_name + "/test_cache.db")
+        conn = sqlite3.connect(dir_name + "/test_cache.db")
+        conn.execute("CREATE TABLE ParseCache (dev INTEGER, ino INTEGER, size INTEGER, "
+                     "mtime INTEGER, parser TEXT, doc TEXT, PRIMARY KEY (dev, ino, size, mtime, parser))")
+        parser = GenericFileParser([], dir_name)
+        file_stat = os.stat(dir_name + "/test_files/text.csv")
+        conn.execute("INSERT INTO ParseCache VALUES (?,?,?,?,?,?)",
+                     ParseCache.file_key(file_stat) + (parser.cache_key(), '{"content": "abc"}'))
+        conn.commit()
+        conn.close()
+
+        cache = ParseCache(dir_name + "/test_cache.db")
+        cache.prune()
+
+        self.assertEqual(cache.get(parser, file_stat), {"content": "abc"})
+
+    def test_crawl_cached(self):
+
+        parser = CountingFileParser([], dir_name + "/test_folder")
+
+        c = Crawler([parser], parse_cache=self.cache)
+        c.crawl(dir_name + "/test_folder")
+        self.assertEqual(len(parser.parsed_files), 31)
+
+        c = Crawler([parser], parse_cache=self.cache)
+        c.crawl(dir_name + "/test_folder")
+        self.assertEqual(len(parser.parsed_files), 31)
+
+        self.assertEqual(len(c.documents), 31)
+        self.assertEqual(len([doc for doc in c.documents if doc["path"] == "sub2"]), 2)
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+import config
+from benchmark import ParserStats
+
+
+class ParserStatsTest(TestCase):
+
+    def setUp(self):
+        self.reservoir_size = config.benchmark_reservoir_size
+        config.benchmark_reservoir_size = 100
+
+    def tearDown(self):
+        config.benchmark_reservoir_size = self.reservoir_size
+
+    def test_reservoir(self):
+
+        stats = ParserStats()
+        for i in range(1000):
+            stats.add(i / 1000)
+
+        # Only a sample is kept, the totals count every file
+        self.assertEqual(len(stats.times), 100)
+        self.assertEqual(stats.files, 1000)
+        self.assertAlmostEqual(stats.parse_time, 499.5)
+        self.assertAlmostEqual(stats.percentile(0.5), 0.5, delta=0.2)
+        self.assertGreater(stats.percentile(0.99), 0.8)
@@ -15,3 +15,25 @@ class PdfParserTest(TestCase):
 
         self.assertEqual(len(info["content"]), 12488)
         self.assertTrue(info["content"].startswith("Rabies\n03/11/2011\nRabies"))
+
+    def test_parse_content_fast(self):
+
+        parser = PdfFileParser([], 12488, "test_files/", fast=True)
+
+        info = parser.parse(dir_name + "/test_files/pdf1.pdf")
+
+        self.assertEqual(len(info["content"]), 12488)
+        self.assertTrue(info["content"].startswith("Rabies\nDirectorate Communnication\nRabies"))
+        self.assertIn("What is rabies?", info["content"])
+
+    def test_max_pages(self):
+
+        parser = PdfFileParser([], 100000, "test_files/", fast=True, max_pages=1)
+        first_page = parser.parse(dir_name + "/test_files/pdf1.pdf")["content"]
+
+        parser = PdfFileParser([], 100000, "test_files/", fast=True, max_pages=2)
+        two_pages = parser.parse(dir_name + "/test_files/pdf1.pdf")["content"]
+
+        self.assertTrue(two_pages.startswith(first_page))
+        self.assertGreater(len(two_pages), len(first_page))
+        self.assertNotEqual(PdfFileParser([], 100, "", max_pages=1).cache_key(), PdfFileParser([], 100, "").cache_key())
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from parsing import TextFileParser
+from parsing import TextFileParser, EncodingDetector
+import config
 import os
 
 dir_name = os.path.dirname(os.path.abspath(__file__))
@@ -16,3 +17,45 @@ class TextFileParserTest(TestCase):
         self.assertTrue(info["content"].startswith("rosbagTimestamp,header,seq,stamp,secs,nsecs,"))
         self.assertEqual(len(info["content"]), 1234)
         self.assertEqual(info["encoding"], "ascii")
+
+
+class EncodingDetectorTest(TestCase):
+
+    def test_fast_path(self):
+
+        detector = EncodingDetector()
+
+        self.assertEqual(detector.detect(b"plain text"), "ascii")
+        self.assertEqual(detector.detect("d\u00e9j\u00e0 vu".encode("utf-8")), "utf-8")
+        self.assertEqual(detector.detect("text".encode("utf-8-sig")), "UTF-8-SIG")
+        self.assertEqual(detector.detect("text".encode("utf-16")), "UTF-16")
+        self.assertEqual(sum(detector.encodings.values()), 0)
+
+    def test_truncated_utf8(self):
+
+        detector = EncodingDetector()
+        data = "\u00e9t\u00e9".encode("utf-8")[:-1]
+
+        self.assertEqual(detector.detect(data, truncated=True), "utf-8")
+        self.assertFalse(EncodingDetector.is_valid(data, "utf-8", truncated=False))
+
+    def test_usual_encoding(self):
+
+        detector = EncodingDetector()
+        data = "\u65e5\u672c\u8a9e\u306e\u30c6\u30ad\u30b9\u30c8\u3067\u3059".encode("euc-jp")
+
+        detector.encodings["EUC-JP"] = config.encoding_stats_min_files
+        self.assertEqual(detector.detect(data), "EUC-JP")
+        # Found without chardet
+        self.assertEqual(sum(detector.encodings.values()), config.encoding_stats_min_files)
+
+    def test_usual_single_byte_encoding(self):
+
+        detector = EncodingDetector()
+        data = "Les \u00e9l\u00e8ves ont \u00e9t\u00e9 tr\u00e8s s\u00e9rieux cette ann\u00e9e".encode("cp1252")
+
+        # Any data is valid ISO-8859-1, chardet is still used
+        detector.encodings["ISO-8859-1"] = config.encoding_stats_min_files
+        self.assertIsNone(detector.usual_encoding())
+        detector.detect(data)
+        self.assertEqual(sum(detector.encodings.values()), config.encoding_stats_min_files + 1)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from tuning import ThreadCountTuner
+import config
+
+
+class ThreadCountTunerTest(TestCase):
+
+    def setUp(self):
+        # Don't let the load of the test machine influence the results
+        self.max_cpu = config.autotune_max_cpu
+        self.max_iowait = config.autotune_max_iowait
+        config.autotune_max_cpu = 1.1
+        config.autotune_max_iowait = 1.1
+
+    def tearDown(self):
+        config.autotune_max_cpu = self.max_cpu
+        config.autotune_max_iowait = self.max_iowait
+
+    def test_grow_while_faster(self):
+
+        tuner = ThreadCountTuner(8, maximum=64)
+
+        tuner.completed = 100
+        self.assertEqual(tuner.update(1), 10)
+
+        tuner.completed = 300
+        self.assertEqual(tuner.update(1), 12)
+
+    def test_reverse_when_slower(self):
+
+        tuner = ThreadCountTuner(8, maximum=64)
+
+        tuner.completed = 100
+        self.assertEqual(tuner.update(1), 10)
+
+        tuner.completed = 150
+        self.assertEqual(tuner.update(1), 9)
+
+    def test_idle(self):
+
+        tuner = ThreadCountTuner(8, maximum=64)
+
+        self.assertEqual(tuner.update(1), 8)
+
+    def test_bounds(self):
+
+        tuner = ThreadCountTuner(4, minimum=2, maximum=5)
+
+        for i in range(1, 5):
+            tuner.completed += 100 * i
+            self.assertTrue(2 <= tuner.update(1) <= 5)
+
+    def test_done(self):
+
+        tuner = ThreadCountTuner(4)
+
+        tuner.done()
+        tuner.done()
+
+        self.assertEqual(tuner.completed, 2)
@@ -0,0 +1,123 @@
+from queue import Queue
+from threading import enumerate as enumerate_threads
+from unittest import TestCase
+
+from walker import Walker, WalkFilter, split_tree, read_listing
+import os
+
+dir_name = os.path.dirname(os.path.abspath(__file__))
+
+
+class WalkerTest(TestCase):
+
+    def test_walk(self):
+
+        files = list(Walker(4).walk(dir_name + "/test_folder"))
+
+        self.assertEqual(len(files), 31)
+        self.assertEqual(len(set(path for path, _ in files)), 31)
+
+    def test_walk_stat(self):
+
+        for path, file_stat in Walker(4).walk(dir_name + "/test_folder"):
+            self.assertEqual(file_stat.st_size, os.path.getsize(path))
+
+    def test_walk_stopped(self):
+
+        threads = set(enumerate_threads())
+        walker = Walker(4)
+        # The threads are blocked on the full queue when the walk is stopped
+        walker.out_q = Queue(1)
+
+        files = walker.walk(dir_name + "/test_folder")
+        next(files)
+        files.close()
+
+        self.assertEqual(set(enumerate_threads()) - threads, set())
+
+    def test_walk_empty(self):
+
+        os.makedirs(dir_name + "/empty_folder", exist_ok=True)
+
+        try:
+            self.assertEqual(list(Walker().walk(dir_name + "/empty_folder")), [])
+        finally:
+            os.rmdir(dir_name + "/empty_folder")
+
+    def test_walk_max_depth(self):
+
+        self.assertEqual(len(list(Walker(4, max_depth=0).walk(dir_name + "/test_folder"))), 23)
+        self.assertEqual(len(list(Walker(4, max_depth=1).walk(dir_name + "/test_folder"))), 28)
+
+    def test_split_tree(self):
+
+        parts = split_tree(dir_name + "/test_folder", 1)
+        self.assertIn((dir_name + "/test_folder", False), parts)
+        self.assertIn((dir_name + "/test_folder/sub2", True), parts)
+
+        files = []
+        for path, recursive in parts:
+            files.extend(Walker(4, max_depth=None if recursive else 0).walk(path))
+
+        self.assertEqual(len(set(path for path, _ in files)), 31)
+        self.assertEqual(len(files), 31)
+
+    def walk_names(self, walk_filter: WalkFilter) -> set:
+        return set(os.path.relpath(path, dir_name + "/test_folder") for path, _ in
+                   Walker(4, walk_filter=walk_filter).walk(dir_name + "/test_folder"))
+
+    def test_exclude_glob(self):
+
+        files = self.walk_names(WalkFilter(dir_name + "/test_folder", ["sub_sub1", "*.jpg"]))
+
+        self.assertNotIn("sub2/sub_sub1/mp500.xml", files)
+        self.assertNotIn("sample_1.jpg", files)
+        self.assertIn("sub2/monitor.xml", files)
+        self.assertIn("sample_2.jpeg", files)
+
+    def test_exclude_path(self):
+
+        files = self.walk_names(WalkFilter(dir_name + "/test_folder", ["sub2/*.xml", "re:^sub1/m"]))
+
+        self.assertNotIn("sub2/monitor.xml", files)
+        self.assertNotIn("sub1/mem.xml", files)
+        self.assertIn("sub2/sub_sub1/mp500.xml", files)
+
+    def test_filter_depth_and_size(self):
+
+        files = self.walk_names(WalkFilter(dir_name + "/test_folder", max_depth=1, max_file_size=100000))
+
+        self.assertIn("sub2/monitor.xml", files)
+        self.assertNotIn("sub2/sub_sub1/mp500.xml", files)
+        self.assertIn("sample_2.jpeg", files)
+        self.assertNotIn("sample_3.jpg", files)
+
+    def test_one_file_system(self):
+
+        walk_filter = WalkFilter(dir_name + "/test_folder", one_file_system=True)
+        sub_stat = os.stat(dir_name + "/test_folder/sub1")
+
+        self.assertFalse(walk_filter.skip_dir(dir_name + "/test_folder/sub1", sub_stat))
+
+        walk_filter.root_dev = sub_stat.st_dev + 1
+        self.assertTrue(walk_filter.skip_dir(dir_name + "/test_folder/sub1", sub_stat))
+
+    def test_read_listing(self):
+
+        with open(dir_name + "/test_listing.txt", "w") as f:
+            f.write("a/file.txt\t120\t1500000000.5\t42\n")
+            f.write("/abs/path.txt\t10\t1500000000\n")
+            f.write("invalid line\n")
+            f.write("node_modules/lib.js\t10\t1500000000\n")
+
+        try:
+            files = list(read_listing(dir_name + "/test_listing.txt", "/root",
+                                      WalkFilter("/root", ["node_modules"])))
+        finally:
+            os.remove(dir_name + "/test_listing.txt")
+
+        self.assertEqual([path for path, _ in files], ["/root/a/file.txt", "/abs/path.txt"])
+        self.assertEqual(files[0][1].st_size, 120)
+        self.assertEqual(files[0][1].st_mtime, 1500000000.5)
+        self.assertEqual(files[0][1].st_ino, 42)
+        self.assertEqual(files[1][1].st_ino, 0)
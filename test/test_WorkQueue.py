@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from storage import WorkQueue, Directory, Option
+import config
+import os
+
+dir_name = os.path.dirname(os.path.abspath(__file__))
+
+
+class WorkQueueTest(TestCase):
+
+    def setUp(self):
+        if os.path.exists(dir_name + "/test_work_queue.db"):
+            os.remove(dir_name + "/test_work_queue.db")
+
+        self.queue = WorkQueue(dir_name + "/test_work_queue.db")
+
+        directory = Directory("/some/dir", True, [Option("FileParsers", "text")], "my dir")
+        directory.id = 3
+        self.queue.add_task(1, directory, [("/some/dir", False), ("/some/dir/a", True)])
+
+    def tearDown(self):
+        os.remove(dir_name + "/test_work_queue.db")
+
+    def test_directory(self):
+
+        directory = self.queue.directory(1)
+
+        self.assertEqual(directory.id, 3)
+        self.assertEqual(directory.path, "/some/dir")
+        self.assertEqual(directory.get_option("FileParsers"), "text")
+        self.assertIsNone(self.queue.directory(2))
+
+    def test_claim_and_complete(self):
+
+        unit1 = self.queue.claim("worker1")
+        unit2 = self.queue.claim("worker2", 1)
+
+        self.assertEqual(unit1[1:], (1, "/some/dir", False, 1))
+        self.assertEqual(unit2[1:], (1, "/some/dir/a", True, 1))
+        self.assertIsNone(self.queue.claim("worker3"))
+
+        self.queue.complete(unit1[0], "worker1", 10, 12)
+        self.assertEqual(self.queue.progress(1), (1, 2, 10, 12))
+
+        self.queue.heartbeat(unit2[0], "worker2", 5, 6)
+        self.assertEqual(self.queue.progress(1), (1, 2, 15, 18))
+
+    def test_reclaim_lost_unit(self):
+
+        lease = config.work_unit_lease
+        config.work_unit_lease = -1
+
+        try:
+            unit = self.queue.claim("worker1")
+            self.queue.save_journal(unit[0], ["file.txt"])
+
+            reclaimed = self.queue.claim("worker2")
+        finally:
+            config.work_unit_lease = lease
+
+        self.assertEqual(reclaimed[0], unit[0])
+        self.assertEqual(reclaimed[4], 2)
+        self.assertEqual(self.queue.journal(unit[0]), {"file.txt"})
+
+        # The lost worker can't report anymore
+        self.assertFalse(self.queue.heartbeat(unit[0], "worker1", 0, 0))
+        self.assertTrue(self.queue.heartbeat(unit[0], "worker2", 0, 0))
+
+    def test_remove_task(self):
+
+        self.queue.remove_task(1)
+
+        self.assertFalse(self.queue.has_task(1))
+        self.assertIsNone(self.queue.claim("worker1"))
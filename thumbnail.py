@@ -1,5 +1,5 @@
-from queue import Full, Empty
-from threading import Thread
+from queue import Full
+from threading import Thread, Lock, current_thread
 
 from PIL import Image
 import os
@@ -7,6 +7,8 @@ from multiprocessing import Value, Process
 from queue import Queue
 import ffmpeg
 import config
+from fileio import open_file
+from tuning import ThreadCountTuner
 
 if config.cairosvg:
     import cairosvg
@@ -19,6 +21,11 @@ class ThumbnailGenerator:
         self.quality = quality
         self.color = tuple(bytes.fromhex(color))
 
+        self.threads = []
+        self.thread_count = config.tn_threads
+        self.lock = Lock()
+        self.tuner = None
+
     def generate(self, path, dest_path, mime):
 
         if mime is None:
@@ -66,12 +73,12 @@ class ThumbnailGenerator:
 
     def worker(self, in_q: Queue, counter: Value, dest_path, directory):
 
+        current = current_thread()
+
         while True:
-            try:
-                doc = in_q.get(timeout=1)
-                if doc is None:
-                    break
-            except Empty:
+            doc = in_q.get()
+            if doc is None:
+                in_q.task_done()
                 break
 
             extension = "" if doc["_source"]["extension"] == "" else "." + doc["_source"]["extension"]
@@ -82,19 +89,48 @@ class ThumbnailGenerator:
 
             if counter is not None:
                 counter.value += 1
+            if self.tuner is not None:
+                self.tuner.done()
+
+            with self.lock:
+                # Extra threads exit when the tuner shrinks the pool
+                retire = len(self.threads) > self.thread_count
+                if retire:
+                    self.threads.remove(current)
 
             in_q.task_done()
 
-    def generate_all(self, docs, dest_path, counter: Value = None, directory=None, total_count=None):
+            if retire:
+                break
+
+    def resize(self, count: int, in_q: Queue, counter: Value, dest_path, directory, workers: Value = None):
+        """
+        Set the number of worker threads. Extra threads exit after their current thumbnail
+        """
+
+        with self.lock:
+            self.thread_count = count
+            while len(self.threads) < count:
+                t = Thread(target=self.worker, args=[in_q, counter, dest_path, directory])
+                self.threads.append(t)
+                t.start()
+
+        if workers:
+            workers.value = count
+
+    def generate_all(self, docs, dest_path, counter: Value = None, directory=None, total_count=None,
+                     workers: Value = None):
 
         os.makedirs(dest_path, exist_ok=True)
 
         in_q = Queue(50000)  # TODO: load from config?
-        threads = []
-        for _ in range(config.tn_threads):
-            t = Thread(target=self.worker, args=[in_q, counter, dest_path, directory])
-            threads.append(t)
-            t.start()
+        self.resize(config.tn_threads, in_q, counter, dest_path, directory, workers)
+
+        if config.autotune_threads:
+            self.tuner = ThreadCountTuner(config.tn_threads,
+                                          lambda count: self.resize(count, in_q, counter, dest_path, directory,
+                                                                    workers))
+            self.tuner.start()
 
         for doc in docs:
             while True:
@@ -107,6 +143,15 @@ class ThumbnailGenerator:
                     continue
 
         in_q.join()
+
+        if self.tuner is not None:
+            self.tuner.stop()
+            self.tuner = None
+
+        with self.lock:
+            threads = list(self.threads)
+            self.threads.clear()
+
         for _ in threads:
             in_q.put(None)
         for t in threads:
@@ -115,7 +160,7 @@ class ThumbnailGenerator:
     def generate_image(self, path, dest_path):
 
         try:
-            with open(path, "rb") as image_file:
+            with open_file(path) as image_file:
                 with Image.open(image_file) as image:
 
                     # https://stackoverflow.com/questions/43978819
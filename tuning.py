@@ -0,0 +1,498 @@
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from multiprocessing import Value
+from threading import Thread, Lock, Event, Condition, current_thread
+
+import config
+
+
+def read_cpu_times():
+    """
+    Read the cumulative system-wide CPU times from /proc/stat
+    :return: (busy, iowait, total) tuple, None if unavailable
+    """
+
+    try:
+        with open("/proc/stat", "r") as f:
+            fields = [int(x) for x in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+
+    idle = fields[3]
+    iowait = fields[4] if len(fields) > 4 else 0
+    total = sum(fields[:8])
+
+    return total - idle - iowait, iowait, total
+
+
+def cpu_load(previous, current):
+    """
+    Get the CPU usage between two calls of read_cpu_times()
+    :return: (busy ratio, I/O wait ratio) tuple, None if unavailable
+    """
+
+    if previous is None or current is None:
+        return None
+
+    total = current[2] - previous[2]
+    if total <= 0:
+        return None
+
+    return (current[0] - previous[0]) / total, (current[1] - previous[1]) / total
+
+
+def read_rss():
+    """
+    Read the resident set size of the current process from /proc/self/statm
+    :return: RSS in bytes, None if unavailable
+    """
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def device_kind(st_dev: int) -> str:
+    """
+    Find the kind of the block device holding a file system
+    :param st_dev: device id, as found in stat results
+    :return: rotational, ssd or other (network and virtual file systems, or unknown)
+    """
+
+    path = "/sys/dev/block/%d:%d" % (os.major(st_dev), os.minor(st_dev))
+    if not os.path.exists(path):
+        return "other"
+
+    # Partitions don't have a queue, their parent device does
+    path = os.path.realpath(path)
+    for queue in (os.path.join(path, "queue"), os.path.join(os.path.dirname(path), "queue")):
+        try:
+            with open(os.path.join(queue, "rotational"), "r") as f:
+                return "rotational" if f.read().strip() == "1" else "ssd"
+        except OSError:
+            continue
+
+    return "other"
+
+
+def device_queue_depth(st_dev: int) -> int:
+    """Get the maximum number of files read at the same time from a device"""
+    return config.device_queue_depths.get(device_kind(st_dev), config.device_queue_depths["other"])
+
+
+class DeviceSlots:
+    """
+    Limits the number of files read at the same time from each device to its queue depth. The slots are shared
+    by the threads of the process and by the processes forked after it is created. Devices are counted in a fixed
+    number of counters, devices that share a counter share its slots
+    """
+
+    def __init__(self, counters: int = 64):
+        self.cond = multiprocessing.Condition()
+        self.used = multiprocessing.Array("i", counters, lock=False)
+
+        # Per process: st_dev -> queue depth, and token -> (thread, counter) of the slots that are held
+        self.depths = {}
+        self.holders = {}
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["depths"] = {}
+        state["holders"] = {}
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def depth(self, st_dev: int) -> int:
+        depth = self.depths.get(st_dev)
+        if depth is None:
+            depth = self.depths[st_dev] = device_queue_depth(st_dev)
+        return depth
+
+    def is_free(self, st_dev: int) -> bool:
+        """Check, without waiting, if a slot of a device is free"""
+        return self.used[st_dev % len(self.used)] < self.depth(st_dev)
+
+    def acquire(self, st_dev: int):
+        """
+        Wait for a free slot of a device
+        :return: token of the slot, for release()
+        """
+
+        counter = st_dev % len(self.used)
+        depth = self.depth(st_dev)
+
+        # A thread that already reads from the device doesn't wait for itself (files opened while another is open)
+        with self.lock:
+            nested = (current_thread(), counter) in self.holders.values()
+
+        with self.cond:
+            while self.used[counter] >= depth and not nested:
+                self.cond.wait()
+            self.used[counter] += 1
+
+        token = object()
+        with self.lock:
+            self.holders[token] = (current_thread(), counter)
+        return token
+
+    def release(self, token):
+        """Release a slot, unless release_thread() already released it"""
+
+        with self.lock:
+            holder = self.holders.pop(token, None)
+
+        if holder is not None:
+            self.free([holder[1]])
+
+    def release_thread(self, thread: Thread):
+        """Release the slots held by a thread that was abandoned, they are not released again by the thread"""
+
+        with self.lock:
+            tokens = [token for token, (holder, _) in self.holders.items() if holder is thread]
+            counters = [self.holders.pop(token)[1] for token in tokens]
+        self.free(counters)
+
+    def free(self, counters: list):
+
+        if not counters:
+            return
+
+        with self.cond:
+            for counter in counters:
+                self.used[counter] -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, st_dev: int):
+        token = self.acquire(st_dev)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+
+class ByteBudget:
+    """
+    Limits the size of the data held between two stages of a pipeline. Producers wait in acquire()
+    until consumers release enough bytes. Data is always admitted when nothing is held, so that
+    a single large item can't block the pipeline
+    """
+
+    def __init__(self, limit: int, memory_limit: int = 0, memory_floor: int = 0):
+        """
+        :param limit: maximum number of bytes held
+        :param memory_limit: producers also wait while the RSS of the process is above this value (0 for no limit)
+        :param memory_floor: the memory limit doesn't hold producers back while less than this number of bytes
+        is held, so that the consumers still get batches of that size
+        """
+        self.limit = limit
+        self.memory_limit = memory_limit
+        self.memory_floor = memory_floor
+        self.used = 0
+        # Number of producers waiting in acquire(), consumers that batch the data release it early when it isn't 0
+        self.waiting = 0
+        self.cond = Condition()
+
+        self.rss = 0
+        self.rss_time = 0
+
+    def over_memory_limit(self) -> bool:
+
+        if not self.memory_limit:
+            return False
+
+        # /proc is read at most every 100ms
+        now = time.time()
+        if now - self.rss_time > 0.1:
+            self.rss = read_rss() or 0
+            self.rss_time = now
+
+        return self.rss > self.memory_limit
+
+    def must_wait(self, size: int) -> bool:
+        if self.used == 0:
+            return False
+        if self.used + size > self.limit:
+            return True
+        return self.used >= self.memory_floor and self.over_memory_limit()
+
+    def acquire(self, size: int):
+
+        with self.cond:
+            if not self.must_wait(size):
+                self.used += size
+                return
+
+            self.waiting += 1
+            try:
+                while self.must_wait(size):
+                    # The memory usage is checked again even if nothing is released
+                    self.cond.wait(1)
+            finally:
+                self.waiting -= 1
+            self.used += size
+
+    def release(self, size: int):
+
+        with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+
+
+class ThreadCountTuner:
+    """
+    Adjusts the number of worker threads of a pool to maximise the number of processed files per second.
+    Throughput is measured at regular intervals and the thread count climbs in the direction that improved it.
+    The pool is not grown while the disks (I/O wait) or the CPUs are saturated
+    """
+
+    def __init__(self, initial: int, on_resize=None, minimum: int = 1, maximum: int = None, interval: float = None):
+        self.workers = initial
+        self.on_resize = on_resize
+        self.minimum = minimum
+        self.maximum = config.autotune_max_threads if maximum is None else maximum
+        self.interval = config.autotune_interval if interval is None else interval
+
+        self.completed = 0
+        self.lock = Lock()
+
+        self.direction = 1
+        self.step = max(1, initial // 4)
+        self.last_completed = 0
+        self.last_rate = None
+        self.last_cpu_times = None
+
+        self.stopped = Event()
+        self.thread = None
+
+    def done(self):
+        """Called by the workers after each processed file"""
+        with self.lock:
+            self.completed += 1
+
+    def start(self):
+        self.last_cpu_times = read_cpu_times()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+
+        while not self.stopped.wait(self.interval):
+            workers = self.update(self.interval)
+
+            if self.on_resize is not None:
+                self.on_resize(workers)
+
+    def update(self, elapsed: float) -> int:
+        """
+        Measure the throughput since the last update and choose the new number of workers
+        :param elapsed: time since the last update, in seconds
+        :return: number of workers
+        """
+
+        with self.lock:
+            completed = self.completed - self.last_completed
+            self.last_completed = self.completed
+
+        if completed == 0:
+            # Idle or waiting for files, there is nothing to measure
+            return self.workers
+
+        rate = completed / elapsed
+
+        cpu_times = read_cpu_times()
+        load = cpu_load(self.last_cpu_times, cpu_times)
+        cpu_saturated = load is not None and load[0] > config.autotune_max_cpu
+        io_saturated = load is not None and load[1] > config.autotune_max_iowait
+        self.last_cpu_times = cpu_times
+
+        if self.last_rate is not None and rate < self.last_rate * 0.95:
+            # The last change made things worse, go back with smaller steps
+            self.direction = -self.direction
+            self.step = max(1, self.step // 2)
+
+        self.last_rate = rate
+
+        if self.direction > 0 and (io_saturated or cpu_saturated):
+            # More threads would only compete for the same resources
+            return self.workers
+
+        self.workers = min(self.maximum, max(self.minimum, self.workers + self.direction * self.step))
+
+        return self.workers
+
+
+class RateLimiter:
+    """
+    Limits the rate of an operation. Callers wait in acquire() so that the amounts acquired don't exceed
+    the limit on average. Large amounts are admitted at once and paid back by the following callers.
+    The limit is shared by the threads of the process and by the processes forked after it is created
+    """
+
+    def __init__(self, rate: float = 0):
+        """
+        :param rate: maximum amount per second, 0 for no limit
+        """
+        self.rate = rate
+        # Current limit (lowered by CrawlThrottle when the search engine is overloaded), total amount acquired
+        # and time at which the next amount is admitted
+        self.values = multiprocessing.Array("d", (rate, 0, 0), lock=False)
+        self.lock = multiprocessing.Lock()
+
+    @property
+    def limit(self) -> float:
+        return self.values[0]
+
+    @limit.setter
+    def limit(self, value: float):
+        self.values[0] = value
+
+    @property
+    def total(self) -> float:
+        return self.values[1]
+
+    @total.setter
+    def total(self, value: float):
+        self.values[1] = value
+
+    def acquire(self, amount: float = 1):
+
+        with self.lock:
+            self.values[1] += amount
+            limit = self.values[0]
+            if not limit:
+                return
+
+            now = time.time()
+            # Unused time is not saved up beyond one second, so bursts stay short
+            start = max(self.values[2], now - 1)
+            self.values[2] = start + amount / limit
+            delay = start - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SearchLatency:
+    """
+    Moving average of the time taken by the searches, shared with the crawl processes
+    """
+
+    def __init__(self):
+        self.average = Value("d", 0)
+        self.last_time = Value("d", 0)
+
+    def record(self, elapsed: float):
+        with self.average.get_lock():
+            self.average.value = elapsed if self.average.value == 0 else self.average.value * 0.8 + elapsed * 0.2
+            self.last_time.value = time.time()
+
+    def value(self) -> float:
+        """
+        :return: average search time in seconds, 0 if there were no recent searches
+        """
+        if time.time() - self.last_time.value > config.throttle_latency_window:
+            return 0
+        return self.average.value
+
+
+class CrawlThrottle:
+    """
+    Limits the bytes read, files parsed and documents indexed per second by a crawl. In adaptive mode,
+    the limits are lowered while the searches are slow or elasticsearch rejects documents, and raised
+    back once it recovers
+    """
+
+    def __init__(self, read_rate: float = 0, file_rate: float = 0, index_rate: float = 0, adaptive: bool = False,
+                 search_latency=None, indexer=None):
+        """
+        :param read_rate: maximum bytes read per second, 0 for no limit
+        :param file_rate: maximum files parsed per second, 0 for no limit
+        :param index_rate: maximum documents indexed per second, 0 for no limit
+        :param adaptive: adjust the limits to the load of the search engine
+        :param search_latency: SearchLatency of the search page
+        :param indexer: indexer whose rejections attribute counts the documents rejected by elasticsearch
+        """
+        self.bytes = RateLimiter(read_rate)
+        self.files = RateLimiter(file_rate)
+        self.docs = RateLimiter(index_rate)
+
+        self.adaptive = adaptive
+        self.search_latency = search_latency
+        self.indexer = indexer
+
+        self.lock = Lock()
+        self.last_time = time.time()
+        self.last_totals = (0, 0, 0)
+        self.last_rejections = self.rejections()
+
+    def limiters(self) -> tuple:
+        return self.bytes, self.files, self.docs
+
+    def rejections(self) -> int:
+        return getattr(self.indexer, "rejections", 0)
+
+    def overloaded(self, rejections: int) -> bool:
+        if rejections > self.last_rejections:
+            return True
+        return self.search_latency is not None and self.search_latency.value() > config.throttle_max_search_latency
+
+    def adapt(self):
+        """Adjust the limits to the load of the search engine, at most every throttle_check_interval seconds"""
+
+        if not self.adaptive:
+            return
+
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.last_time
+            if elapsed < config.throttle_check_interval:
+                return
+
+            rejections = self.rejections()
+            overloaded = self.overloaded(rejections)
+            self.last_rejections = rejections
+
+            totals = tuple(limiter.total for limiter in self.limiters())
+            for limiter, total, last_total in zip(self.limiters(), totals, self.last_totals):
+                measured = (total - last_total) / elapsed
+
+                if overloaded:
+                    # Halve the rate that was actually reached, the limit may not have been reached
+                    current = min(limiter.limit, measured) if limiter.limit else measured
+                    if current > 0:
+                        limiter.limit = current / 2
+                elif limiter.limit and limiter.limit != limiter.rate:
+                    limiter.limit *= 1.25
+                    if limiter.rate and limiter.limit >= limiter.rate:
+                        limiter.limit = limiter.rate
+                    elif not limiter.rate and limiter.limit > measured * 2:
+                        # The limit isn't slowing the crawl down anymore
+                        limiter.limit = 0
+
+            self.last_time = now
+            self.last_totals = totals
+
+    def parse(self):
+        """Called before a file is parsed. The bytes are counted as they are read, see fileio.read_limiter"""
+        self.adapt()
+        self.files.acquire(1)
+
+    def index(self, count: int):
+        """Called before count documents are indexed"""
+        self.adapt()
+        self.docs.acquire(count)
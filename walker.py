@@ -0,0 +1,261 @@
+import os
+import re
+import stat
+from fnmatch import fnmatch
+from queue import Queue, Full
+from threading import Thread, Lock, Event
+
+import config
+
+
+class WalkFilter:
+    """
+    Rules deciding which files and sub-directories of a directory are walked. Excluded
+    directories are never listed
+    """
+
+    def __init__(self, root_dir: str, exclude: list = None, max_depth: int = None, max_file_size: int = None,
+                 one_file_system: bool = False):
+        """
+        :param root_dir: root of the directory, paths are matched relative to it
+        :param exclude: glob patterns, matched against names or, if they contain a /, against relative paths.
+        Patterns starting with re: are regular expressions searched in relative paths
+        :param max_depth: depth of the deepest directories that are walked (0: only the root), None for no limit
+        :param max_file_size: size (in bytes) of the largest files that are walked, None for no limit
+        :param one_file_system: don't walk directories on other file systems than the root (mount points)
+        """
+        self.root_dir = root_dir
+        self.max_depth = max_depth
+        self.max_file_size = max_file_size
+        self.root_dev = os.stat(root_dir).st_dev if one_file_system else None
+
+        self.globs = []
+        self.regexes = []
+        for pattern in exclude or []:
+            if pattern.startswith("re:"):
+                self.regexes.append(re.compile(pattern[3:]))
+            else:
+                self.globs.append(pattern)
+
+    def is_excluded(self, path: str) -> bool:
+
+        rel_path = os.path.relpath(path, self.root_dir)
+        name = os.path.basename(path)
+
+        for glob in self.globs:
+            if "/" not in glob:
+                if fnmatch(name, glob):
+                    return True
+                continue
+
+            # Wildcards of path patterns don't match across directories
+            parts = rel_path.split(os.sep)
+            glob_parts = glob.strip("/").split("/")
+            if len(parts) == len(glob_parts) and all(fnmatch(p, g) for p, g in zip(parts, glob_parts)):
+                return True
+
+        return any(regex.search(rel_path) for regex in self.regexes)
+
+    def skip_dir(self, path: str, dir_stat: os.stat_result = None) -> bool:
+        """
+        :param dir_stat: stat result of the directory, needed when walking one file system
+        :return: True if the directory and its content are not walked
+        """
+
+        if self.max_depth is not None and os.path.relpath(path, self.root_dir).count(os.sep) + 1 > self.max_depth:
+            return True
+
+        if self.root_dev is not None and dir_stat is not None and dir_stat.st_dev != self.root_dev:
+            return True
+
+        return self.is_excluded(path)
+
+    def skip_dir_entry(self, entry: os.DirEntry) -> bool:
+        """skip_dir() for a directory listed by os.scandir(), which is only stat'ed when walking one file system"""
+        return self.skip_dir(entry.path, entry.stat(follow_symlinks=False) if self.root_dev is not None else None)
+
+    def skip_file(self, path: str, file_stat: os.stat_result) -> bool:
+
+        if self.max_file_size is not None and file_stat.st_size > self.max_file_size:
+            return True
+
+        return self.is_excluded(path)
+
+
+class Walker:
+    """
+    Lists directories concurrently with os.scandir(). The stat result of each file is
+    returned along with its path so that it doesn't need to be stat'ed again by the parsers
+    """
+
+    def __init__(self, threads: int = None, max_depth: int = None, walk_filter: WalkFilter = None):
+        """
+        :param threads: number of threads listing directories
+        :param max_depth: depth of the deepest directories that are listed (0: only the root), None for no limit
+        :param walk_filter: files and directories to skip
+        """
+        self.threads = config.walk_threads if threads is None else threads
+        self.max_depth = max_depth
+        self.walk_filter = walk_filter
+
+        self.dir_q = Queue()
+        self.out_q = Queue(10000)
+        self.pending_dirs = 0
+        self.lock = Lock()
+        # Set when the consumer stops before the end of the walk
+        self.stopped = Event()
+
+    def walk(self, root_dir: str):
+        """
+        Walk a directory tree. Files are yielded in no particular order
+        :param root_dir: root of the tree
+        :return: generator of (path, stat result) tuples
+        """
+
+        self.pending_dirs = 1
+        self.dir_q.put((root_dir, 0))
+
+        threads = []
+        for _ in range(self.threads):
+            t = Thread(target=self.list_dirs, daemon=True)
+            threads.append(t)
+            t.start()
+
+        try:
+            while True:
+                item = self.out_q.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # The generator is closed early when the consumer stops, the threads may be waiting for room in out_q
+            self.stopped.set()
+            while not self.out_q.empty():
+                self.out_q.get()
+
+            for _ in threads:
+                self.dir_q.put(None)
+            for t in threads:
+                t.join()
+
+    def put(self, item):
+        """Put an item in out_q, unless the walk was stopped"""
+
+        while not self.stopped.is_set():
+            try:
+                self.out_q.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def list_dirs(self):
+
+        while True:
+            item = self.dir_q.get()
+            if item is None or self.stopped.is_set():
+                break
+            path, depth = item
+
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if self.stopped.is_set():
+                            break
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.max_depth is not None and depth >= self.max_depth:
+                                    continue
+                                if self.walk_filter is not None and self.walk_filter.skip_dir_entry(entry):
+                                    continue
+                                with self.lock:
+                                    self.pending_dirs += 1
+                                self.dir_q.put((entry.path, depth + 1))
+                            elif entry.is_file():
+                                file_stat = entry.stat()
+                                if self.walk_filter is not None and self.walk_filter.skip_file(entry.path, file_stat):
+                                    continue
+                                self.put((entry.path, file_stat))
+                        except OSError:
+                            continue
+            except OSError as e:
+                print("Couldn't list directory: " + str(e))
+            finally:
+                with self.lock:
+                    self.pending_dirs -= 1
+                    if self.pending_dirs == 0:
+                        self.put(None)
+
+
+def split_tree(root_dir: str, depth: int, walk_filter: WalkFilter = None) -> list:
+    """
+    Split a directory tree into parts that can be walked separately. The directories above the
+    sub-trees are listed without recursion so that every file is in exactly one part
+    :param root_dir: root of the tree
+    :param depth: depth of the directories at the top of the sub-trees
+    :param walk_filter: directories to leave out
+    :return: list of (path, recursive) tuples
+    """
+
+    if depth <= 0:
+        return [(root_dir, True)]
+
+    parts = [(root_dir, False)]
+
+    try:
+        with os.scandir(root_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if walk_filter is not None and walk_filter.skip_dir_entry(entry):
+                        continue
+                    parts.extend(split_tree(entry.path, depth - 1, walk_filter))
+    except OSError as e:
+        print("Couldn't list directory: " + str(e))
+
+    return parts
+
+
+def read_listing(listing_path: str, root_dir: str, walk_filter: WalkFilter = None):
+    """
+    Read the files of a directory from a listing instead of walking it. Each line of the listing is
+    path<TAB>size<TAB>mtime, optionally followed by <TAB>inode, as written by
+    find -type f -printf '%p\\t%s\\t%T@\\t%i\\n'
+    :param listing_path: path of the listing
+    :param root_dir: directory of the relative paths of the listing
+    :param walk_filter: files and directories to skip
+    :return: generator of (path, stat result) tuples. The stat results are built from the listing,
+    their inode is 0 when the listing doesn't have it
+    """
+
+    skipped_dirs = {}  # directory -> True if it is excluded
+
+    def is_skipped_dir(path):
+        if path == root_dir or len(path) < len(root_dir):
+            return False
+        if path not in skipped_dirs:
+            skipped_dirs[path] = is_skipped_dir(os.path.dirname(path)) or walk_filter.skip_dir(path)
+        return skipped_dirs[path]
+
+    with open(listing_path, "r", errors="surrogateescape") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                continue
+
+            try:
+                full_path = os.path.join(root_dir, fields[0])
+                size = int(fields[1])
+                mtime = float(fields[2])
+                ino = int(fields[3]) if len(fields) > 3 and fields[3] else 0
+            except ValueError:
+                print("Invalid line in listing: " + line)
+                continue
+
+            mtime_ns = int(mtime * 1e9)
+            file_stat = os.stat_result((stat.S_IFREG | 0o644, ino, 0, 1, 0, 0, size, int(mtime), int(mtime),
+                                        int(mtime), mtime, mtime, mtime, mtime_ns, mtime_ns, mtime_ns))
+
+            if walk_filter is not None and (is_skipped_dir(os.path.dirname(full_path)) or
+                                            walk_filter.skip_file(full_path, file_stat)):
+                continue
+
+            yield full_path, file_stat
@@ -0,0 +1,280 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import config
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_ONLYDIR | IN_DONT_FOLLOW
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Minimal wrapper around the Linux inotify API
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this system")
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float) -> list:
+        """
+        Wait for events
+        :param timeout: maximum time to wait, in seconds
+        :return: list of (wd, mask, cookie, name) tuples
+        """
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        buf = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Keeps the index of a directory up to date by watching it with inotify. Events are debounced and
+    only the files that changed are sent through the crawler's parsers and indexed
+    """
+
+    def __init__(self, crawler, root_dir: str, doc_ids: dict, search=None):
+        """
+        :param crawler: Crawler used to parse and index the files
+        :param root_dir: root of the watched directory
+        :param doc_ids: relative path -> document id of the files that are already indexed
+        :param search: Search used to rescan the directory when inotify events are lost
+        """
+        self.crawler = crawler
+        self.root_dir = root_dir
+        self.doc_ids = doc_ids
+        self.search = search
+
+        self.inotify = Inotify()
+        self.watches = {}  # wd -> directory path
+        self.pending = {}  # path -> True if the file was created or modified, False if it was deleted
+        self.overflow = False
+
+    def run(self):
+
+        self.add_watches(self.root_dir)
+        print("Watching " + str(len(self.watches)) + " directories in " + self.root_dir)
+
+        first_event = None
+        last_event = None
+
+        while True:
+            now = time.time()
+
+            if self.process_events(config.watch_debounce):
+                last_event = time.time()
+                if first_event is None:
+                    first_event = now
+
+            if self.overflow:
+                self.rescan()
+                first_event = None
+            elif self.pending and (time.time() - last_event >= config.watch_debounce or
+                                   time.time() - first_event >= config.watch_max_delay):
+                self.flush()
+                first_event = None
+
+    def add_watches(self, path: str, scan: bool = False):
+        """
+        Watch a directory and all its sub-directories
+        :param path: directory to watch
+        :param scan: Mark the files that are already in the directory as changed
+        """
+
+        if path != self.root_dir and self.is_skipped_dir(path):
+            return
+
+        for root, dirs, files in os.walk(path):
+            try:
+                self.watches[self.inotify.add_watch(root)] = root
+            except OSError as e:
+                print("Couldn't watch directory: " + str(e))
+
+            dirs[:] = [d for d in dirs if not self.is_skipped_dir(os.path.join(root, d))]
+
+            if scan:
+                for filename in files:
+                    self.pending[os.path.join(root, filename)] = True
+
+    def is_skipped_dir(self, path: str) -> bool:
+        """Check if a directory is excluded from the crawls of the directory"""
+
+        if self.crawler.walk_filter is None:
+            return False
+
+        try:
+            return self.crawler.walk_filter.skip_dir(path, os.lstat(path))
+        except OSError:
+            return True
+
+    def remove_tree(self, path: str):
+        """Forget a directory that was moved or deleted"""
+
+        prefix = path + os.sep
+
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+        rel_prefix = os.path.relpath(path, self.root_dir) + os.sep
+        for rel_path in self.doc_ids:
+            if rel_path.startswith(rel_prefix):
+                self.pending[os.path.join(self.root_dir, rel_path)] = False
+
+    def process_events(self, timeout: float) -> bool:
+        """
+        Read and handle the pending inotify events
+        :param timeout: maximum time to wait for events, in seconds
+        :return: True if there were events
+        """
+
+        events = self.inotify.read_events(timeout)
+
+        for wd, mask, cookie, name in events:
+            self.handle_event(wd, mask, name)
+
+        return len(events) > 0
+
+    def handle_event(self, wd: int, mask: int, name: str):
+
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return
+
+        full_path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove_tree(full_path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(full_path, scan=True)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending[full_path] = False
+        else:
+            self.pending[full_path] = True
+
+    def flush(self):
+        """
+        Parse and index the files that changed, delete the documents of the files that were removed. If elasticsearch
+        fails, the changes are kept and indexed again at the next flush
+        """
+
+        pending = self.pending
+        self.pending = {}
+
+        outdated_docs = {}  # rel path -> doc id
+        docs = []
+        rel_paths = []
+
+        for full_path, changed in pending.items():
+            rel_path = os.path.relpath(full_path, self.root_dir)
+
+            doc_id = self.doc_ids.get(rel_path)
+            if doc_id is not None:
+                outdated_docs[rel_path] = doc_id
+
+            if changed and os.path.isfile(full_path):
+                try:
+                    file_stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if self.crawler.walk_filter is not None and self.crawler.walk_filter.skip_file(full_path, file_stat):
+                    continue
+
+                doc = self.crawler.parse_path(full_path, file_stat)
+                if doc is not None:
+                    docs.append(doc)
+                    rel_paths.append(rel_path)
+
+        try:
+            if outdated_docs:
+                self.crawler.indexer.delete(list(outdated_docs.values()))
+                for rel_path in outdated_docs:
+                    del self.doc_ids[rel_path]
+
+            if docs:
+                for rel_path, doc_id in zip(rel_paths, self.crawler.indexer.index(docs, self.crawler.dir_id)):
+                    self.doc_ids[rel_path] = doc_id
+        except Exception as e:
+            print("Couldn't index the changes in " + self.root_dir + ": " + str(e))
+            self.pending = pending
+
+    def rescan(self):
+        """Some events were lost, run an incremental crawl of the whole directory"""
+
+        self.overflow = False
+
+        if self.search is None:
+            print("inotify queue overflowed, some changes in " + self.root_dir + " were lost")
+            return
+
+        print("inotify queue overflowed, rescanning " + self.root_dir)
+        self.pending.clear()
+
+        self.crawler.known_files = self.search.get_file_states(self.crawler.dir_id)
+        self.crawler.outdated_docs = []
+        self.crawler.crawl(self.root_dir)
+
+        self.doc_ids = {rel_path: state["id"] for rel_path, state in
+                        self.search.get_file_states(self.crawler.dir_id).items()}